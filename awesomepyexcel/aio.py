@@ -0,0 +1,137 @@
+# coding: utf-8
+"""
+Формирование книг из источников данных, которые читаются одновременно с записью книги.
+Источники-итераторы (курсоры БД, генераторы) читаются в отдельных потоках:
+
+    book = create_book_threaded(OrdersBook, cursor, metadata=metadata)
+
+Строки передаются книге (Book.create и process_data) пачками по batch_size через очередь, в которой
+не больше max_batches пачек: если запись отстает, чтение данных приостанавливается.
+"""
+import Queue
+import threading
+
+BATCH_SIZE = 1000
+MAX_BATCHES = 4
+
+_END = object()
+
+
+class _Failure(object):
+    def __init__(self, error):
+        self.error = error
+
+
+class ThreadFeed(object):
+    """
+    Обычный итератор данных, который читается в отдельном потоке, пока книга записывает предыдущие строки.
+    Поток чтения ждет, пока в очереди не освободится место, поэтому в памяти не больше
+    max_batches + 1 пачек
+    """
+
+    def __init__(self, data, batch_size=BATCH_SIZE, max_batches=MAX_BATCHES):
+        self.iterator = iter(data)
+        self.batch_size = batch_size
+        self.queue = Queue.Queue(max_batches)
+        self.closed = False
+        self.thread = threading.Thread(target=self._read)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def __iter__(self):
+        while True:
+            item = self.queue.get()
+            if item is _END:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            for obj in item:
+                yield obj
+
+    def close(self):
+        """
+        Прекращает чтение данных (книга сформирована или ее формирование прервано)
+        """
+        self.closed = True
+
+    def _read(self):
+        batch = []
+        try:
+            for obj in self.iterator:
+                if self.closed:
+                    return
+                batch.append(obj)
+                if len(batch) >= self.batch_size:
+                    if not self._put(batch):
+                        return
+                    batch = []
+        except Exception as error:
+            self._put(_Failure(error))
+            return
+        if batch and not self._put(batch):
+            return
+        self._put(_END)
+
+    def _put(self, item):
+        """
+        :return: False, если чтение прекращено, пока пачка ждала места в очереди
+        """
+        while not self.closed:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+
+def _create_book(book_class, data, metadata):
+    return book_class(data, metadata=metadata)
+
+
+def _feed_sources(data, feed):
+    """
+    Заменяет источники данных книги результатом feed(source) - для словаря и кортежа источников
+    с теми же ключами
+    """
+    if isinstance(data, dict):
+        return dict((key, feed(source)) for key, source in data.items())
+    if isinstance(data, tuple):
+        return tuple(feed(source) for source in data)
+    return feed(data)
+
+
+def create_book_threaded(book_class, data, metadata=None, batch_size=BATCH_SIZE, max_batches=MAX_BATCHES):
+    """
+    Формирует книгу в текущем потоке, читая источники-итераторы в отдельных потоках.
+    :param book_class: класс книги (наследник Book)
+    :param data: данные отчета. Итераторы (iter(source) is source: генераторы, курсоры БД) читаются
+                 в отдельных потоках; для книг с несколькими источниками данных - словарь или кортеж,
+                 в process_data он придет с теми же ключами. Остальные данные передаются как есть
+    :param metadata: дополнительные данные об отчете (см. Book.__init__)
+    :param batch_size: строк в пачке
+    :param max_batches: пачек в очереди каждого источника
+    :return: книга
+    """
+    feeds = []
+
+    def feed(source):
+        try:
+            if iter(source) is not source:
+                return source
+        except TypeError:
+            return source
+        source_feed = ThreadFeed(source, batch_size, max_batches)
+        feeds.append(source_feed)
+        return source_feed
+
+    data = _feed_sources(data, feed)
+    for source_feed in feeds:
+        source_feed.start()
+    try:
+        return _create_book(book_class, data, metadata)
+    finally:
+        for source_feed in feeds:
+            source_feed.close()
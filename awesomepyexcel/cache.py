@@ -0,0 +1,298 @@
+# coding: utf-8
+"""
+Кэш готовых отчетов. Ключ кэша строится из описания книги (класс Book: заголовки, Field,
+стили, методы), metadata и отпечатка данных - значений ячеек, которые книга получит из данных
+(Field.get_accessor), поэтому одинаковый отчет по одинаковым данным отдается из кэша без обращения к xlwt.
+
+    cache = ReportCache(MemoryStore(max_size=100 * 1024 * 1024))
+    content = cache.get_bytes(OrdersBook, orders, metadata=form.cleaned_data)
+"""
+import collections
+import datetime
+import hashlib
+import os
+import tempfile
+import threading
+import types
+from decimal import Decimal
+
+import xlwt
+import xlwt.Formatting
+
+from awesomepyexcel.core import Book, Sheet
+
+# Меняется, когда меняется формат вывода библиотеки: записи старой версии становятся недоступны
+CACHE_VERSION = 1
+
+
+def _code_repr(code):
+    consts = tuple(_code_repr(const) if isinstance(const, types.CodeType) else repr(const)
+                   for const in code.co_consts)
+    return ('code', code.co_code, consts, code.co_names, code.co_varnames)
+
+
+def stable_repr(value, _seen=None):
+    """
+    Представление значения, одинаковое между запусками интерпретатора
+    (без адресов объектов). Приватные атрибуты объектов (начинающиеся с '_') не учитываются.
+    """
+    if value is None or isinstance(value, (bool, int, long, float, Decimal, basestring,
+                                           datetime.date, datetime.time, datetime.timedelta)):
+        return repr(value)
+    if _seen is None:
+        _seen = set()
+    if id(value) in _seen:
+        return 'recursion'
+    _seen = _seen | set([id(value)])
+    if isinstance(value, dict):
+        return '{%s}' % ', '.join(sorted('%s: %s' % (stable_repr(key, _seen), stable_repr(item, _seen))
+                                         for key, item in value.iteritems()))
+    if isinstance(value, (list, tuple)):
+        return '%s(%s)' % (type(value).__name__, ', '.join(stable_repr(item, _seen) for item in value))
+    if isinstance(value, (set, frozenset)):
+        return 'set(%s)' % ', '.join(sorted(stable_repr(item, _seen) for item in value))
+    if isinstance(value, (staticmethod, classmethod)):
+        return stable_repr(value.__func__, _seen)
+    if isinstance(value, property):
+        return 'property(%s, %s)' % (stable_repr(value.fget, _seen), stable_repr(value.fset, _seen))
+    if isinstance(value, types.MethodType):
+        return stable_repr(value.im_func, _seen)
+    if isinstance(value, types.FunctionType):
+        closure = [cell.cell_contents for cell in value.func_closure or ()]
+        return '%s.%s%r%s%s' % (value.__module__, value.__name__, _code_repr(value.func_code),
+                                stable_repr(value.func_defaults, _seen), stable_repr(closure, _seen))
+    if isinstance(value, types.BuiltinFunctionType):
+        return '%s.%s' % (value.__module__, value.__name__)
+    if isinstance(value, (type, types.ClassType)):
+        return '%s.%s' % (value.__module__, value.__name__)
+    if isinstance(value, xlwt.Formatting.Borders):
+        # при записи стиля xlwt обнуляет цвет сторон без линии (XFRecord), он не влияет на результат
+        attrs = dict(vars(value))
+        for side in ('left', 'right', 'top', 'bottom', 'diag'):
+            if attrs[side] == value.NO_LINE:
+                attrs[side + '_colour'] = 0
+        return 'Borders%s' % stable_repr(attrs, _seen)
+    if hasattr(value, '__dict__'):
+        return '%s.%s%s' % (type(value).__module__, type(value).__name__, stable_repr(
+            dict((name, attr) for name, attr in vars(value).iteritems() if not name.startswith('_')), _seen))
+    return repr(value)
+
+
+def class_fingerprint(klass, base):
+    """
+    Отпечаток класса: атрибуты и методы klass и его предков вплоть до base (включительно)
+    """
+    pieces = []
+    for mro_class in klass.__mro__:
+        pieces.append('%s.%s' % (mro_class.__module__, mro_class.__name__))
+        pieces.append(stable_repr(dict((name, attr) for name, attr in vars(mro_class).iteritems()
+                                       if not (name.startswith('__') and name.endswith('__')))))
+        if mro_class is base:
+            break
+    return '\n'.join(pieces)
+
+
+_book_fingerprints = {}
+
+
+def book_fingerprint(book_class):
+    """
+    Отпечаток класса книги вместе с классом листа. Считается один раз на класс
+    """
+    if book_class not in _book_fingerprints:
+        _book_fingerprints[book_class] = hashlib.sha1('\n'.join([
+            'version %s, xlwt %s' % (CACHE_VERSION, getattr(xlwt, '__VERSION__', '')),
+            class_fingerprint(book_class, Book),
+            class_fingerprint(book_class.sheet_class, Sheet),
+        ])).hexdigest()
+    return _book_fingerprints[book_class]
+
+
+def data_digest(objects, headers, key_name=None, digest=None):
+    """
+    Отпечаток данных отчета, считается по мере прохода по данным.
+    Учитываются значения ячеек колонок headers - те же, что получит лист (Field.get_accessor),
+    включая значения связанных объектов ('client__fio') и свойств. Данные, которые книга берет
+    в обход Field (например, в своем process_data), не учитываются - для таких книг отпечаток
+    нужно передавать в ReportCache.get_bytes явно.
+    :param objects: итерируемый объект с данными (словари или объекты)
+    :param headers: колонки книги (Book.headers)
+    :param key_name: название источника данных (см. Field.get_value)
+    :param digest: объект hashlib, который нужно дополнить. По умолчанию - новый sha1
+    :return: объект hashlib
+    """
+    digest = digest or hashlib.sha1()
+    accessors = [field.get_accessor(key_name) for field in headers if not (field.is_counter or field.row_formula)]
+    for obj in objects:
+        digest.update(stable_repr([accessor(obj) for accessor in accessors]))
+        digest.update('\n')
+    return digest
+
+
+class MemoryStore(object):
+    """
+    Хранилище в памяти, вытесняются давно не запрошенные отчеты
+    """
+
+    def __init__(self, max_size):
+        """
+        :param max_size: максимальный суммарный размер отчетов в байтах
+        """
+        self.max_size = max_size
+        self.size = 0
+        self.evictions = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            content = self._items.pop(key, None)
+            if content is not None:
+                self._items[key] = content
+            return content
+
+    def set(self, key, content):
+        if len(content) > self.max_size:
+            return
+        with self._lock:
+            old_content = self._items.pop(key, None)
+            if old_content is not None:
+                self.size -= len(old_content)
+            self._items[key] = content
+            self.size += len(content)
+            while self.size > self.max_size:
+                evicted_key, evicted_content = self._items.popitem(last=False)
+                self.size -= len(evicted_content)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._items)
+
+
+class DiskStore(object):
+    """
+    Хранилище в папке на диске: отчет - файл с именем по ключу. Давность использования
+    определяется по времени изменения файла, которое обновляется при каждом чтении.
+    """
+    SUFFIX = '.report'
+
+    def __init__(self, directory, max_size):
+        """
+        :param directory: папка для файлов кэша (создается, если ее нет)
+        :param max_size: максимальный суммарный размер файлов в байтах
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.max_size = max_size
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._items = collections.OrderedDict()  # ключ -> размер, от давно использованных к недавним
+        files = []
+        for file_name in os.listdir(directory):
+            if file_name.endswith(self.SUFFIX):
+                stat = os.stat(os.path.join(directory, file_name))
+                files.append((stat.st_mtime, file_name[:-len(self.SUFFIX)], stat.st_size))
+        for mtime, key, size in sorted(files):
+            self._items[key] = size
+        self.size = sum(self._items.itervalues())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            try:
+                with open(self._path(key), 'rb') as report_file:
+                    content = report_file.read()
+                os.utime(self._path(key), None)
+            except (IOError, OSError):
+                # файл удален снаружи
+                self.size -= self._items.pop(key)
+                return None
+            self._items[key] = self._items.pop(key)
+            return content
+
+    def set(self, key, content):
+        if len(content) > self.max_size:
+            return
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(content)
+        with self._lock:
+            os.rename(temp_path, self._path(key))
+            self.size -= self._items.pop(key, 0)
+            self._items[key] = len(content)
+            self.size += len(content)
+            while self.size > self.max_size:
+                evicted_key, evicted_size = self._items.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+                try:
+                    os.remove(self._path(evicted_key))
+                except OSError:
+                    pass
+
+    def __len__(self):
+        return len(self._items)
+
+
+class ReportCache(object):
+    """
+    Кэш файлов отчетов (содержимое .xls/.xlsx) поверх хранилища MemoryStore или DiskStore
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, book_class, metadata=None, digest=None):
+        """
+        :param digest: отпечаток данных (строка)
+        :return: ключ кэша
+        """
+        return hashlib.sha1('\n'.join([
+            book_fingerprint(book_class), stable_repr(metadata or {}), digest or ''])).hexdigest()
+
+    def get_bytes(self, book_class, data, metadata=None, digest=None):
+        """
+        Содержимое файла отчета: из кэша или, если его там нет, собранное заново.
+        :param book_class: класс книги (наследник Book)
+        :param data: итерируемый объект с данными отчета
+        :param metadata: дополнительные данные об отчете (см. Book.__init__)
+        :param digest: отпечаток данных, если он известен заранее (например, версия данных в БД).
+                       Если не задан, считается по значениям ячеек колонок книги (см. data_digest),
+                       data при этом читается в список. Значения ячеек тогда вычисляются дважды: для отпечатка
+                       и при формировании книги, поэтому для дорогих данных digest лучше передавать.
+                       Для книг с несколькими источниками данных (словарь источников, Field.keys) обязателен
+        :return: содержимое файла (str)
+        """
+        if digest is None:
+            if isinstance(data, dict) or any(field.keys and not field.key for field in book_class.headers):
+                raise ValueError(u'Отпечаток данных книги с несколькими источниками не вычисляется, нужен digest')
+            data = list(data)
+            digest = data_digest(data, book_class.headers).hexdigest()
+        key = self.get_key(book_class, metadata, digest)
+        content = self.store.get(key)
+        if content is not None:
+            self.hits += 1
+            return content
+        self.misses += 1
+        content = book_class(data, metadata=metadata).get_bytes()
+        self.store.set(key, content)
+        return content
+
+    def get_stats(self):
+        """
+        :return: словарь счетчиков: hits, misses, evictions, а также количество (count) и размер (size) отчетов
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.store.evictions,
+            'count': len(self.store),
+            'size': self.store.size,
+        }
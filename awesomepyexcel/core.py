@@ -1,7 +1,12 @@
 # coding: utf-8
+import collections
+import datetime
+import itertools
 import os
-import random
 import re
+import struct
+import tempfile
+from decimal import Decimal
 
 import xlrd
 import xlrd.sheet
@@ -9,18 +14,82 @@ import xlwt
 import xlwt.Workbook
 import xlwt.Cell
 
+from awesomepyexcel import xlsx
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 HEADER_HORIZONTAL = 'horizontal'
 HEADER_VERTICAL = 'vertical'
 HEADER_ORIENTATION = (HEADER_HORIZONTAL, HEADER_VERTICAL)
 
+BACKEND_XLS = 'xls'
+BACKEND_XLSX = 'xlsx'
+BACKENDS = (BACKEND_XLS, BACKEND_XLSX)
+
+
+def _percentile(values, percent):
+    """
+    Значение перцентиля percent (0-100) из списка values (ближайший ранг)
+    """
+    values = sorted(values)
+    index = int(round((len(values) - 1) * percent / 100.0))
+    return values[index]
+
+
+_COLUMN_REF_RE = re.compile(r'(\d+)col')
+
+
+def _formula_for_row(formula, row_number):
+    """
+    Формат формулы 2col/5col + 5 заменяем на B(row_number)/E(row_number) + 5
+    """
+    return _COLUMN_REF_RE.sub(lambda match: '%s%s' % (xlrd.colname(int(match.group(1))), row_number), formula)
+
+
+def _to_decimal(value):
+    if isinstance(value, float):
+        return Decimal(repr(value))
+    return Decimal(value)
+
+
+def _to_int(value):
+    """
+    Целое число без потери дробной части: 2.0 -> 2, 2.7 - ошибка
+    """
+    number = int(value)
+    if not isinstance(value, basestring) and number != value:
+        raise ValueError(u'%r - не целое число' % value)
+    return number
+
+
+def _formula_placeholder(obj):
+    """
+    Значение ячейки формулы строки для автоподбора размеров (сама формула пишется отдельно)
+    """
+    return u''
+
 
 class Field(object):
     WIDTH_AUTO = 'auto'
 
+    TYPE_INT = 'int'
+    TYPE_FLOAT = 'float'
+    TYPE_DECIMAL = 'decimal'
+    TYPE_DATE = 'date'
+    TYPE_DATETIME = 'datetime'
+    TYPE_TEXT = 'text'
+    TYPE_BOOL = 'bool'
+    VALUE_TYPES = (TYPE_INT, TYPE_FLOAT, TYPE_DECIMAL, TYPE_DATE, TYPE_DATETIME, TYPE_TEXT, TYPE_BOOL)
+
     class GetValueException(Exception): pass
 
     def __init__(self, verbose_name=None, key=None, keys=None, is_counter=False, width=WIDTH_AUTO, style=None,
-                 need_sum=False, need_count=False, need_average=False, empty_filler='', header_orientation=None, formula=False):
+                 need_sum=False, need_count=False, need_average=False, empty_filler='', header_orientation=None, formula=False,
+                 row_formula=None, cache_key=None, cache_size=1000, value_type=None, need_min=False, need_max=False,
+                 related_depth=None):
         """
         Описание колонки таблицы, того как она оформляется и заполняется.
         :param verbose_name: Название поля/атрибута/данных, которые подставляются в колонку.
@@ -39,16 +108,35 @@ class Field(object):
         :param is_counter: Является ли колонка счетчиком строк
         :param need_sum: флаг - нужно ли втсавлять формулу суммы под колонкой таблицы
         :param need_count: строковое значение - если указано, то будет использоваться формула COUNTIF с ним.
+                           True - формула COUNT (количество чисел в колонке)
         :param need_average: флаг - нужно ли втсавлять формулу среднего значения под колонкой таблицы
         :param empty_filler: заполнитель для пустой ячейки
         :param header_orientation: ориентация для заголовка - горизонтальный (HEADER_HORIZONTAL),
                              или вертикальный (HEADER_VERTICAL). Может быть не задан.
         :param formula: вставка формулы, в доступны значения ячеек той же строки
+        :param row_formula: формула, вычисляемая в каждой строке тела таблицы ('2col*3col'), ссылки Ncol
+                            указывают на ячейки колонки N той же строки. Данные для колонки не нужны (key не задается)
+        :param cache_key: функция cache_key(obj) -> ключ кеша значений колонки (например, id связанного объекта).
+                          Для строк с одинаковым ключом значение вычисляется один раз - для дорогих
+                          ключей-функций и вызываемых значений. Кеш общий для листов книги и очищается после Book.create
+        :param cache_size: сколько последних значений хранить в кеше (вытесняются давно не использованные),
+                           не меньше 1. None - без ограничения
+        :param value_type: тип значений колонки (Field.VALUE_TYPES). Значения приводятся к нему (целое без дробной части,
+                           float(value), Decimal(value), date/datetime, unicode(value), bool(value)) и пишутся
+                           без определения типа каждого значения. Не приводимое значение - ошибка с адресом ячейки
+        :param need_min: флаг - нужно ли вставлять формулу минимума под колонкой таблицы
+        :param need_max: флаг - нужно ли вставлять формулу максимума под колонкой таблицы
+        :param related_depth: сколько первых частей лукапа - связанные объекты, которые подгружаются
+                              пачками (Book.prefetch_chunk_size). По умолчанию - все, кроме последней
+                              ('client__city__name' - client и client__city). Для лукапов по значениям
+                              ('created__year') - 0 или число частей до значения ('client__created__year' - 1)
 
 
         """
         # assert key or keys Не работает в случае с is_counter Field-ом
         assert header_orientation is None or header_orientation in HEADER_ORIENTATION
+        assert value_type is None or value_type in self.VALUE_TYPES
+        assert cache_size is None or cache_size >= 1
         if need_sum and need_count:
             assert False
 
@@ -64,6 +152,15 @@ class Field(object):
         self.empty_filler = empty_filler
         self.header_orientation = header_orientation
         self.formula = formula
+        self.row_formula = row_formula
+        self.cache_key = cache_key
+        self.cache_size = cache_size
+        self.value_type = value_type
+        self.need_min = need_min
+        self.need_max = need_max
+        self.related_depth = related_depth
+        self._accessors = {}  # скомпилированные функции доступа к данным по key_name
+        self._key_accessors = {}  # то же, для ключей, переданных в get_value явно
 
     def get_value(self, obj, key_name=None, key=None):
         """
@@ -74,57 +171,516 @@ class Field(object):
         :param key: ключ для доступа к данным obj. Если не задан, будет определен автоматически из настроек Field
         :return: данные объекта obj по ключу key
         """
+        if key:
+            try:
+                accessor = self._key_accessors[key]
+            except KeyError:
+                accessor = self._key_accessors[key] = self._by_type(*self._compile_key(key))
+            return accessor(obj)
+        return self.get_accessor(key_name)(obj)
+
+    def get_accessor(self, key_name=None):
+        """
+        Возвращает скомпилированную функцию доступа к данным: accessor(obj) -> значение ячейки.
+        Ключ (обычный, лукап 'client__fio', функция или ключ из словаря keys) разбирается
+        один раз, результат кешируется на Field.
+        :param key_name: название источника данных (см. get_value)
+        """
+        try:
+            return self._accessors[key_name]
+        except KeyError:
+            pass
+        if self.row_formula:
+            # значение формулы вычисляет Excel, из данных строки ничего не берется
+            accessor = self._by_type(_formula_placeholder, _formula_placeholder)
+        else:
+            accessor = self._by_type(*self._compile_key(self.get_key(key_name)))
+        self._accessors[key_name] = accessor
+        return accessor
+
+    def get_footer_function(self):
+        """
+        Итоговая функция колонки (Sheet.FOOTER_FORMULAS): 'sum', 'average', 'min', 'max', 'count',
+        'countif' или None, если итога нет или он задан своей формулой (formula)
+        """
+        if self.formula:
+            return None
+        if self.need_sum:
+            return 'sum'
+        if self.need_average:
+            return 'average'
+        if self.need_min:
+            return 'min'
+        if self.need_max:
+            return 'max'
+        if self.need_count is True:
+            return 'count'
+        if self.need_count:
+            return 'countif'
+        return None
+
+    def get_key(self, key_name=None):
+        """
+        Ключ доступа к данным источника key_name (см. get_value)
+        """
+        if key_name:
+            return self.keys[key_name]
+        return self.key
+
+    def get_lookup_path(self, key_name=None):
+        """
+        Путь лукапа ключа источника key_name: ('client', 'fio') для 'client__fio'.
+        :return: кортеж частей ключа или None, если данные берутся не по строковому ключу
+                 (ключ-функция, счетчик, формула строки)
+        """
+        if self.is_counter or self.row_formula:
+            return None
+        key = self.get_key(key_name)
+        if not key or not isinstance(key, basestring):
+            return None
+        return tuple(key.split('__'))
+
+    def get_related_paths(self, key_name=None):
+        """
+        Пути связанных объектов лукапа источника key_name (см. related_depth):
+        ['client', 'client__city'] для 'client__city__name'
+        """
+        path = self.get_lookup_path(key_name)
+        if path is None:
+            return []
+        depth = len(path) - 1 if self.related_depth is None else min(self.related_depth, len(path) - 1)
+        return ['__'.join(path[:length]) for length in range(1, depth + 1)]
+
+    def _compile_key(self, key):
+        """
+        Собирает пару функций доступа к данным по ключу key: для словаря и для объекта.
+        """
+        empty_filler = self.empty_filler
+
         if not key:
-            if key_name:
-                key = self.keys[key_name]
-            elif self.key:
-                key = self.key
-            if not key:
+            def from_object(obj):
                 raise self.GetValueException(u'Не удалось получить ключ (key) для доступа к объекту "%s"' % obj)
-
-        if isinstance(obj, dict) and key in obj:
-            return obj[key]
+            return from_object, from_object
 
         if isinstance(key, basestring):
-            # ищем по лукапу
             if '__' in key:
-                key_parts = key.split('__')
+                return self._compile_lookup(key.split('__'))
+
+            def from_dict(obj):
+                # значение из словаря отдаем как есть, отсутствующий ключ - заполнитель
+                return obj.get(key, empty_filler)
+
+            def from_object(obj):
+                try:
+                    value = getattr(obj, key)
+                except Exception:
+                    value = empty_filler
+                if value is None:
+                    return empty_filler
+                if hasattr(value, '__call__'):
+                    value = value()
+                    if value is None:
+                        return empty_filler
+                return value
+            return from_dict, from_object
 
-                attr_name = key_parts[0]
-                obj_attr = self.get_value(obj, key=attr_name)
+        # ключ генерит функция
+        if hasattr(key, '__call__'):
+            def from_dict(obj):
+                if key in obj:
+                    return obj[key]
+                return from_object(obj)
+
+            def from_object(obj):
+                value = key(obj)
+                if value is None:
+                    return empty_filler
+                if hasattr(value, '__call__'):
+                    value = value()
+                    if value is None:
+                        return empty_filler
+                return value
+            return from_dict, from_object
+
+        def from_object(obj):
+            raise self.GetValueException(
+                u'Не смог получить значения для объекта "%s" по ключу "%s"' % (obj, key)
+            )
+        return from_object, from_object
 
-                if obj_attr:
-                    look_up_key = '__'.join(key_parts[1:])
-                    value = self.get_value(obj_attr, key=look_up_key)
-                else:
-                    value = None
+    def _compile_lookup(self, key_parts):
+        """
+        Лукап 'client__fio': берем значение по первой части ключа,
+        и если оно непустое - продолжаем по оставшейся части.
+        """
+        if len(key_parts) == 1:
+            return self._compile_key(key_parts[0])
+
+        empty_filler = self.empty_filler
+        full_key = '__'.join(key_parts)
+        head_key = key_parts[0]
+        tail = self._by_type(*self._compile_lookup(key_parts[1:]))
+
+        def finish(obj_attr):
+            if not obj_attr:
+                return empty_filler
+            value = tail(obj_attr)
+            if value is None:
+                return empty_filler
+            if hasattr(value, '__call__'):
+                value = value()
+                if value is None:
+                    return empty_filler
+            return value
+
+        def from_dict(obj):
+            if full_key in obj:
+                return obj[full_key]
+            return finish(obj.get(head_key, empty_filler))
+
+        def from_object(obj):
+            try:
+                obj_attr = getattr(obj, head_key)
+            except Exception:
+                obj_attr = empty_filler
+            if hasattr(obj_attr, '__call__'):
+                obj_attr = obj_attr()
+            if obj_attr is None:
+                obj_attr = empty_filler
+            return finish(obj_attr)
+        return from_dict, from_object
+
+    @staticmethod
+    def _by_type(from_dict, from_object):
+        """
+        Выбор функции доступа по типу объекта. Решение кешируется для каждого типа,
+        так что строки-словари и строки-объекты не проходят isinstance на каждой ячейке.
+        accessor.for_type(obj_type) отдает функцию доступа для конкретного типа напрямую.
+        """
+        getters = {}
 
-            # данные из словаря
-            elif isinstance(obj, dict):
-                value = obj.get(key)
+        def for_type(obj_type):
+            getter = getters.get(obj_type)
+            if getter is None:
+                getter = getters[obj_type] = from_dict if issubclass(obj_type, dict) else from_object
+            return getter
 
-            # данные из атрибута объекта
-            elif hasattr(obj, key):
-                value = getattr(obj, key)
+        def accessor(obj):
+            return for_type(type(obj))(obj)
+        accessor.for_type = for_type
+        return accessor
 
-            else:
-                value = self.empty_filler
 
-        # ключ генерит функция
-        elif hasattr(key, '__call__'):
-            value = key(obj)
+class _FieldCache(object):
+    """
+    Кеш значений колонки (Field.cache_key) с вытеснением давно не использованных значений
+    """
 
-        else:
-            raise self.GetValueException(
-                u'Не смог получить значения для объекта "%s" по ключу "%s"' % (obj, key)
-            )
+    def __init__(self, cache_key, size):
+        self.cache_key = cache_key
+        self.size = size
+        self.values = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
 
-        # если в качестве значени получили функцию, вызовем ее для получения значения ячейки
-        if hasattr(value, '__call__'):
-            value = value()
-        if value is None:
-            return self.empty_filler
-        return value
+    def wrap_getter(self, getter):
+        """
+        Функция доступа к данным колонки, берущая значение из кеша по ключу cache_key(obj)
+        """
+        cache_key, size, values = self.cache_key, self.size, self.values
+
+        def cached_getter(obj):
+            key = cache_key(obj)
+            try:
+                value = values.pop(key)
+            except KeyError:
+                self.misses += 1
+                value = getter(obj)
+                if size is not None and len(values) >= size:
+                    values.popitem(last=False)
+            else:
+                self.hits += 1
+            values[key] = value
+            return value
+        return cached_getter
+
+    def clear(self):
+        self.values.clear()
+
+    def get_hit_rate(self):
+        calls = self.hits + self.misses
+        if not calls:
+            return 0.0
+        return float(self.hits) / calls
+
+
+def _make_countif_matcher(condition):
+    """
+    Проверка значения на условие COUNTIF: '>0', '<>5', 'да', '=', 'Иван*' (* и ? - шаблоны, регистр не важен)
+    """
+    match = re.match(r'(<=|>=|<>|<|>|=)?(.*)$', unicode(condition), re.S)
+    operator_, operand = match.group(1) or '=', match.group(2)
+    compare = {'=': lambda a, b: a == b, '<>': lambda a, b: a != b, '<': lambda a, b: a < b,
+               '>': lambda a, b: a > b, '<=': lambda a, b: a <= b, '>=': lambda a, b: a >= b}[operator_]
+    try:
+        number = float(operand)
+    except ValueError:
+        number = None
+
+    if number is not None:
+        def matcher(value):
+            if type(value) in _NUMBER_TYPES:
+                return compare(value, number)
+            return operator_ == '<>'
+        return matcher
+
+    if not operand:
+        # '=' - пустые ячейки, '<>' - непустые
+        def matcher(value):
+            return compare(value is None or value == '', True)
+        return matcher
+
+    pattern = re.compile(u''.join('.*' if char == '*' else '.' if char == '?' else re.escape(char)
+                                  for char in operand) + u'$', re.I | re.U | re.S)
+    if operator_ in ('=', '<>'):
+        def matcher(value):
+            return isinstance(value, basestring) and compare(pattern.match(value) is not None, True)
+    else:
+        operand = operand.lower()
+
+        def matcher(value):
+            return isinstance(value, basestring) and compare(value.lower(), operand)
+    return matcher
+
+
+_NUMBER_TYPES = frozenset([int, long, float, Decimal])
+
+_NO_GROUP = object()  # значение группы до первой строки: не равно никакому ключу, в том числе None
+
+
+class _Aggregate(object):
+    """
+    Итоги колонки, которые накапливаются по значениям строк при записи, без хранения самих значений.
+    Числа - как у функций Excel: логические значения, строки и пустые ячейки не учитываются.
+    Значения формул (xlwt.Formula) при записи не известны - итог по колонке с ними не вычисляется
+    """
+    __slots__ = ['count', 'total', 'minimum', 'maximum', 'matches', 'match', 'has_formulas']
+
+    def __init__(self, match=None):
+        self.match = match
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = None
+        self.matches = 0
+        self.has_formulas = False
+
+    def add(self, value):
+        if type(value) in _NUMBER_TYPES:
+            if type(value) is Decimal:
+                value = float(value)
+            self.count += 1
+            self.total += value
+            if self.minimum is None or value < self.minimum:
+                self.minimum = value
+            if self.maximum is None or value > self.maximum:
+                self.maximum = value
+        elif isinstance(value, xlwt.Formula):
+            self.has_formulas = True
+        if self.match is not None and self.match(value):
+            self.matches += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        for value in (other.minimum, other.maximum):
+            if value is not None:
+                self.minimum = value if self.minimum is None else min(self.minimum, value)
+                self.maximum = value if self.maximum is None else max(self.maximum, value)
+        self.matches += other.matches
+        self.has_formulas = self.has_formulas or other.has_formulas
+
+    def get_value(self, function):
+        """
+        Значение итоговой функции или None, если Excel вернет ошибку (среднее пустой колонки)
+        или значение не известно (в колонке есть формулы)
+        """
+        if self.has_formulas:
+            return None
+        if function == 'sum':
+            return self.total
+        if function == 'average':
+            return round(self.total / float(self.count), 0) if self.count else None
+        if function == 'min':
+            return self.minimum or 0
+        if function == 'max':
+            return self.maximum or 0
+        if function == 'count':
+            return self.count
+        return self.matches
+
+
+class _CachedFormulaCell(xlwt.Cell.FormulaCell):
+    """
+    Ячейка формулы с уже вычисленным значением: оно видно до пересчета книги (и программам,
+    которые формулы не считают)
+    """
+    __slots__ = ['value']
+
+    def __init__(self, rowx, colx, xf_idx, frmla, value):
+        super(_CachedFormulaCell, self).__init__(rowx, colx, xf_idx, frmla)
+        self.value = value
+
+    def get_biff_data(self):
+        data = struct.pack('<3HdHL', self.rowx, self.colx, self.xf_idx, self.value, self.calc_flags & 3, 0)
+        data += self.frmla.rpn()
+        return struct.pack('<2H', 0x0006, len(data)) + data
+
+
+class _BiffCells(object):
+    """
+    Уже закодированные BIFF-записи ячеек строки. Занимает первую колонку диапазона,
+    остальные колонки диапазона в строке xlwt заняты None (как у MulBlankCell).
+    """
+    __slots__ = ['biff_data']
+
+    def __init__(self, biff_data):
+        self.biff_data = biff_data
+
+    def get_biff_data(self):
+        return self.biff_data
+
+
+class _RowFormula(object):
+    """
+    Формула колонки тела таблицы (Field.row_formula), разобранная парсером xlwt один раз на лист.
+    Ссылки Ncol указывают на текущую строку, поэтому в токенах RPN от строки к строке меняются
+    только номера строк в этих ссылках: запись FORMULA для строки собирается из готовых частей.
+    """
+    RECORD_HEADER = struct.Struct('<2H3HQHLH')  # заголовок записи FORMULA и длина RPN
+    RECORD_ID = 0x0006
+    MAX_RECORD_SIZE = 0x2020  # длиннее - запись делится на CONTINUE, такие формулы пишет xlwt
+
+    def __init__(self, book, text):
+        self.book = book
+        self.text = text
+        # номера строк в RPN - места, где отличаются формулы, разобранные для двух разных строк
+        first, second = self._get_rpn(0), self._get_rpn(1)
+        offsets = [i for i in xrange(len(first)) if first[i] != second[i]]
+        self.parts = None
+        if len(first) == len(second) and all(first[i:i + 2] == '\x00\x00' for i in offsets):
+            parts = []
+            start = 0
+            for offset in offsets:
+                parts.append(first[start:offset])
+                start = offset + 2
+            parts.append(first[start:])
+            self.record_size = self.RECORD_HEADER.size - 4 + len(first)
+            # проверка на строке, номер которой не помещается в один байт
+            if (self.record_size <= self.MAX_RECORD_SIZE and
+                    struct.pack('<H', 0x0102).join(parts) == self._get_rpn(0x0102)):
+                self.parts = parts
+                self.rpn_size = len(first)
+
+    def _get_rpn(self, row_i):
+        formula = xlwt.Formula(_formula_for_row(self.text, row_i + 1))
+        self.book.add_sheet_reference(formula)  # ссылки на другие листы
+        return formula.rpn()[2:]
+
+    def make_cell(self, row_i, col_i, xf_index):
+        if self.parts is None:
+            # формула не сводится к подстановке номера строки (например, "1col" в строковом литерале)
+            formula = xlwt.Formula(_formula_for_row(self.text, row_i + 1))
+            self.book.add_sheet_reference(formula)
+            return xlwt.Cell.FormulaCell(row_i, col_i, xf_index, formula)
+        return _BiffCells(self.RECORD_HEADER.pack(
+            self.RECORD_ID, self.record_size, row_i, col_i, xf_index, 0xFFFF000000000003, 0, 0, self.rpn_size
+        ) + struct.pack('<H', row_i).join(self.parts))
+
+
+class _HeaderTemplate(object):
+    """
+    Снимок шапки листа (ширины колонок, объединения, ячейки шапки таблицы и верхней части, логотип),
+    снятый после первого write_header. Применяется к новым листам того же вида, ячейки
+    записываются заново, чтобы стили и строки попали в таблицы своей книги.
+    """
+    COLUMN_ATTRS = ('width', 'hidden', 'level', 'collapse', 'user_set', 'best_fit', 'unused')
+    ROW_ATTRS = ('height', 'has_default_height', 'height_mismatch', 'level', 'collapse', 'hidden',
+                 'space_above', 'space_below')
+
+    def __init__(self, sheet):
+        book = sheet.parent
+        styles = self._get_styles(book)
+        strings = dict((index, value) for value, index in book._Workbook__sst._str_indexes.iteritems())
+        self.columns = [(colx, [getattr(column, attr) for attr in self.COLUMN_ATTRS])
+                        for colx, column in sorted(sheet.get_cols().iteritems())]
+        self.rows = []
+        for rowx, row in sorted(sheet.get_rows().iteritems()):
+            cells = []  # (колонка, последняя колонка для диапазона пустых ячеек или None, значение, стиль)
+            for colx, cell in sorted(row._Row__cells.iteritems()):
+                if cell is None:
+                    continue
+                cell_class = type(cell)
+                if cell_class is xlwt.Cell.StrCell:
+                    cells.append((colx, None, strings[cell.sst_idx], styles[cell.xf_idx]))
+                elif cell_class is xlwt.Cell.NumberCell:
+                    cells.append((colx, None, cell.number, styles[cell.xf_idx]))
+                elif cell_class is xlwt.Cell.BlankCell:
+                    cells.append((colx, None, None, styles[cell.xf_idx]))
+                elif cell_class is xlwt.Cell.MulBlankCell:
+                    cells.append((cell.colx1, cell.colx2, None, styles[cell.xf_idx]))
+                else:
+                    raise sheet.WriteSheetException(u'Ячейка %r не поддерживается в шаблоне шапки' % cell)
+            self.rows.append((rowx, [getattr(row, attr) for attr in self.ROW_ATTRS], cells))
+        self.merged_ranges = list(sheet.get_merged_ranges())
+        self.images = sheet._get_images_state()
+        self.current_row_i = sheet.current_row_i
+        self.data_start_row_i = sheet._data_start_row_i
+
+    @staticmethod
+    def _get_styles(book):
+        """
+        :return: {индекс XF: стиль}. xlwt хранит не сами стили, а их составные части, стили собираются заново
+        """
+        style_collection = book._Workbook__styles
+        fonts = dict((font_index, font) for font, font_index in style_collection._font_id2x.iteritems())
+        num_formats = dict((index, num_format) for num_format, index in style_collection._num_formats.iteritems())
+        styles = {}
+        for xf, xf_index in style_collection._xf_id2x.iteritems():
+            font_index, num_format_index, alignment, borders, pattern, protection = xf
+            style = xlwt.XFStyle()
+            style.font = fonts[font_index]
+            style.num_format_str = num_formats[num_format_index]
+            style.alignment, style.borders, style.pattern, style.protection = alignment, borders, pattern, protection
+            styles[xf_index] = style
+        return styles
+
+    def apply(self, sheet):
+        for colx, values in self.columns:
+            column = sheet.col(colx)
+            for attr, value in zip(self.COLUMN_ATTRS, values):
+                setattr(column, attr, value)
+        for rowx, values, cells in self.rows:
+            row = sheet.row(rowx)
+            for first_colx, last_colx, value, style in cells:
+                if last_colx is not None:
+                    row.write_blanks(first_colx, last_colx, style)
+                else:
+                    row.write(first_colx, value, style)
+            for attr, value in zip(self.ROW_ATTRS, values):
+                setattr(row, attr, value)
+        sheet.get_merged_ranges().extend(self.merged_ranges)
+        sheet._set_images_state(self.images)
+        sheet.current_row_i = self.current_row_i
+        sheet._data_start_row_i = self.data_start_row_i
+
+
+# Шаблоны шапок: (класс листа, ключ шаблона) -> _HeaderTemplate
+_header_templates = {}
+HEADER_TEMPLATES_LIMIT = 100
 
 
 class Sheet(xlwt.Worksheet):
@@ -143,8 +699,11 @@ class Sheet(xlwt.Worksheet):
     ONE_LETTER_WIDTH = 350  # Ширина одной буквы в горизонтальной ориентации
     AUTO_COLUMN_WIDTH = 2938  # примерное значение ширины столбца, которое создает xlwt по умолчанию
     MIN_TITLE_WIDTH = 21000  # Минимальная ширина для title
+    MAX_AUTO_COL_WIDTH = 15000  # Максимальная ширина столбца при автоподборе по данным
     max_lines_in_row = 10
     COEFF = 36.72  # Коэффициент соответствия width и 36.72 px
+    max_rows = 65536  # строк на листе .xls, дальше таблица продолжается на новом листе
+    signature_rows = 0  # строк под подпись (write_signature), они оставляются на каждом листе таблицы
 
     title_style = xlwt.easyxf(
         'font: height 300, name Times New Roman, bold True;'
@@ -165,6 +724,17 @@ class Sheet(xlwt.Worksheet):
         'alignment: wrap on;'
         'borders: left thin, right thin, top thin, bottom thin;'
     )
+    # Формулы итогов колонок (Field.get_footer_function) по диапазону: без групп и с промежуточными
+    # итогами групп - SUBTOTAL не учитывает ячейки других SUBTOTAL в диапазоне
+    FOOTER_FORMULAS = {
+        'sum': (u'SUM(%s)', u'SUBTOTAL(9;%s)'),
+        'average': (u'ROUND(AVERAGE(%s);0)', u'ROUND(SUBTOTAL(1;%s);0)'),
+        'min': (u'MIN(%s)', u'SUBTOTAL(5;%s)'),
+        'max': (u'MAX(%s)', u'SUBTOTAL(4;%s)'),
+        'count': (u'COUNT(%s)', u'SUBTOTAL(2;%s)'),
+    }
+    subtotal_label = u'Итого: %s'  # подпись строки промежуточного итога в колонке группы
+
     signature_style = xlwt.easyxf(
         'align:  horiz center;'
         'alignment: wrap on;'
@@ -180,6 +750,20 @@ class Sheet(xlwt.Worksheet):
         super(Sheet, self).__init__(*args, **kwargs)
         self.current_row_i = 0  # Индекс строки, в которую ведется запись
         self._data_start_row_i = 0  #  Индекс строки, с которой наинается содержимое таблицы
+        self._column_styles = None  # [(стиль, индекс XF в книге)] для колонок тела таблицы
+        self._row_formulas = None  # [(номер колонки, формула строки)] для колонок с Field.row_formula
+        self._typed_writers = None  # {номер колонки: функция записи} для колонок с Field.value_type
+        self._aggregates = None  # [(номер колонки, итоговая функция, _Aggregate или None)] для итогов под таблицей
+        self._aggregated_rows = 0  # строк тела таблицы, прошедших через накопители итогов
+        self._subtotal_rows = 0  # строк промежуточных итогов групп (Book.group_by)
+        self._group_aggregates = None  # [(номер колонки, функция, _Aggregate группы или None, итог таблицы)]
+        self._group_value = _NO_GROUP  # ключ открытой группы
+        self._group_first_row_i = None  # индекс первой строки открытой группы или None, если группы нет
+        self._page_rows = 0  # строк данных тела таблицы на листе (для Book.page_size)
+        self._footer_row_i = None  # индекс итоговой строки под таблицей, когда она записана
+        self.first_page = self  # первый лист таблицы, продолженной на нескольких листах
+        self.next_sheet = None  # лист, на котором продолжается таблица, когда этот лист заполнен
+        self.page_number = 1  # номер листа таблицы, начиная с 1
         self.calculate_max_count_char_in_vertical_line()
 
     def calculate_max_count_char_in_vertical_line(self):
@@ -189,19 +773,54 @@ class Sheet(xlwt.Worksheet):
         raise NotImplementedError()
 
     def write_header(self):
+        if self.parent.use_header_template and self.current_row_i == 0 and not self.get_rows():
+            key = self._get_header_template_key()
+            template = _header_templates.get(key)
+            if template is not None:
+                template.apply(self)
+                return
+            self._write_header()
+            if len(_header_templates) >= HEADER_TEMPLATES_LIMIT:
+                _header_templates.clear()
+            _header_templates[key] = _HeaderTemplate(self)
+        else:
+            self._write_header()
+
+    def _write_header(self):
         self._set_cols_widths()
         if self.parent.need_top_part:
             self._write_top_part()
         self._write_table_header()
 
+    def _get_header_template_key(self):
+        """
+        Все, от чего зависит шапка листа. При изменении заголовков таблицы, названия отчета
+        или файла логотипа ключ меняется, и шаблон шапки строится заново. Кеш шаблонов живет
+        все время процесса, поэтому в ключе только значения, а не id() объектов: после сборки
+        мусора id достается новому объекту, и по нему нашлась бы чужая шапка.
+        """
+        parent = self.parent
+        headers_key = tuple((field.verbose_name, field.width, field.is_counter, field.header_orientation)
+                            for field in parent.headers)
+        top_part_key = None
+        if parent.need_top_part:
+            logo_path = self.get_logo_path()
+            logo_mtime = os.path.getmtime(logo_path) if os.path.isfile(logo_path) else None
+            top_part_key = (self.get_title(), parent.subscription, logo_path, logo_mtime)
+        return (type(self), headers_key, parent.header_orientation, parent.header_height,
+                parent.is_set_header_row_height, top_part_key)
+
+    def _get_images_state(self):
+        return self._Worksheet__bmp_rec
+
+    def _set_images_state(self, state):
+        self._Worksheet__bmp_rec = state
+
     def _parse_formula(self, formula):
         """Формат формулы 2col/5col + 5 заменяем на
            B(current_row)/E(current_row) + 5
         """
-        for column_text, col_number in re.findall(r'((\d+)col)', formula):
-            letter = xlrd.colname(int(col_number))
-            formula = formula.replace(column_text, '%s%s' % (letter, self.current_row_i+1))
-        return formula
+        return _formula_for_row(formula, self.current_row_i + 1)
 
     def write_table_body(self, objects, key_name=None):
         """
@@ -209,32 +828,747 @@ class Sheet(xlwt.Worksheet):
         :param objects:
         :param key_name:
         """
+        if self.parent.prefetch_chunk_size:
+            objects = self.parent.iter_prefetched(objects, key_name)
+        if self.parent.stats is not None:
+            objects = self.parent.stats.iter_data(objects)
+        self._write_rows_values(self._iter_rows_values(objects, key_name))
+
+    def _write_rows_values(self, rows_values):
+        """
+        Пишет строки тела таблицы по уже полученным значениям ячеек
+        (с автоподбором размеров, если он включен). Когда лист заполняется (max_rows или Book.page_size),
+        таблица продолжается на новом листе - за один проход по rows_values
+        :param rows_values: итерируемый объект со списками значений ячеек строк
+        """
+        sheet = self
+        while sheet.next_sheet is not None:
+            sheet = sheet.next_sheet
+        rows_values = iter(rows_values)
+        pending = []  # строки, прочитанные для заполненного листа, но не поместившиеся на него
+        while True:
+            pending = sheet._write_page_rows(itertools.chain(pending, rows_values))
+            if not sheet._is_page_full():
+                break
+            if not pending:
+                values = next(rows_values, None)
+                if values is None:
+                    break
+                pending = [values]
+            sheet = sheet._roll_over()
+        sheet._close_group()
+
+    def _write_page_rows(self, rows_values):
+        """
+        Пишет строки тела таблицы, пока лист не заполнится
+        :return: список строк, прочитанных из rows_values, но не записанных
+        """
+        sample_size = self.parent.auto_fit_sample_size
+        if sample_size:
+            sample = list(itertools.islice(rows_values, sample_size))
+            row_height = self._auto_fit(sample)
+            sample_values = iter(sample)
+            self._write_rows(sample_values)
+            self._write_rows(rows_values, row_height=row_height)
+            return list(sample_values)
+        self._write_rows(rows_values)
+        return []
+
+    def _get_body_end_row_i(self):
+        """
+        Индекс строки, на которой тело таблицы заканчивается: ниже остаются итоговая строка и подпись
+        """
+        end_row_i = self.max_rows - 1
+        if self.parent.need_signature:
+            end_row_i -= self.signature_rows
+        if self.parent.group_by is not None:
+            # строка данных может потребовать итог предыдущей группы, и последняя группа листа - свой итог
+            end_row_i -= 2
+        return end_row_i
+
+    def _is_page_full(self):
+        page_size = self.parent.page_size
+        return self.current_row_i >= self._get_body_end_row_i() or bool(page_size and self._page_rows >= page_size)
+
+    def _roll_over(self):
+        """
+        Закрывает заполненный лист итоговой строкой и продолжает таблицу на новом листе с той же шапкой
+        :return: новый лист
+        """
+        self._close_group()
+        self._write_page_footer()
+        page_number = self.page_number + 1
+        sheet = self.parent.add_sheet(self.parent.get_page_sheet_name(self.first_page.name, page_number))
+        sheet.first_page = self.first_page
+        sheet.page_number = page_number
+        sheet.write_header()
+        self.next_sheet = sheet
+        return sheet
+
+    def get_pages(self):
+        """
+        Листы таблицы, начиная с этого: сам лист и листы-продолжения
+        """
+        pages = [self]
+        while pages[-1].next_sheet is not None:
+            pages.append(pages[-1].next_sheet)
+        return pages
+
+    def _iter_rows_values(self, objects, key_name=None):
+        """
+        Значения ячеек для каждой строки тела таблицы
+        """
+        headers = self.parent.headers
+        stats = self.parent.stats
+        accessors = [None if field.is_counter else field.get_accessor(key_name) for field in headers]
+        caches = [field.cache_key and self.parent.get_field_cache(field, key_name) for field in headers]
+        if not any(caches):
+            caches = None
+        getters, obj_type = None, None
         for counter, obj in enumerate(objects, start=1):
-            max_height = 0
+            if type(obj) is not obj_type:
+                # функции доступа подбираются один раз на тип строки данных
+                obj_type = type(obj)
+                getters = [accessor and accessor.for_type(obj_type) for accessor in accessors]
+                if stats is not None:
+                    getters = [getter and stats.wrap_getter(col_i, headers[col_i], getter)
+                               for col_i, getter in enumerate(getters)]
+                if caches is not None:
+                    getters = [cache.wrap_getter(getter) if cache and getter else getter
+                               for getter, cache in zip(getters, caches)]
+            yield [counter if getter is None else getter(obj) for getter in getters]
+
+    def _write_rows(self, rows_values, row_height=None):
+        """
+        Пишет строки тела таблицы.
+        :param rows_values: итерируемый объект со списками значений ячеек строк
+        :param row_height: высота строк, если она уже известна (при calculate_row_heights).
+                           Если не задана - считается по значениям каждой строки
+        """
+        column_styles = self._get_column_styles()
+        # высота строки xlwt подстраивается под самый крупный шрифт из стилей колонок
+        height_style = max([style for style, xf_index in column_styles] or [self.table_style],
+                           key=lambda style: style.font.height)
+        last_col_i = len(self.parent.headers) - 1
+        write_cell = self._write_cell
+        constant_row_height = self.parent.constant_row_height
+        calculate_row_heights = self.parent.calculate_row_heights
+        chunk_size = self._get_streaming_chunk_size()
+        calc_row_height, flush_row_data = self._calc_row_height, self.flush_row_data
+        if self.parent.stats is not None:
+            calc_row_height = self.parent.stats.timed('row_heights', calc_row_height)
+            flush_row_data = self.parent.stats.timed('flush_row_data', flush_row_data)
+        row_formulas = [(col_i, formula, column_styles[col_i][1]) for col_i, formula in self._get_row_formulas()]
+        aggregates = self._get_aggregates()
+        group_col_i = self._get_group_col_i()
+        if group_col_i is None:
+            row_aggregates = [(col_i, aggregate) for col_i, function, aggregate in aggregates if aggregate is not None]
+        else:
+            # строки копятся в итогах группы, в итоги таблицы они переносятся при закрытии группы
+            row_aggregates = [(col_i, aggregate) for col_i, function, aggregate, total in self._get_group_aggregates()
+                              if aggregate is not None]
+        rows_count = 0
+        if self._is_page_full():
+            return
+        body_end_row_i = self._get_body_end_row_i()
+        page_size = self.parent.page_size
+        rows_left = page_size - self._page_rows if page_size else None
+        typed_writers = self._get_typed_writers()
+        value_cols = None  # колонки, которые пишутся не общим _write_cell
+        if row_formulas or typed_writers:
+            # в итоги колонок с value_type идут значения, приведенные к типу колонки
+            typed_adds = dict((col_i, aggregate.add) for col_i, aggregate in row_aggregates if col_i in typed_writers)
+            row_aggregates = [(col_i, aggregate) for col_i, aggregate in row_aggregates if col_i not in typed_adds]
+            value_cols = [(col_i, typed_writers.get(col_i)) + column_styles[col_i] + (typed_adds.get(col_i),)
+                          for col_i, field in enumerate(self.parent.headers) if not field.row_formula]
+        for rows_count, values in enumerate(rows_values, start=1):
+            if group_col_i is not None and values[group_col_i] != self._group_value:
+                self._close_group()
+                self._group_value, self._group_first_row_i = values[group_col_i], self.current_row_i
+            row = self.row(self.current_row_i)
+            row._Row__adjust_height(height_style)
+            row._Row__adjust_bound_col_idx(0, last_col_i)
+            if value_cols is not None:
+                for col_i, typed_writer, style, xf_index, add in value_cols:
+                    if typed_writer is None:
+                        write_cell(row, col_i, values[col_i], xf_index, style)
+                    elif add is None:
+                        typed_writer(row, self.current_row_i, values[col_i])
+                    else:
+                        add(typed_writer(row, self.current_row_i, values[col_i]))
+                cells = row._Row__cells
+                for col_i, formula, xf_index in row_formulas:
+                    cells[col_i] = formula.make_cell(self.current_row_i, col_i, xf_index)
+            else:
+                for col_i, value in enumerate(values):
+                    style, xf_index = column_styles[col_i]
+                    write_cell(row, col_i, value, xf_index, style)
+            for col_i, aggregate in row_aggregates:
+                aggregate.add(values[col_i])
+
+            if constant_row_height:
+                row.height = constant_row_height
+            elif calculate_row_heights:
+                row.height = calc_row_height(values) if row_height is None else row_height
+
+            self.current_row_i += 1
+            if chunk_size and rows_count % chunk_size == 0:
+                flush_row_data()
+            if self.current_row_i >= body_end_row_i or rows_count == rows_left:
+                break
+        self._aggregated_rows += rows_count
+        self._page_rows += rows_count
+
+    def _get_aggregates(self):
+        """
+        Накопители итогов колонок с итоговыми функциями (Field.get_footer_function). Создаются один раз на лист.
+        Для колонок, значения которых при записи не известны (формулы строк, колонка группы - в ней
+        подписи итогов групп), накопителя нет (None): итог пишется формулой без значения
+        """
+        if self._aggregates is None:
+            self._aggregates = []
+            group_col_i = self._get_group_col_i()
             for col_i, field in enumerate(self.parent.headers):
-                style = field.style if field.style else self.table_style
-                if field.is_counter:
-                    self.write(self.current_row_i, col_i, counter, style)
-                else:
-                    value = field.get_value(obj, key_name=key_name)
-                    self.write(self.current_row_i, col_i, value, style)
-                    if not self.parent.constant_row_height and self.parent.calculate_row_heights:
-                        cell_height = self._get_row_height(unicode(value), width=self.col(col_i).width)
-                        if cell_height > max_height:
-                            max_height = cell_height
+                function = field.get_footer_function()
+                if function is None:
+                    continue
+                if field.row_formula or col_i == group_col_i:
+                    self._aggregates.append((col_i, function, None))
+                    continue
+                match = _make_countif_matcher(field.need_count) if function == 'countif' else None
+                self._aggregates.append((col_i, function, _Aggregate(match)))
+        return self._aggregates
+
+    def _get_group_col_i(self):
+        """
+        Номер колонки группировки (Book.group_by) или None
+        """
+        group_by = self.parent.group_by
+        if group_by is None:
+            return None
+        for col_i, field in enumerate(self.parent.headers):
+            if field is group_by or (field.key is not None and field.key == group_by):
+                return col_i
+        raise self.WriteSheetException(u'Нет колонки для группировки "%s"' % group_by)
+
+    def _get_group_aggregates(self):
+        """
+        Накопители итогов открытой группы (Book.group_by) рядом с накопителями итогов таблицы.
+        Создаются один раз на лист
+        """
+        if self._group_aggregates is None:
+            group_col_i = self._get_group_col_i()
+            self._group_aggregates = [(col_i, function, aggregate and _Aggregate(aggregate.match), aggregate)
+                                      for col_i, function, aggregate in self._get_aggregates()
+                                      if col_i != group_col_i]
+        return self._group_aggregates
+
+    def _close_group(self):
+        """
+        Закрывает открытую группу строкой промежуточного итога: при смене ключа группы,
+        при переходе таблицы на новый лист и в конце данных
+        """
+        if self._group_first_row_i is None:
+            return
+        self._write_subtotal(self._get_group_col_i(), self._group_value, self._group_first_row_i,
+                             self._get_group_aggregates())
+        self._group_value, self._group_first_row_i = _NO_GROUP, None
+
+    def _write_subtotal(self, group_col_i, group_value, first_row_i, group_aggregates):
+        """
+        Строка промежуточного итога группы, строки которой начинаются с first_row_i и заканчиваются перед текущей.
+        Итоги группы переносятся в итоги таблицы и обнуляются
+        """
+        column_styles = self._get_column_styles()
+        row_i = self.current_row_i
+        style = column_styles[group_col_i][0]
+        self.write(row_i, group_col_i, self.subtotal_label % group_value, style)
+        for col_i, function, aggregate, total in group_aggregates:
+            cell_range = '%s%d:%s%d' % (xlrd.colname(col_i), first_row_i + 1, xlrd.colname(col_i), row_i)
+            self._write_formula(row_i, col_i, self._get_footer_formula(col_i, function, cell_range, grouped=True),
+                                aggregate and aggregate.get_value(function), column_styles[col_i][0])
+            if aggregate is not None:
+                total.merge(aggregate)
+                aggregate.reset()
+        self.current_row_i += 1
+        self._subtotal_rows += 1
+
+    def _get_footer_formula(self, col_i, function, cell_range, grouped=False):
+        """
+        Текст формулы итога колонки col_i по диапазону cell_range ('B2:B10')
+        """
+        if function == 'countif':
+            return u'COUNTIF(%s,"%s")' % (cell_range, self.parent.headers[col_i].need_count)
+        return self.FOOTER_FORMULAS[function][grouped] % cell_range
+
+    def _write_formula(self, row_i, col_i, text, value=None, style=xlwt.Style.default_style):
+        """
+        Пишет формулу, с уже вычисленным значением value, если оно известно
+        """
+        self.write(row_i, col_i, self._make_formula(text), style)
+        if value is not None:
+            cells = self.row(row_i)._Row__cells
+            cell = cells[col_i]
+            cells[col_i] = _CachedFormulaCell(cell.rowx, cell.colx, cell.xf_idx, cell.frmla, value)
+
+    def _get_streaming_chunk_size(self):
+        return self.parent.streaming_chunk_size
 
+    def _calc_row_height(self, values):
+        """
+        Высота строки тела таблицы - максимальная из высот ее ячеек
+        """
+        max_height = 0
+        for col_i, field in enumerate(self.parent.headers):
+            if not field.is_counter:
+                cell_height = self._get_row_height(unicode(values[col_i]), width=self.col(col_i).width)
+                if cell_height > max_height:
+                    max_height = cell_height
+        return max_height
+
+    def _auto_fit(self, sample):
+        """
+        Автоподбор по выборке строк: расширяет колонки Field.WIDTH_AUTO под длину значений
+        (перцентиль Book.auto_fit_percentile) и оценивает высоту для остальных строк таблицы.
+        :param sample: списки значений ячеек первых строк тела таблицы
+        :return: высота для строк, не попавших в выборку, или None
+        """
+        if not sample:
+            return None
+        percentile = self.parent.auto_fit_percentile
+        for col_i, field in enumerate(self.parent.headers):
+            if field.is_counter or field.width != Field.WIDTH_AUTO:
+                continue
+            lengths = []
+            for values in sample:
+                lengths.append(max([len(line) for line in unicode(values[col_i]).split('\n')]))
+            width = _percentile(lengths, percentile) * self.ONE_LETTER_WIDTH
+            if width > self.col(col_i).width:
+                self.col(col_i).width = int(min(width, self.MAX_AUTO_COL_WIDTH))
+
+        if self.parent.constant_row_height or not self.parent.calculate_row_heights:
+            return None
+        return _percentile([self._calc_row_height(values) for values in sample], percentile)
+
+    def write_table_columns(self, columns, key_name=None):
+        """
+        Запишем данные, заданные по колонкам (словарь списков, массивы NumPy, pandas.DataFrame).
+        Тело таблицы заполняется колонка за колонкой, без объектов строк: тип значений
+        проверяется один раз на колонку (колонки с Field.value_type приводятся к своему типу),
+        пустые значения (None, NaN) заменяются на empty_filler.
+        Если установлен NumPy, записи подряд идущих числовых колонок кодируются сразу для всех строк.
+        :param columns: отображение ключ Field (key или keys[key_name]) -> колонка значений.
+                        Все колонки должны быть одной длины
+        :param key_name: название источника данных (см. Field.get_value)
+        """
+        headers = self.parent.headers
+        prepared = []
+        for field in headers:
+            if field.is_counter or field.row_formula:
+                prepared.append(None)
+                continue
+            try:
+                prepared.append(self._prepare_column(columns[field.get_key(key_name)]))
+            except (KeyError, TypeError):
+                raise self.WriteSheetException(u'Нет колонки с данными для "%s"' % field.verbose_name)
+        lengths = set([len(column[0]) for column in prepared if column is not None])
+        if len(lengths) > 1:
+            raise self.WriteSheetException(u'Колонки с данными разной длины')
+        rows_count = lengths.pop() if lengths else 0
+        if self.current_row_i + rows_count > self._get_body_end_row_i():
+            raise self.WriteSheetException(u'Колонки не помещаются на лист: %d строк' % rows_count)
+        for col_i, field in enumerate(headers):
+            if field.is_counter:
+                prepared[col_i] = (range(1, rows_count + 1), 'number', [])
+            elif field.row_formula:
+                prepared[col_i] = ([u''] * rows_count, 'formula', [])
+
+        row_height = None
+        sample_size = self.parent.auto_fit_sample_size
+        if sample_size:
+            row_height = self._auto_fit([list(values) for values in zip(*[
+                values[:sample_size] for values, kind, missing in prepared])])
+
+        column_styles = self._get_column_styles()
+        typed_writers = self._get_typed_writers()
+        height_style = max([style for style, xf_index in column_styles] or [self.table_style],
+                           key=lambda style: style.font.height)
+        rows = []
+        for row_i in xrange(self.current_row_i, self.current_row_i + rows_count):
+            row = self.row(row_i)
+            row._Row__adjust_height(height_style)
+            row._Row__adjust_bound_col_idx(0, len(headers) - 1)
+            rows.append(row)
+
+        col_i = 0
+        while col_i < len(headers):
+            values, kind, missing = prepared[col_i]
+            if kind == 'formula':
+                formula = dict(self._get_row_formulas())[col_i]
+                xf_index = column_styles[col_i][1]
+                for row in rows:
+                    row._Row__cells[col_i] = formula.make_cell(row.get_index(), col_i, xf_index)
+                col_i += 1
+            elif col_i in typed_writers:
+                # значения заменяются приведенными к типу колонки - для итогов и высоты строк
+                typed_writer = typed_writers[col_i]
+                missing_set = set(missing)
+                for i, row in enumerate(rows):
+                    if i not in missing_set:
+                        values[i] = typed_writer(row, row.get_index(), values[i])
+                col_i += 1
+            elif kind == 'number' and numpy is not None:
+                # подряд идущие числовые колонки пишутся одной записью на строку
+                last_col_i = col_i
+                while (last_col_i + 1 < len(headers) and prepared[last_col_i + 1][1] == 'number'
+                       and last_col_i + 1 not in typed_writers):
+                    last_col_i += 1
+                self._write_number_columns(rows, col_i, prepared[col_i:last_col_i + 1],
+                                           column_styles[col_i:last_col_i + 1])
+                col_i = last_col_i + 1
+            else:
+                style, xf_index = column_styles[col_i]
+                self._write_column(rows, col_i, values, kind, xf_index, style)
+                col_i += 1
+
+        calculate_row_heights = not self.parent.constant_row_height and self.parent.calculate_row_heights
+        heights = [0] * rows_count
+        for col_i, field in enumerate(headers):
+            values, kind, missing = prepared[col_i]
+            style, xf_index = column_styles[col_i]
+            for i in missing:
+                rows[i]._Row__cells.pop(col_i, None)
+                self._write_cell(rows[i], col_i, field.empty_filler, xf_index, style)
+                values[i] = field.empty_filler
+            if calculate_row_heights and not field.is_counter:
+                width = self.col(col_i).width
+                for i in xrange(min(rows_count, sample_size) if row_height is not None else rows_count):
+                    cell_height = self._get_row_height(unicode(values[i]), width=width)
+                    if cell_height > heights[i]:
+                        heights[i] = cell_height
+
+        for i, row in enumerate(rows):
             if self.parent.constant_row_height:
-                self.row(self.current_row_i).height = self.parent.constant_row_height
+                row.height = self.parent.constant_row_height
             elif self.parent.calculate_row_heights:
-                self.row(self.current_row_i).height = max_height
+                row.height = heights[i] if row_height is None or i < sample_size else row_height
+        for col_i, function, aggregate in self._get_aggregates():
+            if aggregate is None:
+                continue
+            add = aggregate.add
+            for value in prepared[col_i][0]:
+                add(value)
+        self._aggregated_rows += rows_count
+        self._page_rows += rows_count
+        self.current_row_i += rows_count
+
+    def _prepare_column(self, column):
+        """
+        Приводит колонку к списку значений и определяет тип ее значений.
+        :return: (список значений, тип: 'number', 'bool' или None - разные типы, индексы пустых значений)
+        """
+        if numpy is not None and hasattr(column, 'dtype'):
+            array = numpy.asarray(column)
+            if array.dtype.kind in 'iuf':
+                missing = numpy.flatnonzero(numpy.isnan(array)).tolist() if array.dtype.kind == 'f' else []
+                if missing:
+                    array = numpy.where(numpy.isnan(array), 0, array)
+                return array.tolist(), 'number', missing
+            if array.dtype.kind == 'b':
+                return array.tolist(), 'bool', []
+            if array.dtype.kind == 'M':
+                array = array.astype('datetime64[us]')
+            values = array.tolist()
+            # None, а для колонок pandas - и NaN (значение не равно самому себе)
+            missing = [i for i, value in enumerate(values) if value is None or value != value]
+            return values, None, missing
+
+        values = list(column)
+        types = set(map(type, values))
+        missing = [i for i, value in enumerate(values) if value is None] if type(None) in types else []
+        types.discard(type(None))
+        if types and types <= set([int, long, float]):
+            kind = 'number'
+            for i in missing:
+                values[i] = 0
+        elif types == set([bool]):
+            kind = 'bool'
+            for i in missing:
+                values[i] = False
+        else:
+            kind = None
+        return values, kind, missing
 
-            self.current_row_i += 1
+    def _write_column(self, rows, col_i, values, kind, xf_index, style):
+        """
+        Пишет колонку значений в строки rows. Для колонок одного типа ячейки создаются
+        напрямую, без проверки типа каждого значения.
+        """
+        if kind == 'number':
+            cell_class = xlwt.Cell.NumberCell
+        elif kind == 'bool':
+            cell_class = xlwt.Cell.BooleanCell
+        else:
+            for row, value in itertools.izip(rows, values):
+                self._write_cell(row, col_i, value, xf_index, style)
+            return
+        start_row_i = rows[0].get_index() if rows else 0
+        rows_cells = [row._Row__cells for row in rows]
+        for row_i, cells, value in itertools.izip(itertools.count(start_row_i), rows_cells, values):
+            cells[col_i] = cell_class(row_i, col_i, xf_index, value)
+
+    def _write_number_columns(self, rows, first_col_i, columns, column_styles):
+        """
+        Пишет подряд идущие числовые колонки: значения кодируются в RK (как это делает xlwt)
+        средствами NumPy сразу для всех строк, и каждая строка получает одну готовую
+        запись RK/MULRK. Строки со значениями, которые не кодируются в RK, и строки
+        с пустыми значениями пишутся по ячейкам.
+        """
+        if not rows:
+            return
+        last_col_i = first_col_i + len(columns) - 1
+        numbers = numpy.array([values for values, kind, missing in columns], dtype=numpy.float64).T
+        int_ok = (numbers >= -0x20000000) & (numbers < 0x20000000) & (numpy.trunc(numbers) == numbers)
+        temp = numbers * 100
+        itemp = numpy.where(temp >= 0, numpy.floor(temp + 0.5), numpy.ceil(temp - 0.5))
+        cent_ok = (temp >= -0x20000000) & (temp < 0x20000000) & (itemp / 100.0 == numbers)
+        int_rk = numpy.where(int_ok, numbers, 0).astype(numpy.int64) << 2 | 2
+        cent_rk = numpy.where(cent_ok, itemp, 0).astype(numpy.int64) << 2 | 3
+        rk = numpy.where(int_ok, int_rk, cent_rk).astype(numpy.int32)
+        rows_ok = (int_ok | cent_ok).all(axis=1)
+        for values, kind, missing in columns:
+            rows_ok[missing] = False
+
+        start_row_i = rows[0].get_index()
+        if len(columns) == 1:
+            # RK
+            fields = [('id', '<u2'), ('size', '<u2'), ('row', '<u2'), ('col', '<u2'), ('xf0', '<u2'), ('rk0', '<i4')]
+            record_id, record_size = 0x027E, 10
+        else:
+            # MULRK
+            fields = [('id', '<u2'), ('size', '<u2'), ('row', '<u2'), ('col', '<u2')]
+            for col_n in range(len(columns)):
+                fields.extend([('xf%d' % col_n, '<u2'), ('rk%d' % col_n, '<i4')])
+            fields.append(('last_col', '<u2'))
+            record_id, record_size = 0x00BD, 6 * len(columns) + 6
+        records = numpy.zeros(len(rows), dtype=fields)
+        records['id'] = record_id
+        records['size'] = record_size
+        records['row'] = numpy.arange(start_row_i, start_row_i + len(rows))
+        records['col'] = first_col_i
+        for col_n, (style, xf_index) in enumerate(column_styles):
+            records['xf%d' % col_n] = xf_index
+            records['rk%d' % col_n] = rk[:, col_n]
+        if len(columns) > 1:
+            records['last_col'] = last_col_i
+        data = records.tobytes()
+        record_len = records.dtype.itemsize
+
+        placeholders = dict.fromkeys(range(first_col_i + 1, last_col_i + 1))
+        for i, (row, row_ok) in enumerate(itertools.izip(rows, rows_ok.tolist())):
+            if row_ok:
+                cells = row._Row__cells
+                cells.update(placeholders)
+                cells[first_col_i] = _BiffCells(data[i * record_len:(i + 1) * record_len])
+            else:
+                for col_n, (values, kind, missing) in enumerate(columns):
+                    style, xf_index = column_styles[col_n]
+                    row.insert_cell(first_col_i + col_n,
+                                    xlwt.Cell.NumberCell(start_row_i + i, first_col_i + col_n, xf_index, values[i]))
+
+    def _get_column_styles(self):
+        """
+        Стили колонок тела таблицы и их индексы XF в книге. Вычисляются один раз на лист,
+        чтобы xlwt не искал стиль в таблице стилей книги для каждой ячейки.
+        """
+        if self._column_styles is None:
+            self._column_styles = []
+            for field in self.parent.headers:
+                style = field.style if field.style else self.table_style
+                self._column_styles.append((style, self.parent.add_style(style)))
+        return self._column_styles
+
+    def _get_row_formulas(self):
+        """
+        Формулы строк (Field.row_formula) колонок тела таблицы. Разбираются один раз на лист
+        """
+        if self._row_formulas is None:
+            self._row_formulas = [(col_i, self._make_row_formula(field.row_formula))
+                                  for col_i, field in enumerate(self.parent.headers) if field.row_formula]
+        return self._row_formulas
+
+    def _get_typed_writers(self):
+        """
+        Функции записи ячеек колонок с Field.value_type. Создаются один раз на лист
+        """
+        if self._typed_writers is None:
+            column_styles = self._get_column_styles()
+            self._typed_writers = dict((col_i, self._make_typed_writer(col_i, field, *column_styles[col_i]))
+                                       for col_i, field in enumerate(self.parent.headers)
+                                       if field.value_type and not field.is_counter and not field.row_formula)
+        return self._typed_writers
+
+    def _make_typed_writer(self, col_i, field, style, xf_index):
+        """
+        Функция записи ячейки колонки типа field.value_type: writer(row, индекс строки, value) -> записанное значение.
+        Значение приводится к типу колонки, и ячейка нужного вида создается сразу,
+        без проверки типа значения. Пустое значение (None, empty_filler) пишется как empty_filler
+        """
+        value_type = field.value_type
+        empty_filler = field.empty_filler
+        write_cell = self._write_cell
+
+        def write_empty_or_raise(row, row_i, value):
+            if value is None or value == empty_filler:
+                write_cell(row, col_i, empty_filler, xf_index, style)
+                return empty_filler
+            raise self.WriteSheetException(u'Ячейка %s%d (колонка "%s"): значение %r не приводится к типу %s' % (
+                xlrd.colname(col_i), row_i + 1, field.verbose_name, value, value_type))
+
+        if value_type == Field.TYPE_TEXT:
+            add_str, encoding = self.parent.add_str, self.parent.encoding
+
+            def typed_writer(row, row_i, value):
+                if value is None or value == empty_filler:
+                    write_cell(row, col_i, empty_filler, xf_index, style)
+                    return empty_filler
+                value = value.decode(encoding) if isinstance(value, str) else unicode(value)
+                if value:
+                    row._Row__cells[col_i] = xlwt.Cell.StrCell(row_i, col_i, xf_index, add_str(value))
+                else:
+                    row._Row__cells[col_i] = xlwt.Cell.BlankCell(row_i, col_i, xf_index)
+                return value
+            return typed_writer
+
+        if value_type == Field.TYPE_BOOL:
+            def typed_writer(row, row_i, value):
+                if value is None or value == empty_filler:
+                    write_cell(row, col_i, empty_filler, xf_index, style)
+                    return empty_filler
+                value = bool(value)
+                row._Row__cells[col_i] = xlwt.Cell.BooleanCell(row_i, col_i, xf_index, value)
+                return value
+            return typed_writer
+
+        if value_type in (Field.TYPE_DATE, Field.TYPE_DATETIME):
+            convert = self._make_xldate_converter(with_time=value_type == Field.TYPE_DATETIME)
+        else:
+            convert = {Field.TYPE_INT: _to_int, Field.TYPE_FLOAT: float, Field.TYPE_DECIMAL: _to_decimal}[value_type]
+        NumberCell = xlwt.Cell.NumberCell
+
+        def typed_writer(row, row_i, value):
+            # пустые значения (None, empty_filler) к числу не приводятся и разбираются только при ошибке
+            try:
+                number = convert(value)
+                row._Row__cells[col_i] = NumberCell(row_i, col_i, xf_index, number)
+                return number
+            except (TypeError, ValueError, ArithmeticError, AttributeError):
+                return write_empty_or_raise(row, row_i, value)
+        return typed_writer
+
+    def _make_xldate_converter(self, with_time):
+        """
+        Дата (или дата и время при with_time) -> число Excel, как у xlwt.Row.__excel_date_dt
+        """
+        if self.parent.dates_1904:
+            epoch, adjust = datetime.date(1904, 1, 1).toordinal(), False
+        else:
+            # 1900 год в Excel ошибочно високосный: после 28.02.1900 добавляется день
+            epoch, adjust = datetime.date(1899, 12, 31).toordinal(), True
+
+        def to_xldate(value):
+            xldate = value.toordinal() - epoch
+            if with_time:
+                try:
+                    xldate += (value.hour * 3600 + value.minute * 60 + value.second) / 86400.0
+                except AttributeError:
+                    pass  # дата без времени
+            if adjust and xldate > 59:
+                xldate += 1
+            return xldate
+        return to_xldate
+
+    def _write_cell(self, row, col_i, value, xf_index, style):
+        """
+        Аналог xlwt.Row.write для ячейки с уже известным индексом стиля xf_index.
+        Границы строки и ее высоту вызывающий код выставляет сам.
+        """
+        if isinstance(value, basestring):
+            if value:
+                cell = xlwt.Cell.StrCell(row.get_index(), col_i, xf_index, self.parent.add_str(value))
+            else:
+                cell = xlwt.Cell.BlankCell(row.get_index(), col_i, xf_index)
+        elif isinstance(value, bool):
+            cell = xlwt.Cell.BooleanCell(row.get_index(), col_i, xf_index, value)
+        elif isinstance(value, (float, int, long, Decimal)):
+            cell = xlwt.Cell.NumberCell(row.get_index(), col_i, xf_index, value)
+        elif isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+            cell = xlwt.Cell.NumberCell(row.get_index(), col_i, xf_index, row._Row__excel_date_dt(value))
+        elif value is None:
+            cell = xlwt.Cell.BlankCell(row.get_index(), col_i, xf_index)
+        else:
+            # формулы, rich text и прочие редкие значения пишет сам xlwt
+            row.write(col_i, value, style)
+            return
+        row.insert_cell(col_i, cell)
 
     def write_footer(self):
+        if self.next_sheet is not None:
+            # таблица продолжилась на следующих листах, у этого листа итоговая строка уже есть
+            self.next_sheet.write_footer()
+            return
+        self._write_page_footer()
+        if self.parent.need_grand_total_sheet:
+            sheet = self.parent.add_sheet(self.parent.get_page_sheet_name(self.first_page.name, None))
+            sheet.write_grand_total(self.first_page.get_pages())
+
+    def _write_page_footer(self):
         self._write_sum()
         if self.parent.need_signature:
             self.write_signature()
 
+    def write_grand_total(self, pages):
+        """
+        Лист общих итогов таблицы, записанной на листах pages: под шапкой таблицы - строка на каждый лист
+        со ссылками на его итоговую строку, и общий итог по этим строкам
+        """
+        self.write_header()
+        headers = self.parent.headers
+        label_cols = [col_i for col_i, field in enumerate(headers)
+                      if field.get_footer_function() is None and not field.formula][:1]
+        totals = self._get_aggregates()
+        cached = True
+        first_row_i = self.current_row_i
+        for page in pages:
+            cached = cached and page._is_aggregated()
+            page_aggregates = dict((col_i, aggregate) for col_i, function, aggregate in page._get_aggregates())
+            for col_i in label_cols:
+                self.write(self.current_row_i, col_i, page.name)
+            for col_i, function, total in totals:
+                text = u"'%s'!%s%d" % (page.name.replace(u"'", u"''"), xlrd.colname(col_i), page._footer_row_i + 1)
+                page_aggregate = page_aggregates[col_i]
+                value = None
+                if page_aggregate is not None and page._is_aggregated():
+                    value = page_aggregate.get_value(function)
+                self._write_formula(self.current_row_i, col_i, text, value)
+                if total is not None:
+                    total.merge(page_aggregate)
+            self.current_row_i += 1
+
+        for col_i, function, total in totals:
+            value = total.get_value(function) if cached and total is not None else None
+            if function == 'average':
+                # среднее средних листов разного размера неверно, пишется только общее среднее
+                if value is not None:
+                    self.write(self.current_row_i, col_i, value)
+                continue
+            letter = xlrd.colname(col_i)
+            text = u'%s(%s%d:%s%d)' % ({'min': u'MIN', 'max': u'MAX'}.get(function, u'SUM'),
+                                       letter, first_row_i + 1, letter, self.current_row_i)
+            self._write_formula(self.current_row_i, col_i, text, value)
+        self._footer_row_i = self.current_row_i
+        self.current_row_i += 1
+
     def write_signature(self):
         """
         подпись под таблицей
@@ -285,26 +1619,43 @@ class Sheet(xlwt.Worksheet):
         self.current_row_i += 1
         self._data_start_row_i = self.current_row_i
 
+    def _is_aggregated(self):
+        """
+        Все ли строки тела таблицы прошли через накопители итогов, т.е. известны ли значения итогов
+        """
+        end_row_i = self.current_row_i if self._footer_row_i is None else self._footer_row_i
+        return self._aggregated_rows + self._subtotal_rows == end_row_i - self._data_start_row_i
+
     def _write_sum(self):
+        cached = self._is_aggregated()
+        self._footer_row_i = self.current_row_i
+        grouped = self._subtotal_rows > 0
+        aggregates = dict((col_i, aggregate) for col_i, function, aggregate in self._get_aggregates())
         for col, field in enumerate(self.parent.headers):
-            if field.need_sum or field.need_count or field.need_average or field.formula:
+            function = field.get_footer_function()
+            if field.formula:
+                self.write(self.current_row_i, col, self._make_formula(self._parse_formula(field.formula)))
+            elif function is not None:
                 letter = xlrd.colname(col)
-                if field.formula:
-                    formula = xlwt.Formula(self._parse_formula(field.formula))
+                cell_range = '%s%s:%s%s' % (letter, self._data_start_row_i + 1, letter, self.current_row_i)
+                if function == 'countif' and grouped:
+                    # COUNTIF учел бы и строки промежуточных итогов, складываем их значения
+                    group_letter = xlrd.colname(self._get_group_col_i())
+                    text = u'SUMIF(%s%s:%s%s;"%s";%s)' % (
+                        group_letter, self._data_start_row_i + 1, group_letter, self.current_row_i,
+                        self.subtotal_label % u'*', cell_range)
                 else:
-                    if field.need_sum:
-                        function_ = u'SUM(%s%s:%s%s)'
-                    elif field.need_average:
-                        function_ = u'ROUND(AVERAGE(%s%s:%s%s);0)'
-                    else:
-                        function_ = u'COUNTIF(%s%s:%s%s,"{condition}")'.format(condition=field.need_count)
-                    formula = xlwt.Formula(
-                        function_ % (
-                            letter, self._data_start_row_i+1, letter, self.current_row_i
-                        ))
-                self.write(self.current_row_i, col, formula)
+                    text = self._get_footer_formula(col, function, cell_range, grouped)
+                value = aggregates[col].get_value(function) if cached and aggregates[col] is not None else None
+                self._write_formula(self.current_row_i, col, text, value)
         self.current_row_i += 1
 
+    def _make_formula(self, text):
+        return xlwt.Formula(text)
+
+    def _make_row_formula(self, text):
+        return _RowFormula(self.parent, text)
+
     def _get_header_style(self):
         if self.parent.header_orientation == HEADER_HORIZONTAL:
             return self.horizontal_header_style
@@ -437,19 +1788,176 @@ class Sheet(xlwt.Worksheet):
         return widths
 
 
+class _NoPhase(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_no_phase = _NoPhase()
+
+
+def _get_umask():
+    """
+    Текущая маска прав новых файлов (узнать ее можно, только установив новую)
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# Маска читается один раз при импорте: os.umask меняет ее для всего процесса, и файл, который
+# другой поток создал бы во время чтения маски при каждом сохранении, получил бы права 0666
+_UMASK = _get_umask()
+
+
+def _get_django_relation_paths(model, related):
+    """
+    Пути related, каждая часть которых - поле-связь модели Django (прямая или обратная)
+    """
+    from django.core.exceptions import FieldDoesNotExist
+
+    result = []
+    for path in related:
+        current = model
+        for part in path.split('__'):
+            try:
+                field = current._meta.get_field(part)
+            except FieldDoesNotExist:
+                break
+            if not field.is_relation or field.related_model is None:
+                break
+            current = field.related_model
+        else:
+            result.append(path)
+    return result
+
+
+class _ChunksBuffer(object):
+    """
+    Файловый объект для SaveBookMixin.iter_chunks: копит записанное до выдачи частями
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, data):
+        self.parts.append(data)
+        self.size += len(data)
+
+    def pop_chunks(self, chunk_size, flush=False):
+        """
+        Выдает накопленное частями по chunk_size байт, остаток меньше chunk_size остается в буфере
+        (если не задан flush)
+        """
+        if self.size < chunk_size and not (flush and self.size):
+            return
+        data = ''.join(self.parts)
+        self.parts = []
+        self.size = 0
+        for offset in xrange(0, len(data), chunk_size):
+            chunk = data[offset:offset + chunk_size]
+            if len(chunk) < chunk_size and not flush:
+                self.write(chunk)
+            else:
+                yield chunk
+
+
 class SaveBookMixin(object):
+    SAVE_CHUNK_SIZE = 64 * 1024  # размер части файла по умолчанию в iter_chunks
 
     def save(self, filename=None, return_file_path=False):
         """
         Сохраняет книгу в файл.
-        :param filename: имя файла. Если не указана, будет сформировано случайное число.
+        Файл сначала пишется во временный файл рядом и затем переименовывается, поэтому
+        по имени filename никогда не бывает видно недописанной книги.
+        :param filename: имя файла или файловый объект, открытый на запись.
+                         Если не указано, в текущей папке создается файл с уникальным случайным именем.
         :param return_file_path: флаг определяющий нужно ли возвращать путь к файлу
-        :return: название файли или название файла и полный путь к нему (если задан флаг return_file_path)
+        :return: название файли или название файла и полный путь к нему (если задан флаг return_file_path).
+                 Для файлового объекта - сам объект
         """
-        file_name = '%s.xls' % random.randint(1, 999999)
-        super(SaveBookMixin, self).save(file_name)
+        if hasattr(filename, 'write'):
+            self.write_to(filename)
+            return filename
+
+        if filename is None:
+            # занимаем уникальное имя, файл будет заменен готовой книгой
+            fd, file_path = tempfile.mkstemp(suffix='.%s' % self.backend, prefix='', dir=os.getcwd())
+            os.close(fd)
+            file_name = os.path.basename(file_path)
+        else:
+            file_name = filename
+            file_path = os.path.abspath(filename)
+
+        try:
+            fd, temp_path = tempfile.mkstemp(suffix='.tmp', prefix='.%s.' % os.path.basename(file_path),
+                                             dir=os.path.dirname(file_path))
+        except BaseException:
+            if filename is None:
+                os.remove(file_path)
+            raise
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                self.write_to(temp_file)
+            # mkstemp создает файл с правами 0600, у книги - права обычного нового файла
+            os.chmod(temp_path, 0o666 & ~_UMASK)
+            try:
+                os.rename(temp_path, file_path)
+            except OSError:
+                # Windows не заменяет существующий файл при переименовании
+                os.remove(file_path)
+                os.rename(temp_path, file_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            if filename is None and os.path.exists(file_path):
+                # пустой файл, занимавший уникальное имя
+                os.remove(file_path)
+            raise
+
+        if return_file_path:
+            return file_name, file_path
         return file_name
 
+    def write_to(self, fileobj):
+        """
+        Пишет книгу в файловый объект (открытый файл, BytesIO, ответ веб-сервера)
+        """
+        with self._phase('save'):
+            if self.backend == BACKEND_XLSX:
+                xlsx.XlsxWriter(self).write(fileobj)
+            else:
+                super(SaveBookMixin, self).save(fileobj)
+
+    def get_bytes(self):
+        """
+        :return: содержимое файла книги (str)
+        """
+        buffer_ = _ChunksBuffer()
+        self.write_to(buffer_)
+        return ''.join(buffer_.parts)
+
+    def iter_chunks(self, chunk_size=SAVE_CHUNK_SIZE):
+        """
+        Генератор частей файла книги, например для потокового HTTP-ответа.
+        Книга .xlsx отдается по мере записи XML листов; .xls формируется в памяти целиком
+        (так устроен формат BIFF) и отдается частями.
+        :param chunk_size: размер части в байтах (последняя часть может быть меньше)
+        """
+        buffer_ = _ChunksBuffer()
+        if self.backend == BACKEND_XLSX:
+            for _ in xlsx.XlsxWriter(self).iter_write(buffer_):
+                for chunk in buffer_.pop_chunks(chunk_size):
+                    yield chunk
+        else:
+            self.write_to(buffer_)
+        for chunk in buffer_.pop_chunks(chunk_size, flush=True):
+            yield chunk
+
 class Book(SaveBookMixin, xlwt.Workbook):
     title = u'Имя не указано'
     need_top_part = False
@@ -459,9 +1967,40 @@ class Book(SaveBookMixin, xlwt.Workbook):
     header_orientation = HEADER_HORIZONTAL
     header_height = 255
     sheet_class = Sheet
+    # Формат файла: BACKEND_XLS (.xls, до 65536 строк и 256 колонок на листе)
+    # или BACKEND_XLSX (.xlsx, до 1048576 строк и 16384 колонок, строки сбрасываются в XML потоком)
+    backend = BACKEND_XLS
     # Считать height для ячеек строки и ставить строке максимальный из них. Только для тела таблицы
     calculate_row_heights = False
     constant_row_height = None
+    # Потоковая запись: каждые streaming_chunk_size строк тела таблицы сериализуются
+    # во временный файл и освобождаются из памяти. None - все строки держатся в памяти до save()
+    streaming_chunk_size = None
+    # Автоподбор по данным: ширина колонок Field.WIDTH_AUTO и высота строк (при calculate_row_heights)
+    # считаются по первым auto_fit_sample_size строкам тела таблицы, а не по всем значениям.
+    # 0 - выключено, ширина считается по заголовку, высота - для каждой строки
+    auto_fit_sample_size = 0
+    auto_fit_percentile = 90  # перцентиль длины значений в выборке, под который подбирается размер
+    # Шапка листа (ширины колонок, верхняя часть с логотипом, заголовки таблицы) строится один раз
+    # и для следующих книг того же класса переносится из шаблона. Только для книг, у которых
+    # шапка зависит лишь от заголовков, названия отчета (get_title) и логотипа
+    use_header_template = False
+    # Класс статистики формирования отчета (например, stats.ReportStats). None - без замеров
+    stats_class = None
+    # Подгрузка связанных объектов лукапов заголовков ('client__fio') пачками по prefetch_chunk_size
+    # строк данных (см. resolve_related), чтобы обращение к ним не стоило запроса к БД на каждую строку.
+    # None - объекты данных используются как есть
+    prefetch_chunk_size = None
+    # Группировка тела таблицы: Field (или его key), при смене значения которого в упорядоченных данных
+    # под строками группы пишется строка промежуточных итогов. None - без групп. Только для write_table_body
+    group_by = None
+    # Таблица, не помещающаяся на лист (Sheet.max_rows), продолжается на новых листах с той же шапкой
+    # и сквозной нумерацией, у каждого листа своя итоговая строка. page_size - строк данных на листе,
+    # если делить нужно раньше. None - по заполнению листа
+    page_size = None
+    # Лист общих итогов после листов таблицы: итоговые строки листов и общий итог по ним
+    need_grand_total_sheet = False
+    grand_total_title = u'итоги'  # добавляется к названию листа таблицы в названии листа общих итогов
 
     def __init__(self, data=None, create=True, metadata=None, *args, **kwargs):
         """
@@ -473,11 +2012,17 @@ class Book(SaveBookMixin, xlwt.Workbook):
         :param metadata: дополнительные данные об отчете. Например, период за который формируется отчет.
                          В качестве значения можно передавать cleaned_data формы.
         :param args:
-        :param kwargs:
+        :param kwargs: stats - объект статистики (например, stats.ReportStats), иначе создается
+                       из stats_class. Остальное передается в xlwt.Workbook
         """
+        stats = kwargs.pop('stats', None)
         super(Book, self).__init__(*args, **kwargs)
         self.headers = list(self.headers)  # копируем
         self.metadata = metadata or {}
+        if stats is None and self.stats_class is not None:
+            stats = self.stats_class()
+        self.stats = stats
+        self._field_caches = {}  # (Field, key_name) -> _FieldCache
         if create:
             self.create(data)
 
@@ -487,9 +2032,124 @@ class Book(SaveBookMixin, xlwt.Workbook):
         :param data: итерируемый объект с данными отчета
         """
         sheet = self.add_sheet(self.title)
-        sheet.write_header()
-        self.process_data(data, sheet)
-        sheet.write_footer()
+        with self._phase('write_header'):
+            sheet.write_header()
+        with self._phase('process_data'):
+            self.process_data(data, sheet)
+        with self._phase('write_footer'):
+            sheet.write_footer()
+        self.clear_field_caches()
+
+    def get_field_cache(self, field, key_name=None):
+        """
+        Кеш значений колонки field (см. Field.cache_key) для источника данных key_name
+        """
+        try:
+            return self._field_caches[field, key_name]
+        except KeyError:
+            cache = self._field_caches[field, key_name] = _FieldCache(field.cache_key, field.cache_size)
+            return cache
+
+    def clear_field_caches(self):
+        """
+        Освобождает значения кешей колонок, счетчики попаданий сохраняются
+        """
+        for cache in self._field_caches.itervalues():
+            cache.clear()
+        if self.stats is not None:
+            self.stats.caches = self.get_field_caches_stats()
+
+    def get_field_caches_stats(self):
+        """
+        :return: список словарей по кешам колонок: номер колонки, заголовок, источник данных,
+                 количество попаданий и промахов, доля попаданий
+        """
+        result = []
+        for (field, key_name), cache in self._field_caches.iteritems():
+            result.append({'column': self.headers.index(field), 'name': field.verbose_name, 'key_name': key_name,
+                           'hits': cache.hits, 'misses': cache.misses, 'hit_rate': cache.get_hit_rate()})
+        result.sort(key=lambda item: (item['column'], item['key_name']))
+        return result
+
+    def create_columns(self, columns, key_name=None):
+        """
+        заполняет книгу данными, заданными по колонкам
+        :param columns: отображение ключ Field -> колонка значений (см. Sheet.write_table_columns)
+        :param key_name: название источника данных
+        """
+        sheet = self.add_sheet(self.title)
+        with self._phase('write_header'):
+            sheet.write_header()
+        with self._phase('write_table_columns'):
+            sheet.write_table_columns(columns, key_name=key_name)
+        with self._phase('write_footer'):
+            sheet.write_footer()
+
+    def _phase(self, name):
+        """
+        Контекстный менеджер замера фазы формирования отчета (если статистика включена)
+        """
+        if self.stats is None:
+            return _no_phase
+        return self.stats.phase(name)
+
+    def get_prefetch_plan(self, key_name=None):
+        """
+        План подгрузки данных для источника key_name, построенный по ключам заголовков таблицы.
+        Например, для 'number', 'client__fio' и 'client__city__name':
+        {'related': ['client', 'client__city'], 'fields': ['client__city__name', 'client__fio', 'number']}
+        :return: словарь: related - пути связанных объектов (для select_related/prefetch_related,
+                 см. Field.related_depth), fields - поля, которые берутся из данных (для QuerySet.only),
+                 или None, если среди ключей есть функции и нужные им поля неизвестны
+        """
+        related, fields = set(), set()
+        for field in self.headers:
+            if field.is_counter or field.row_formula:
+                continue
+            path = field.get_lookup_path(key_name)
+            if path is None:
+                fields = None
+                continue
+            related.update(field.get_related_paths(key_name))
+            if fields is not None:
+                fields.add('__'.join(path))
+        return {'related': sorted(related), 'fields': None if fields is None else sorted(fields)}
+
+    def iter_prefetched(self, objects, key_name=None):
+        """
+        Проход по данным источника key_name, в котором связанные объекты из плана подгрузки
+        загружаются через resolve_related пачками по prefetch_chunk_size строк
+        """
+        related = self.get_prefetch_plan(key_name)['related']
+        if not related:
+            for obj in objects:
+                yield obj
+            return
+        objects = iter(objects)
+        while True:
+            chunk = list(itertools.islice(objects, self.prefetch_chunk_size))
+            if not chunk:
+                return
+            self.resolve_related(chunk, related)
+            for obj in chunk:
+                yield obj
+
+    def resolve_related(self, objects, related):
+        """
+        Загружает связанные объекты related (пути вида 'client__city') для списка объектов данных objects.
+        По умолчанию - django.db.models.prefetch_related_objects для объектов моделей Django: один запрос
+        на путь для всей пачки, пути не по полям-связям модели пропускаются. Без Django и для других
+        объектов ничего не делает - для других источников данных метод переопределяется.
+        """
+        try:
+            from django.db.models import Model, prefetch_related_objects
+        except ImportError:
+            return
+        if not objects or not isinstance(objects[0], Model):
+            return
+        related = _get_django_relation_paths(type(objects[0]), related)
+        if related:
+            prefetch_related_objects(objects, *related)
 
     def process_data(self, data, sheet):
         """
@@ -511,6 +2171,20 @@ class Book(SaveBookMixin, xlwt.Workbook):
             raise Exception("duplicate worksheet name %r" % sheetname)
         self._Workbook__worksheet_idx_from_name[lower_name] = len(self._Workbook__worksheets)
 
-        sheet = self.sheet_class(sheetname, self, cell_overwrite_ok)
+        sheet = self.get_sheet_class()(sheetname, self, cell_overwrite_ok)
         self._Workbook__worksheets.append(sheet)
-        return sheet
\ No newline at end of file
+        return sheet
+
+    def get_page_sheet_name(self, sheet_name, page_number):
+        """
+        Название листа-продолжения таблицы листа sheet_name (page_number - номер листа таблицы, с 2)
+        или листа общих итогов (page_number=None). Не длиннее 31 символа - ограничение Excel
+        """
+        suffix = u' (%s)' % (page_number or self.grand_total_title)
+        return sheet_name[:31 - len(suffix)] + suffix
+
+    def get_sheet_class(self):
+        assert self.backend in BACKENDS
+        if self.backend == BACKEND_XLSX:
+            return xlsx.sheet_class_for(self.sheet_class)
+        return self.sheet_class
\ No newline at end of file
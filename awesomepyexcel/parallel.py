@@ -0,0 +1,101 @@
+# coding: utf-8
+"""
+Параллельное формирование книг: данные листов готовятся в пуле процессов,
+а книга собирается в текущем процессе в заданном порядке листов.
+"""
+import itertools
+import multiprocessing
+
+# Строк данных на лист при разбиении большого набора данных. Лист .xls вмещает 65536 строк,
+# часть из них уходит на шапку и итоговую строку
+SHARD_SIZE = 65000
+
+
+def _collect_sheet_rows(job):
+    """
+    Выполняется в процессе пула: вычисляет значения ячеек тела таблицы одного листа.
+    Данные проходят через Book.process_data, так что книги с несколькими источниками
+    данных тоже работают, если тело таблицы пишется через write_table_body.
+    :return: (список значений ячеек строк, None) или (None, данные), если process_data пишет
+             на лист сам (sheet.write, write_merge) - такой лист формируется в основном процессе
+             из уже полученных данных, функция данных второй раз не вызывается
+    """
+    book_class, metadata, sheet_name, data = job
+    if hasattr(data, '__call__'):
+        data = _materialize(data())
+    book = book_class(create=False, metadata=metadata)
+    sheet = book.add_sheet(sheet_name)
+    rows_values = []
+    sheet._write_rows_values = rows_values.extend
+    book.process_data(data, sheet)
+    if sheet.get_rows() or sheet.merged_ranges or sheet.current_row_i:
+        return None, data
+    return rows_values, None
+
+
+def _materialize(data):
+    """
+    Итераторы (генераторы, курсоры) читаются в списки: данные могут понадобиться еще раз
+    и должны передаваться в основной процесс
+    :param data: итерируемый объект с данными или словарь {имя источника: данные}
+    """
+    if isinstance(data, dict):
+        return dict((key, _materialize(value)) for key, value in data.iteritems())
+    if isinstance(data, (list, tuple)):
+        return data
+    return list(data)
+
+
+def create_book_parallel(book_class, sheets, metadata=None, processes=None):
+    """
+    Формирует книгу из нескольких листов, значения ячеек которых вычисляются в пуле процессов.
+    Заголовки, стили и строки (shared strings) записываются в одну книгу в текущем процессе,
+    в порядке sheets, поэтому для одинаковых данных результат побайтно одинаков.
+    :param book_class: класс книги (наследник Book). Заголовки таблицы строятся в каждом процессе
+                       из класса, поэтому Field с lambda-ключами передавать не нужно
+    :param sheets: список пар (название листа, данные). Данные - список объектов, или
+                   picklable-функция без аргументов, которая возвращает итерируемый объект с данными
+                   (например, functools.partial над функцией модуля, делающей запрос к БД).
+                   Листы, на которые process_data пишет сам, а не через write_table_body, формируются
+                   в текущем процессе, как в Book.create, из данных, полученных в процессе пула
+    :param metadata: дополнительные данные об отчете (см. Book.__init__)
+    :param processes: количество процессов пула. По умолчанию - количество ядер
+    :return: книга book_class
+    """
+    sheets = list(sheets)
+    book = book_class(create=False, metadata=metadata)
+    jobs = [(book_class, metadata, sheet_name, data) for sheet_name, data in sheets]
+    pool = multiprocessing.Pool(processes)
+    try:
+        for (sheet_name, data), (rows_values, fetched_data) in itertools.izip(
+                sheets, pool.imap(_collect_sheet_rows, jobs)):
+            sheet = book.add_sheet(sheet_name)
+            sheet.write_header()
+            if rows_values is None:
+                book.process_data(fetched_data, sheet)
+            else:
+                sheet._write_rows_values(rows_values)
+            sheet.write_footer()
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return book
+
+
+def iter_shards(data, title, shard_size=SHARD_SIZE):
+    """
+    Разбивает набор данных, не помещающийся на один лист, на листы для create_book_parallel.
+    :param data: итерируемый объект с данными отчета
+    :param title: название листов, к нему добавляется номер листа
+    :param shard_size: количество строк данных на листе
+    :return: генератор пар (название листа, список объектов)
+    """
+    data = iter(data)
+    for number in itertools.count(1):
+        shard = list(itertools.islice(data, shard_size))
+        if not shard:
+            break
+        yield u'%s (%d)' % (title, number), shard
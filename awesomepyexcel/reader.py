@@ -0,0 +1,204 @@
+# coding: utf-8
+"""
+Чтение книг .xls, сформированных Book (или их отредактированных копий), обратно в записи.
+
+    with BookReader(OrdersBook, 'orders.xls') as reader:
+        for record in reader.iter_records():
+            record['number'], record['client__fio']
+
+Заголовки таблицы берутся из класса книги: строка заголовков находится на листе по названиям
+колонок (Field.verbose_name), верхняя часть листа над ней, строки промежуточных итогов групп (Book.group_by)
+и итоговая строка под таблицей пропускаются.
+Файл открывается через mmap, листы загружаются по одному при чтении и сразу освобождаются,
+записи отдаются по мере прохода по строкам листа.
+"""
+import datetime
+import itertools
+import multiprocessing
+
+import xlrd
+
+
+class BookReader(object):
+    class ReadBookException(Exception): pass
+
+    def __init__(self, book_class, filename=None, file_contents=None, key_name=None):
+        """
+        :param book_class: класс книги (наследник Book), которой был сформирован файл
+        :param filename: путь к файлу .xls
+        :param file_contents: содержимое файла (вместо filename)
+        :param key_name: источник данных (см. Field.get_value), ключи которого становятся ключами записей
+        """
+        self.book_class = book_class
+        self.headers = list(book_class.headers)
+        self.key_name = key_name
+        self.workbook = xlrd.open_workbook(filename, file_contents=file_contents, on_demand=True, use_mmap=True)
+        self.has_footer = any(field.get_footer_function() or field.formula for field in self.headers)
+        self.group_col_i = None  # колонка группировки, в ней - подписи строк промежуточных итогов
+        group_by = book_class.group_by
+        if group_by is not None:
+            self.group_col_i = [col_i for col_i, field in enumerate(self.headers)
+                                if field is group_by or (field.key is not None and field.key == group_by)][0]
+        self.subtotal_prefix = book_class.sheet_class.subtotal_label.split('%s')[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.workbook.release_resources()
+
+    def get_sheet_names(self):
+        return self.workbook.sheet_names()
+
+    def get_record_keys(self):
+        """
+        Ключи записей по колонкам таблицы: строковый ключ Field (лукап 'client__fio' остается как есть),
+        для ключей-функций - заголовок колонки. Счетчики и формулы строк не читаются (None)
+        """
+        keys = []
+        for field in self.headers:
+            if field.is_counter or field.row_formula:
+                keys.append(None)
+                continue
+            key = field.get_key(self.key_name)
+            keys.append(key if isinstance(key, basestring) else field.verbose_name)
+        return keys
+
+    def iter_records(self, sheets=None):
+        """
+        Записи всех листов подряд
+        :param sheets: названия или индексы листов. По умолчанию - все листы книги
+        """
+        if sheets is None:
+            sheets = range(self.workbook.nsheets)
+        for sheet in sheets:
+            for record in self.iter_sheet_records(sheet):
+                yield record
+
+    def iter_sheet_records(self, sheet):
+        """
+        Записи одного листа: словари {ключ записи (см. get_record_keys): значение ячейки}
+        :param sheet: название или индекс листа
+        """
+        if isinstance(sheet, basestring):
+            sheet_index = self.get_sheet_names().index(sheet)
+        else:
+            sheet_index = sheet
+        xlrd_sheet = self.workbook.sheet_by_index(sheet_index)
+        try:
+            for record in self._iter_records(xlrd_sheet):
+                yield record
+        finally:
+            self.workbook.unload_sheet(sheet_index)
+
+    def _iter_records(self, sheet):
+        header_row_i = self._find_header_row(sheet)
+        columns = [(col_i, key, field) for col_i, (key, field) in enumerate(zip(self.get_record_keys(), self.headers))
+                   if key is not None]
+        counter_col_i = [col_i for col_i, field in enumerate(self.headers) if field.is_counter][:1]
+        last_col_i = len(self.headers) - 1
+        datemode = self.workbook.datemode
+
+        pending = None  # строка таблицы, которая может оказаться итоговой
+        # на листах-продолжениях таблицы (Book.page_size) нумерация сквозная, у книг с несколькими
+        # источниками данных (несколько write_table_body) - начинается с 1 для каждого источника
+        next_number = None
+        for row_i in xrange(header_row_i + 1, sheet.nrows):
+            types = sheet.row_types(row_i, 0, last_col_i + 1)
+            if all(cell_type in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK) for cell_type in types):
+                break
+            if self._is_subtotal_row(sheet, row_i, types, counter_col_i):
+                continue
+            if counter_col_i:
+                # строки тела таблицы пронумерованы, итоговая строка и подпись - нет
+                col_i = counter_col_i[0]
+                if col_i >= len(types) or types[col_i] != xlrd.XL_CELL_NUMBER:
+                    break
+                number = sheet.cell_value(row_i, col_i)
+                if next_number is not None and number not in (next_number, 1):
+                    raise self.ReadBookException(u'Лист "%s", строка %d: номер строки %s вместо %s' % (
+                        sheet.name, row_i + 1, number, next_number))
+                next_number = number + 1
+            values = sheet.row_values(row_i, 0, last_col_i + 1)
+            record = {}
+            for col_i, key, field in columns:
+                if col_i < len(types):
+                    record[key] = self._convert(types[col_i], values[col_i], field, datemode)
+                else:
+                    record[key] = field.empty_filler
+            if self.has_footer and not counter_col_i:
+                # без счетчика итоговая строка - последняя непустая строка таблицы
+                if pending is not None:
+                    yield pending
+                pending = record
+            else:
+                yield record
+
+    def _is_subtotal_row(self, sheet, row_i, types, counter_col_i):
+        """
+        Строка промежуточного итога группы: подпись в колонке группировки и нет номера строки
+        """
+        col_i = self.group_col_i
+        if col_i is None or col_i >= len(types) or types[col_i] != xlrd.XL_CELL_TEXT:
+            return False
+        if counter_col_i and counter_col_i[0] < len(types) and types[counter_col_i[0]] == xlrd.XL_CELL_NUMBER:
+            return False
+        return sheet.cell_value(row_i, col_i).startswith(self.subtotal_prefix)
+
+    def _find_header_row(self, sheet):
+        names = [field.verbose_name for field in self.headers]
+        for row_i in xrange(sheet.nrows):
+            if sheet.row_values(row_i, 0, len(names)) == names:
+                return row_i
+        raise self.ReadBookException(u'На листе "%s" не найдена строка заголовков таблицы' % sheet.name)
+
+    @staticmethod
+    def _convert(cell_type, value, field, datemode):
+        if cell_type in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK):
+            return field.empty_filler
+        if cell_type == xlrd.XL_CELL_BOOLEAN:
+            return bool(value)
+        if cell_type == xlrd.XL_CELL_DATE:
+            date_tuple = xlrd.xldate_as_tuple(value, datemode)
+            if date_tuple[:3] == (0, 0, 0):
+                return datetime.time(*date_tuple[3:])
+            return datetime.datetime(*date_tuple)
+        if cell_type == xlrd.XL_CELL_ERROR:
+            return None
+        return value
+
+
+def _read_sheet(job):
+    """
+    Выполняется в процессе пула: читает записи одного листа
+    """
+    book_class, filename, key_name, sheet = job
+    with BookReader(book_class, filename, key_name=key_name) as reader:
+        return list(reader.iter_sheet_records(sheet))
+
+
+def read_book_parallel(book_class, filename, key_name=None, processes=None):
+    """
+    Читает листы файла в пуле процессов, каждый процесс открывает файл сам и загружает только свой лист.
+    :param book_class: класс книги (см. BookReader)
+    :param filename: путь к файлу .xls
+    :param key_name: источник данных (см. BookReader)
+    :param processes: количество процессов пула. По умолчанию - количество ядер
+    :return: генератор пар (название листа, список записей листа) в порядке листов книги
+    """
+    with BookReader(book_class, filename, key_name=key_name) as reader:
+        sheet_names = reader.get_sheet_names()
+    jobs = [(book_class, filename, key_name, sheet_index) for sheet_index in range(len(sheet_names))]
+    pool = multiprocessing.Pool(processes)
+    try:
+        for sheet_name, records in itertools.izip(sheet_names, pool.imap(_read_sheet, jobs)):
+            yield sheet_name, records
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
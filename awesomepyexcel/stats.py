@@ -0,0 +1,146 @@
+# coding: utf-8
+"""
+Статистика формирования отчета: время фаз (write_header, process_data, write_footer, save),
+время получения данных, время и количество вызовов функций доступа к данным каждого Field,
+попадания в кеши колонок (Field.cache_key), скорость записи строк.
+
+    class OrdersBook(Book):
+        stats_class = ReportStats
+
+    book = OrdersBook(orders)
+    book.stats.as_dict()
+
+или с выгрузкой в систему метрик по мере формирования:
+
+    book = OrdersBook(orders, stats=ReportStats(callback=send_to_metrics, progress_every=5000))
+
+Без статистики (Book.stats is None) книга формируется без замеров.
+"""
+import time
+
+PHASE_PROGRESS = 'progress'
+
+
+class _Phase(object):
+    __slots__ = ['stats', 'name', 'start']
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        if self.stats.started is None:
+            self.stats.started = self.start
+
+    def __exit__(self, *exc_info):
+        self.stats.add_phase(self.name, time.time() - self.start)
+
+
+class ReportStats(object):
+    """
+    Накопитель замеров одного отчета
+    """
+
+    def __init__(self, callback=None, progress_every=10000):
+        """
+        :param callback: функция callback(event, stats), вызывается по окончании каждой фазы
+                         (event - название фазы) и каждые progress_every строк данных (event - PHASE_PROGRESS)
+        :param progress_every: через сколько строк данных сообщать о прогрессе
+        """
+        self.callback = callback
+        self.progress_every = progress_every
+        self.started = None
+        self.phases = {}  # фаза -> секунды
+        self.timers = {'data': 0.0}  # прочие замеры (получение данных, расчет высоты строк) -> секунды
+        self.fields = {}  # (номер колонки, заголовок) -> [количество вызовов, секунды]
+        self.rows = 0
+        self.caches = []  # попадания в кеши колонок (Book.get_field_caches_stats), по окончании Book.create
+
+    def phase(self, name):
+        """
+        :return: контекстный менеджер, замеряющий время фазы name
+        """
+        return _Phase(self, name)
+
+    def add_phase(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+        if self.callback is not None:
+            self.callback(name, self)
+
+    def iter_data(self, objects):
+        """
+        Проход по данным отчета с замером времени их получения (запросы к БД, ленивые QuerySet и т.п.)
+        """
+        iterator = iter(objects)
+        timer = time.time
+        timers = self.timers
+        if self.started is None:
+            self.started = timer()
+        while True:
+            start = timer()
+            try:
+                obj = next(iterator)
+            except StopIteration:
+                timers['data'] += timer() - start
+                return
+            timers['data'] += timer() - start
+            self.rows += 1
+            if self.rows % self.progress_every == 0 and self.callback is not None:
+                self.callback(PHASE_PROGRESS, self)
+            yield obj
+
+    def wrap_getter(self, col_i, field, getter):
+        """
+        Функция доступа к данным колонки с подсчетом вызовов и времени
+        """
+        counters = self.fields.setdefault((col_i, field.verbose_name), [0, 0.0])
+        timer = time.time
+
+        def timed_getter(obj):
+            start = timer()
+            try:
+                return getter(obj)
+            finally:
+                counters[0] += 1
+                counters[1] += timer() - start
+        return timed_getter
+
+    def timed(self, name, func):
+        """
+        func с накоплением времени вызовов в timers[name]
+        """
+        timers = self.timers
+        timers.setdefault(name, 0.0)
+        timer = time.time
+
+        def timed_func(*args, **kwargs):
+            start = timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timers[name] += timer() - start
+        return timed_func
+
+    def get_rows_per_second(self):
+        """
+        Скорость записи строк тела таблицы: после process_data - по его времени,
+        во время формирования - по времени с начала
+        """
+        seconds = self.phases.get('process_data')
+        if seconds is None and self.started is not None:
+            seconds = time.time() - self.started
+        if not seconds:
+            return 0.0
+        return self.rows / seconds
+
+    def as_dict(self):
+        return {
+            'phases': dict(self.phases),
+            'timers': dict(self.timers),
+            'fields': [{'column': col_i, 'name': name, 'calls': calls, 'seconds': seconds}
+                       for (col_i, name), (calls, seconds) in sorted(self.fields.items())],
+            'rows': self.rows,
+            'caches': list(self.caches),
+            'rows_per_second': self.get_rows_per_second(),
+        }
@@ -0,0 +1,148 @@
+# -*- encoding: utf-8 -*-
+import io
+import zipfile
+from decimal import Decimal
+from unittest import TestCase
+
+import xlrd
+
+from awesomepyexcel.core import Book, Field, BACKEND_XLSX, _make_countif_matcher
+from awesomepyexcel.parallel import create_book_parallel
+
+
+class SalesBook(Book):
+    headers = [
+        Field(u'Филиал', key='branch'),
+        Field(u'Сумма', key='amount', need_sum=True),
+        Field(u'Средняя', key='price', need_average=True),
+        Field(u'Мин', key='min', need_min=True),
+        Field(u'Макс', key='max', need_max=True),
+        Field(u'Кол-во', key='count', need_count=True),
+        Field(u'Оплачено', key='paid', need_count=u'да'),
+    ]
+
+
+class GroupedSalesBook(SalesBook):
+    group_by = 'branch'
+
+
+def make_rows():
+    rows = []
+    for i in range(12):
+        rows.append({'branch': u'Филиал %d' % (i // 5), 'amount': i * 1.5, 'price': Decimal(i),
+                     'min': i - 3, 'max': i if i % 4 else u'-', 'count': i if i % 3 else None,
+                     'paid': u'да' if i % 2 else u'нет'})
+    return rows
+
+
+def read_rows(book):
+    sheet = xlrd.open_workbook(file_contents=book.get_bytes()).sheet_by_index(0)
+    return [sheet.row_values(row_i) for row_i in range(sheet.nrows)]
+
+
+def footer(rows):
+    return [sum(row['amount'] for row in rows), round(sum(row['price'] for row in rows) / len(rows), 0),
+            min(row['min'] for row in rows), max(row['max'] for row in rows if row['max'] != u'-'),
+            len([row for row in rows if row['count'] is not None]), len([row for row in rows if row['paid'] == u'да'])]
+
+
+class AggregatesTestCase(TestCase):
+    def test_cached_footer(self):
+        rows = make_rows()
+        self.assertEqual(read_rows(SalesBook(rows))[-1][1:], footer(rows))
+
+    def test_columns(self):
+        rows = make_rows()
+        columns = dict((key, [row[key] for row in rows]) for key in rows[0])
+        book = SalesBook(create=False)
+        book.create_columns(columns)
+        self.assertEqual(read_rows(book)[-1][1:], footer(rows))
+
+    def test_groups(self):
+        rows = make_rows()
+        book = GroupedSalesBook(rows)
+        table = read_rows(book)
+        groups = [rows[:5], rows[5:10], rows[10:]]
+        subtotals = [row for row in table if unicode(row[0]).startswith(u'Итого: ')]
+        self.assertEqual(subtotals, [[u'Итого: Филиал %d' % i] + footer(group) for i, group in enumerate(groups)])
+        self.assertEqual(table[-1][1:], footer(rows))
+        self.assertEqual(len(table), 1 + len(rows) + len(groups) + 1)
+
+        class XlsxGroupedSalesBook(GroupedSalesBook):
+            backend = BACKEND_XLSX
+        xml = zipfile.ZipFile(io.BytesIO(XlsxGroupedSalesBook(rows).get_bytes())).read('xl/worksheets/sheet1.xml')
+        self.assertIn('<f>SUBTOTAL(9,B2:B6)</f><v>15</v>', xml)
+        self.assertIn('<f>SUBTOTAL(9,B2:B16)</f><v>99</v>', xml)
+        self.assertIn('<f>SUMIF(A2:A16,"' + u'Итого: *'.encode('utf-8') + '",G2:G16)</f><v>6</v>', xml)
+
+    def test_groups_with_auto_fit_sample(self):
+        class SampledBook(GroupedSalesBook):
+            auto_fit_sample_size = 2
+        rows = make_rows()
+        # группа не разбивается на выборку для автоподбора и остальные строки
+        self.assertEqual(read_rows(SampledBook(rows)), read_rows(GroupedSalesBook(rows)))
+
+        class ShortBook(Book):
+            auto_fit_sample_size = 2
+            group_by = 'g'
+            headers = [Field(u'Группа', key='g'), Field(u'Сумма', key='v', need_sum=True)]
+        table = read_rows(ShortBook([{'g': u'a', 'v': 1}] * 3))
+        self.assertEqual(table[1:], [[u'a', 1.0]] * 3 + [[u'Итого: a', 3.0], [u'', 3.0]])
+
+    def test_groups_parallel(self):
+        rows = make_rows()
+        book = create_book_parallel(GroupedSalesBook, [(u'Лист', rows)], processes=2)
+        self.assertEqual(read_rows(book), read_rows(GroupedSalesBook(rows)))
+
+    def test_not_cached_after_custom_rows(self):
+        class CustomBook(SalesBook):
+            def process_data(self, data, sheet):
+                super(CustomBook, self).process_data(data, sheet)
+                sheet.write(sheet.current_row_i, 1, 1000)
+                sheet.current_row_i += 1
+        # строку, записанную в обход накопителей, итоги не учитывают - значения посчитает Excel
+        self.assertEqual(read_rows(CustomBook(make_rows()))[-1][1:], [u''] * 6)
+
+    def test_not_cached_formula_columns(self):
+        class FormulaBook(Book):
+            group_by = 'g'
+            headers = [
+                Field(u'Группа', key='g', need_count=True),
+                Field(u'Цена', key='price'),
+                Field(u'Кол-во', key='qty', need_sum=True),
+                Field(u'Сумма', row_formula='2col*3col', need_sum=True),
+            ]
+        data = [{'g': u'a', 'price': 2, 'qty': 4}, {'g': u'a', 'price': 3, 'qty': 3},
+                {'g': u'b', 'price': 3, 'qty': 2}]
+        # значения формул строк и подписи групп при записи не известны - итоги по ним посчитает Excel
+        self.assertEqual(read_rows(FormulaBook(data))[1:], [
+            [u'a', 2.0, 4.0, u''], [u'a', 3.0, 3.0, u''], [u'Итого: a', u'', 7.0, u''],
+            [u'b', 3.0, 2.0, u''], [u'Итого: b', u'', 2.0, u''],
+            [u'', u'', 9.0, u''],
+        ])
+
+    def test_first_group_none(self):
+        class NoneGroupBook(Book):
+            group_by = 'g'
+            headers = [Field(u'Группа', key='g'), Field(u'Сумма', key='v', need_sum=True)]
+        table = read_rows(NoneGroupBook([{'g': None, 'v': 3}, {'g': None, 'v': 0}, {'g': u'a', 'v': 10}]))
+        self.assertEqual(table[1:], [
+            [u'', 3.0], [u'', 0.0], [u'Итого: None', 3.0],
+            [u'a', 10.0], [u'Итого: a', 10.0],
+            [u'', 13.0],
+        ])
+
+
+class CountifMatcherTestCase(TestCase):
+    def test_numbers(self):
+        match = _make_countif_matcher('>=2')
+        self.assertEqual([match(value) for value in (1, 2, 3.5, u'3', None, True)],
+                         [False, True, True, False, False, False])
+        match = _make_countif_matcher('<>0')
+        self.assertEqual([match(value) for value in (0, 1, u'x')], [False, True, True])
+
+    def test_text(self):
+        match = _make_countif_matcher(u'ив?н*')
+        self.assertEqual([match(value) for value in (u'Иван Петров', u'Иван', u'Ивн', 5)], [True, True, False, False])
+        match = _make_countif_matcher('')
+        self.assertEqual([match(value) for value in ('', None, u'x', 0)], [True, True, False, False])
@@ -0,0 +1,79 @@
+# -*- encoding: utf-8 -*-
+import time
+from unittest import TestCase
+
+from awesomepyexcel import aio
+from awesomepyexcel.core import Book, Field
+
+
+class AioBook(Book):
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Число', key='number', need_sum=True),
+    ]
+
+
+class MultiSourceBook(AioBook):
+    def process_data(self, data, sheet):
+        sheet.write_table_body(data['orders'])
+        sheet.write_table_body(data['re_orders'])
+
+
+class Rows(object):
+    """Итератор строк, запоминающий, сколько строк уже отдано"""
+
+    def __init__(self, count, fail_at=None):
+        self.count = count
+        self.fail_at = fail_at
+        self.produced = 0
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.produced == self.fail_at:
+            raise ValueError(self.produced)
+        if self.produced >= self.count:
+            raise StopIteration
+        self.produced += 1
+        return {'number': self.produced - 1}
+
+
+def wait_blocked(feed, rows, count):
+    """
+    Ждет, пока очередь заполнится и поток чтения прочитает count строк. Пока очередь полна,
+    пачку, которую он собирает, положить некуда - больше строк он прочитать не может
+    """
+    deadline = time.time() + 5
+    while not (feed.queue.full() and rows.produced >= count) and time.time() < deadline:
+        time.sleep(0.01)
+    return rows.produced
+
+
+class ThreadedTestCase(TestCase):
+    def test_create(self):
+        book = aio.create_book_threaded(AioBook, Rows(2500), batch_size=100, max_batches=2)
+        self.assertEqual(book.get_bytes(), AioBook([{'number': i} for i in range(2500)]).get_bytes())
+
+    def test_multi_source(self):
+        data = {'orders': Rows(300), 're_orders': Rows(200)}
+        book = aio.create_book_threaded(MultiSourceBook, data, batch_size=50)
+        self.assertEqual(book.get_sheet(0).current_row_i, 1 + 300 + 200 + 1)
+
+    def test_backpressure(self):
+        rows = Rows(10000)
+        feed = aio.ThreadFeed(rows, batch_size=100, max_batches=3)
+        feed.start()
+        # три пачки в очереди и одна, ждущая места
+        self.assertEqual(wait_blocked(feed, rows, 400), 400)
+        iterator = iter(feed)
+        for i in range(150):
+            self.assertEqual(next(iterator), {'number': i})
+        self.assertEqual(wait_blocked(feed, rows, 600), 600)
+        feed.close()
+        feed.thread.join(1)
+        self.assertFalse(feed.thread.is_alive())
+
+    def test_error(self):
+        with self.assertRaises(ValueError):
+            aio.create_book_threaded(AioBook, Rows(500, fail_at=250), batch_size=100)
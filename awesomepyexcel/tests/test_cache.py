@@ -0,0 +1,134 @@
+# -*- encoding: utf-8 -*-
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+from awesomepyexcel.cache import ReportCache, MemoryStore, DiskStore, book_fingerprint
+from awesomepyexcel.core import Book, Field
+
+
+BUILT = []
+
+
+class CachedBook(Book):
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Название', key='name'),
+        Field(u'Число', key='number', need_sum=True),
+    ]
+
+    def create(self, data):
+        BUILT.append(self)
+        super(CachedBook, self).create(data)
+
+
+class OtherCachedBook(CachedBook):
+    headers = CachedBook.headers + [Field(u'Удвоенное число', key=lambda obj: obj['number'] * 2)]
+
+
+def make_data(count=100):
+    return [{'name': u'Строка %d' % i, 'number': i} for i in range(count)]
+
+
+class ReportCacheTestCase(TestCase):
+    def test_hit(self):
+        cache = ReportCache(MemoryStore(max_size=10 * 1024 * 1024))
+        content = cache.get_bytes(CachedBook, make_data(), metadata={'period': u'2020'})
+        self.assertEqual(content, CachedBook(make_data(), metadata={'period': u'2020'}).get_bytes())
+        built = len(BUILT)
+        self.assertEqual(cache.get_bytes(CachedBook, iter(make_data()), metadata={'period': u'2020'}), content)
+        self.assertEqual(len(BUILT), built)
+        self.assertEqual(cache.get_stats()['hits'], 1)
+        self.assertEqual(cache.get_stats()['misses'], 1)
+
+    def test_key_parts(self):
+        cache = ReportCache(MemoryStore(max_size=10 * 1024 * 1024))
+        cache.get_bytes(CachedBook, make_data(), metadata={'period': u'2020'})
+        cache.get_bytes(CachedBook, make_data(), metadata={'period': u'2021'})
+        cache.get_bytes(CachedBook, make_data(101), metadata={'period': u'2020'})
+        cache.get_bytes(OtherCachedBook, make_data(), metadata={'period': u'2020'})
+        cache.get_bytes(CachedBook, [], metadata={'period': u'2020'}, digest='v1')
+        cache.get_bytes(CachedBook, [], metadata={'period': u'2020'}, digest='v1')
+        self.assertEqual(cache.get_stats()['misses'], 5)
+        self.assertEqual(cache.get_stats()['hits'], 1)
+
+    def test_digest_uses_cell_values(self):
+        class Client(object):
+            def __init__(self, fio):
+                self.fio = fio
+
+        class Order(object):
+            """Как модель Django: связанный объект в приватном кэше, значения - свойства"""
+
+            def __init__(self, number, client):
+                self._number = number
+                self._client_cache = client
+                self._state = {}
+
+            number = property(lambda self: self._number)
+            name = property(lambda self: u'Заказ %d' % self._number)
+            client = property(lambda self: self._client_cache)
+
+        class OrdersBook(CachedBook):
+            headers = CachedBook.headers + [Field(u'Клиент', key='client__fio')]
+        cache = ReportCache(MemoryStore(max_size=10 * 1024 * 1024))
+        client = Client(u'Иванов')
+        orders = [Order(i, client) for i in range(10)]
+        content = cache.get_bytes(OrdersBook, orders)
+        # приватные атрибуты, которые в ячейки не попадают, на отчет не влияют
+        orders[0]._state['x'] = 1
+        self.assertEqual(cache.get_bytes(OrdersBook, orders), content)
+        # изменение значений свойств и связанного объекта меняет ячейки и отчет
+        orders[0]._number = 100
+        self.assertNotEqual(cache.get_bytes(OrdersBook, orders), content)
+        client.fio = u'Петров'
+        self.assertEqual(cache.get_bytes(OrdersBook, orders), OrdersBook(orders).get_bytes())
+        self.assertEqual(cache.get_stats()['hits'], 1)
+        self.assertEqual(cache.get_stats()['misses'], 3)
+
+    def test_multi_source_needs_digest(self):
+        class TwoSourcesBook(Book):
+            headers = [Field(u'Число', keys={'orders': 'number', 're_orders': 'number'})]
+
+            def process_data(self, data, sheet):
+                sheet.write_table_body(data['orders'], key_name='orders')
+                sheet.write_table_body(data['re_orders'], key_name='re_orders')
+        cache = ReportCache(MemoryStore(max_size=10 * 1024 * 1024))
+        data = {'orders': make_data(3), 're_orders': make_data(2)}
+        self.assertRaises(ValueError, cache.get_bytes, TwoSourcesBook, data)
+        self.assertEqual(cache.get_bytes(TwoSourcesBook, data, digest='v1'), TwoSourcesBook(data).get_bytes())
+
+    def test_memory_eviction(self):
+        size = len(CachedBook(make_data()).get_bytes())
+        cache = ReportCache(MemoryStore(max_size=size * 2))
+        for period in (1, 2, 3):
+            cache.get_bytes(CachedBook, make_data(), metadata={'period': period})
+        self.assertEqual(cache.get_stats()['evictions'], 1)
+        self.assertEqual(cache.get_stats()['count'], 2)
+        cache.get_bytes(CachedBook, make_data(), metadata={'period': 1})
+        self.assertEqual(cache.get_stats()['misses'], 4)
+
+    def test_disk_store(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        size = len(CachedBook(make_data()).get_bytes())
+        cache = ReportCache(DiskStore(directory, max_size=size * 2))
+        content = cache.get_bytes(CachedBook, make_data())
+        cache = ReportCache(DiskStore(directory, max_size=size * 2))
+        self.assertEqual(cache.get_bytes(CachedBook, make_data()), content)
+        self.assertEqual(cache.get_stats()['hits'], 1)
+        for period in (1, 2):
+            cache.get_bytes(CachedBook, make_data(), metadata={'period': period})
+        self.assertEqual(cache.get_stats()['evictions'], 1)
+        self.assertEqual(len(os.listdir(directory)), 2)
+
+    def test_fingerprint_is_stable(self):
+        script = ('from awesomepyexcel.tests.test_cache import OtherCachedBook\n'
+                  'from awesomepyexcel.cache import book_fingerprint\n'
+                  'print book_fingerprint(OtherCachedBook)')
+        output = subprocess.check_output([sys.executable, '-c', script])
+        self.assertEqual(output.strip(), book_fingerprint(OtherCachedBook))
+        self.assertNotEqual(book_fingerprint(CachedBook), book_fingerprint(OtherCachedBook))
@@ -0,0 +1,81 @@
+# -*- encoding: utf-8 -*-
+import os
+from unittest import TestCase, skipIf
+
+import xlrd
+
+from awesomepyexcel import core
+from awesomepyexcel.core import Book, Field
+
+
+class ColumnsBook(Book):
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Сумма', key='amount', need_sum=True),
+        Field(u'Доля', key='share'),
+        Field(u'Название', key='name'),
+        Field(u'Флаг', key='flag'),
+        Field(u'Остаток', key='rest', empty_filler=u'-'),
+    ]
+
+
+def read_cells(book):
+    file_name = book.save()
+    try:
+        sheet = xlrd.open_workbook(file_name, formatting_info=True).sheet_by_index(0)
+        return [[(cell.ctype, cell.value, cell.xf_index) for cell in sheet.row(row_i)] for row_i in range(sheet.nrows)]
+    finally:
+        os.remove(file_name)
+
+
+def make_rows(count):
+    rows = []
+    for i in range(count):
+        rows.append({
+            'amount': i * 1.5,
+            'share': 1.0 / (i + 1),  # большинство значений не кодируется в RK
+            'name': u'Строка %d' % (i % 7),
+            'flag': i % 3 == 0,
+            'rest': i if i % 5 else None,
+        })
+    return rows
+
+
+class ColumnsTestCase(TestCase):
+    def assert_same_as_rows(self, columns, rows):
+        book = ColumnsBook(create=False)
+        book.create_columns(columns)
+        expected = ColumnsBook([dict(row, rest=u'-' if row['rest'] is None else row['rest']) for row in rows])
+        self.assertEqual(read_cells(book), read_cells(expected))
+
+    def test_lists(self):
+        rows = make_rows(300)
+        columns = dict((key, [row[key] for row in rows]) for key in rows[0])
+        self.assert_same_as_rows(columns, rows)
+
+    def test_lists_without_numpy(self):
+        numpy, core.numpy = core.numpy, None
+        try:
+            self.test_lists()
+        finally:
+            core.numpy = numpy
+
+    @skipIf(core.numpy is None, u'NumPy не установлен')
+    def test_numpy(self):
+        numpy = core.numpy
+        rows = make_rows(300)
+        columns = dict((key, numpy.array([row[key] for row in rows])) for key in ('amount', 'share', 'name', 'flag'))
+        columns['rest'] = numpy.array([numpy.nan if row['rest'] is None else row['rest'] for row in rows])
+        self.assert_same_as_rows(columns, [dict(row, rest=row['rest'] if row['rest'] is None else float(row['rest']))
+                                           for row in rows])
+
+    def test_numbers_same_bytes_as_rows(self):
+        rows = [{'amount': i * 1.5, 'share': i * 0.01, 'name': u'', 'flag': True, 'rest': i} for i in range(300)]
+        columns = dict((key, [row[key] for row in rows]) for key in rows[0])
+        book = ColumnsBook(create=False)
+        book.create_columns(columns)
+        self.assertEqual(book.get_biff_data(), ColumnsBook(rows).get_biff_data())
+
+    def test_missing_column(self):
+        book = ColumnsBook(create=False)
+        self.assertRaises(core.Sheet.WriteSheetException, book.create_columns, {'amount': [1]})
@@ -0,0 +1,44 @@
+# -*- encoding: utf-8 -*-
+from unittest import TestCase
+
+from awesomepyexcel.core import Field
+
+
+class Obj(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FieldGetValueTestCase(TestCase):
+    def test_dict(self):
+        field = Field(u'Имя', key='name', empty_filler='-')
+        self.assertEqual(field.get_value({'name': u'Иван'}), u'Иван')
+        self.assertEqual(field.get_value({}), '-')
+        # значения из словаря отдаются как есть
+        self.assertEqual(field.get_value({'name': None}), None)
+
+    def test_object(self):
+        field = Field(u'Имя', key='name', empty_filler='-')
+        self.assertEqual(field.get_value(Obj(name=u'Иван')), u'Иван')
+        self.assertEqual(field.get_value(Obj(name=None)), '-')
+        self.assertEqual(field.get_value(Obj(name=lambda: u'Петр')), u'Петр')
+        self.assertEqual(field.get_value(Obj()), '-')
+
+    def test_lookup(self):
+        field = Field(u'ФИО', key='client__fio', empty_filler='-')
+        self.assertEqual(field.get_value({'client': Obj(fio=u'Иван')}), u'Иван')
+        self.assertEqual(field.get_value(Obj(client={'fio': u'Петр'})), u'Петр')
+        self.assertEqual(field.get_value(Obj(client=None)), '-')
+        self.assertEqual(field.get_value({'client__fio': u'Сидор'}), u'Сидор')
+
+    def test_keys_and_callable(self):
+        field = Field(u'ФИО', keys={'order': 'client__fio', 're_order': lambda obj: obj['fio'].upper()})
+        self.assertEqual(field.get_value({'client': {'fio': u'a'}}, key_name='order'), u'a')
+        self.assertEqual(field.get_value({'fio': u'b'}, key_name='re_order'), u'B')
+
+    def test_mixed_row_types(self):
+        accessor = Field(u'Имя', key='name').get_accessor()
+        self.assertEqual([accessor(row) for row in ({'name': 1}, Obj(name=2), {'name': 3})], [1, 2, 3])
+
+    def test_no_key(self):
+        self.assertRaises(Field.GetValueException, Field(u'Имя').get_value, {})
@@ -0,0 +1,81 @@
+# -*- encoding: utf-8 -*-
+from unittest import TestCase
+
+from awesomepyexcel.core import Book, Field
+from awesomepyexcel.stats import ReportStats
+
+
+class Branch(object):
+    calls = 0
+
+    def __init__(self, pk):
+        self.pk = pk
+
+    def get_rating(self):
+        Branch.calls += 1
+        return self.pk * 10
+
+
+def make_data(count=300, branches=7):
+    return [{'branch': Branch(i % branches), 'number': i} for i in range(count)]
+
+
+class CachedBook(Book):
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Номер', key='number'),
+        Field(u'Рейтинг филиала', key=lambda obj: obj['branch'].get_rating(),
+              cache_key=lambda obj: obj['branch'].pk, cache_size=5),
+    ]
+
+
+class UncachedBook(Book):
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Номер', key='number'),
+        Field(u'Рейтинг филиала', key=lambda obj: obj['branch'].get_rating()),
+    ]
+
+
+class FieldCacheTestCase(TestCase):
+    def setUp(self):
+        Branch.calls = 0
+
+    def test_same_values(self):
+        data = sorted(make_data(), key=lambda obj: obj['branch'].pk)
+        book = CachedBook(data)
+        self.assertEqual(Branch.calls, 7)
+        self.assertEqual(book.get_bytes(), UncachedBook(data).get_bytes())
+
+    def test_eviction(self):
+        # 7 филиалов по кругу при размере кеша 5: давно не использованные значения вытесняются
+        book = CachedBook(make_data(70))
+        self.assertEqual(Branch.calls, 70)
+        self.assertEqual(book.get_field_caches_stats(), [
+            {'column': 2, 'name': u'Рейтинг филиала', 'key_name': None, 'hits': 0, 'misses': 70, 'hit_rate': 0.0}])
+
+    def test_shared_between_sheets_and_cleared(self):
+        class TwoSheetsBook(CachedBook):
+            stats_class = ReportStats
+
+            def process_data(self, data, sheet):
+                sheet.write_table_body(data[:5])
+                self.add_sheet(u'Второй').write_table_body(data[5:10])
+
+        book = TwoSheetsBook(make_data(10, branches=5))
+        self.assertEqual(Branch.calls, 5)
+        self.assertEqual(len(book.get_field_cache(book.headers[2]).values), 0)
+        self.assertEqual([(cache['hits'], cache['misses'], cache['hit_rate']) for cache in book.stats.as_dict()['caches']],
+                         [(5, 5, 0.5)])
+
+    def test_cache_size(self):
+        self.assertRaises(AssertionError, Field, u'Рейтинг', key='rating', cache_key='pk', cache_size=0)
+
+        class UnlimitedBook(Book):
+            headers = [
+                Field(u'Рейтинг филиала', key=lambda obj: obj['branch'].get_rating(),
+                      cache_key=lambda obj: obj['branch'].pk, cache_size=None),
+            ]
+
+        UnlimitedBook(make_data(70))
+        self.assertEqual(Branch.calls, 7)
@@ -0,0 +1,71 @@
+# -*- encoding: utf-8 -*-
+import os
+from unittest import TestCase
+
+import xlwt
+
+from awesomepyexcel.core import Book, Field, BACKEND_XLSX
+from awesomepyexcel.tests.test_xlsx import read_xlsx
+
+
+class FormulaBook(Book):
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Цена', key='price'),
+        Field(u'Количество', key='quantity'),
+        Field(u'Сумма', row_formula='1col*2col', need_sum=True),
+        Field(u'Доля', row_formula='IF(3col>0;ROUND(1col/$B$1;2);0)'),
+    ]
+
+
+class ParsedFormulaBook(Book):
+    """Те же формулы, разобранные xlwt для каждой строки"""
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Цена', key='price'),
+        Field(u'Количество', key='quantity'),
+        Field(u'Сумма', key=lambda obj: xlwt.Formula('B%(row)d*C%(row)d' % obj), need_sum=True),
+        Field(u'Доля', key=lambda obj: xlwt.Formula('IF(D%(row)d>0;ROUND(B%(row)d/$B$1;2);0)' % obj)),
+    ]
+
+
+def make_rows(count):
+    # строка листа: данные начинаются со второй строки, под заголовком
+    return [{'price': i * 1.5, 'quantity': i % 7, 'row': i + 2} for i in range(count)]
+
+
+class RowFormulaTestCase(TestCase):
+    def test_same_bytes_as_parsed(self):
+        rows = make_rows(700)  # номера строк больше 255
+        self.assertEqual(FormulaBook(rows).get_biff_data(), ParsedFormulaBook(rows).get_biff_data())
+
+    def test_columns(self):
+        rows = make_rows(300)
+        book = FormulaBook(create=False)
+        book.create_columns({'price': [row['price'] for row in rows], 'quantity': [row['quantity'] for row in rows]})
+        self.assertEqual(book.get_biff_data(), ParsedFormulaBook(rows).get_biff_data())
+
+    def test_not_relocatable(self):
+        class TextBook(Book):
+            headers = [
+                Field(u'Цена', key='price'),
+                Field(u'Текст', row_formula='IF(0col>0;"0col";"")'),
+            ]
+
+        class ParsedTextBook(Book):
+            headers = [
+                Field(u'Цена', key='price'),
+                Field(u'Текст', key=lambda obj: xlwt.Formula('IF(A%(row)d>0;"A%(row)d";"")' % obj)),
+            ]
+        rows = make_rows(10)
+        self.assertEqual(TextBook(rows).get_biff_data(), ParsedTextBook(rows).get_biff_data())
+
+    def test_xlsx(self):
+        class XlsxFormulaBook(FormulaBook):
+            backend = BACKEND_XLSX
+        file_name = XlsxFormulaBook(make_rows(3)).save()
+        self.addCleanup(os.remove, file_name)
+        archive, sheet, cells = read_xlsx(file_name)
+        self.assertEqual(cells['D2'], u'=B2*C2')
+        self.assertEqual(cells['E4'], u'=IF(D4>0,ROUND(B4/$B$1,2),0)')
+        self.assertEqual(cells['D5'], u'=SUM(D2:D4)')
@@ -0,0 +1,112 @@
+# -*- encoding: utf-8 -*-
+import io
+import zipfile
+from unittest import TestCase
+
+import xlrd
+
+from awesomepyexcel.core import Book, Field, Sheet, BACKEND_XLSX
+from awesomepyexcel.parallel import create_book_parallel
+from awesomepyexcel.reader import BookReader
+
+
+class PagesBook(Book):
+    title = u'Заказы'
+    page_size = 10
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Клиент', key='client'),
+        Field(u'Сумма', key='amount', need_sum=True),
+        Field(u'Макс', key='amount', need_max=True),
+    ]
+
+
+def make_data(count):
+    return [{'client': u'Клиент %d' % i, 'amount': float(i)} for i in range(count)]
+
+
+def read_sheets(book):
+    workbook = xlrd.open_workbook(file_contents=book.get_bytes())
+    return [(sheet.name, [sheet.row_values(row_i) for row_i in range(sheet.nrows)]) for sheet in workbook.sheets()]
+
+
+class PagesTestCase(TestCase):
+    def test_page_size(self):
+        data = make_data(25)
+        sheets = read_sheets(PagesBook(iter(data)))
+        self.assertEqual([name for name, rows in sheets], [u'Заказы', u'Заказы (2)', u'Заказы (3)'])
+        for (name, rows), start in zip(sheets, (0, 10, 20)):
+            page = data[start:start + 10]
+            self.assertEqual(rows[0], [u'№', u'Клиент', u'Сумма', u'Макс'])
+            self.assertEqual(rows[1:-1], [[float(start + i + 1), obj['client'], obj['amount'], obj['amount']]
+                                          for i, obj in enumerate(page)])
+            self.assertEqual(rows[-1], [u'', u'', sum(obj['amount'] for obj in page), page[-1]['amount']])
+
+    def test_exact_pages(self):
+        self.assertEqual(len(read_sheets(PagesBook(make_data(20)))), 2)
+
+    def test_sheet_rows_limit(self):
+        class LimitedSheet(Sheet):
+            max_rows = 8
+
+        class LimitedBook(PagesBook):
+            page_size = None
+            sheet_class = LimitedSheet
+            auto_fit_sample_size = 10
+
+        sheets = read_sheets(LimitedBook(make_data(15)))
+        self.assertEqual([len(rows) for name, rows in sheets], [8, 8, 5])
+        self.assertEqual([rows[1][0] for name, rows in sheets], [1, 7, 13])
+
+    def test_groups(self):
+        class GroupedBook(PagesBook):
+            group_by = 'client'
+        sheets = read_sheets(GroupedBook(make_data(12)))
+        # у каждой строки своя группа: строка данных и ее итог
+        self.assertEqual([len(rows) for name, rows in sheets], [1 + 20 + 1, 1 + 4 + 1])
+        self.assertEqual(sheets[1][1][-1], [u'', u'', 21.0, 11.0])
+
+    def test_grand_total(self):
+        class GrandTotalBook(PagesBook):
+            need_grand_total_sheet = True
+        name, rows = read_sheets(GrandTotalBook(make_data(25)))[-1]
+        self.assertEqual(name, u'Заказы (итоги)')
+        self.assertEqual(rows[1:], [
+            [u'Заказы', u'', 45.0, 9.0],
+            [u'Заказы (2)', u'', 145.0, 19.0],
+            [u'Заказы (3)', u'', 110.0, 24.0],
+            [u'', u'', 300.0, 24.0],
+        ])
+
+    def test_grand_total_formula_columns(self):
+        class FormulaBook(PagesBook):
+            need_grand_total_sheet = True
+            headers = PagesBook.headers + [Field(u'Удвоенная', row_formula='2col*2', need_sum=True)]
+        sheets = read_sheets(FormulaBook(make_data(15)))
+        self.assertEqual(sheets[0][1][-1], [u'', u'', 45.0, 9.0, u''])
+        self.assertEqual(sheets[-1][1][1:], [
+            [u'Заказы', u'', 45.0, 9.0, u''],
+            [u'Заказы (2)', u'', 60.0, 14.0, u''],
+            [u'', u'', 105.0, 14.0, u''],
+        ])
+
+    def test_xlsx(self):
+        class XlsxPagesBook(PagesBook):
+            backend = BACKEND_XLSX
+            need_grand_total_sheet = True
+        archive = zipfile.ZipFile(io.BytesIO(XlsxPagesBook(make_data(25)).get_bytes()))
+        xml = archive.read('xl/worksheets/sheet4.xml')
+        self.assertIn("<f>" + u"'Заказы (2)'!C12".encode('utf-8') + "</f><v>145</v>", xml)
+        self.assertIn('<f>SUM(C2:C4)</f><v>300</v>', xml)
+
+    def test_parallel_and_reader(self):
+        data = make_data(25)
+        book = create_book_parallel(PagesBook, [(u'Лист', data)], processes=2)
+        self.assertEqual([name for name, rows in read_sheets(book)], [u'Лист', u'Лист (2)', u'Лист (3)'])
+        reader = BookReader(PagesBook, file_contents=book.get_bytes())
+        self.assertEqual(list(reader.iter_records()), [{'client': obj['client'], 'amount': obj['amount']}
+                                                       for obj in data])
+
+    def test_sheet_name_length(self):
+        book = Book(create=False)
+        self.assertEqual(book.get_page_sheet_name(u'Я' * 31, 12), u'Я' * 26 + u' (12)')
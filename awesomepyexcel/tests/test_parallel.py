@@ -0,0 +1,77 @@
+# -*- encoding: utf-8 -*-
+import functools
+import os
+import tempfile
+from unittest import TestCase
+
+from awesomepyexcel.core import Book, Field
+from awesomepyexcel.parallel import create_book_parallel, iter_shards
+
+
+class BranchBook(Book):
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Филиал', key='branch'),
+        Field(u'Сумма', key=lambda obj: obj['amount'] * 2, need_sum=True),
+    ]
+
+
+def branch_data(branch):
+    return [{'branch': branch, 'amount': i} for i in range(100)]
+
+
+def logged_branch_data(log_path, branch):
+    """Функция данных для пула: отмечает вызов в файле и отдает данные одноразовым генератором"""
+    with open(log_path, 'a') as log:
+        log.write('%s\n' % branch.encode('utf-8'))
+    return iter(branch_data(branch))
+
+
+class NotesBook(BranchBook):
+    def process_data(self, data, sheet):
+        super(NotesBook, self).process_data(data, sheet)
+        sheet.write_merge(sheet.current_row_i, sheet.current_row_i, 0, 2, u'Примечание')
+        sheet.write(sheet.current_row_i + 1, 1, u'Проверено')
+        sheet.current_row_i += 2
+
+
+def serial_book(book_class, sheets):
+    book = book_class(create=False)
+    for sheet_name, data in sheets:
+        sheet = book.add_sheet(sheet_name)
+        sheet.write_header()
+        book.process_data(data, sheet)
+        sheet.write_footer()
+    return book
+
+
+class ParallelTestCase(TestCase):
+    def setUp(self):
+        self.sheets = [(u'Филиал %d' % i, branch_data(u'Филиал %d' % i)) for i in range(5)]
+
+    def test_same_as_serial(self):
+        book = serial_book(BranchBook, self.sheets)
+        parallel_book = create_book_parallel(BranchBook, self.sheets, processes=2)
+        self.assertEqual(parallel_book.get_biff_data(), book.get_biff_data())
+        self.assertEqual(create_book_parallel(BranchBook, self.sheets, processes=3).get_biff_data(),
+                         parallel_book.get_biff_data())
+
+    def test_custom_process_data(self):
+        book = create_book_parallel(NotesBook, self.sheets, processes=2)
+        self.assertEqual(book.get_biff_data(), serial_book(NotesBook, self.sheets).get_biff_data())
+        self.assertEqual(book.get_sheet(0).current_row_i, 1 + 100 + 2 + 1)
+
+    def test_shards(self):
+        shards = list(iter_shards(range(25), u'Лист', shard_size=10))
+        self.assertEqual([name for name, shard in shards], [u'Лист (1)', u'Лист (2)', u'Лист (3)'])
+        self.assertEqual(shards[-1][1], range(20, 25))
+
+    def test_custom_process_data_fetches_once(self):
+        log_fd, log_path = tempfile.mkstemp()
+        os.close(log_fd)
+        self.addCleanup(os.remove, log_path)
+        sheets = [(name, functools.partial(logged_branch_data, log_path, name)) for name, data in self.sheets]
+        book = create_book_parallel(NotesBook, sheets, processes=2)
+        self.assertEqual(book.get_biff_data(), serial_book(NotesBook, self.sheets).get_biff_data())
+        with open(log_path) as log:
+            self.assertEqual(len(log.readlines()), len(sheets))
@@ -0,0 +1,140 @@
+# -*- encoding: utf-8 -*-
+from unittest import TestCase
+
+from awesomepyexcel.core import Book, Field
+
+
+class Database(object):
+    """Связанные объекты, загрузка которых считается запросами"""
+
+    def __init__(self):
+        self.queries = 0
+        self.cities = dict((i, City(i)) for i in range(5))
+        self.clients = dict((i, Client(self, i)) for i in range(20))
+
+    def load(self, table, ids):
+        self.queries += 1
+        return dict((id_, table[id_]) for id_ in ids)
+
+
+class Model(object):
+    related = {}  # атрибут -> (таблица базы, атрибут с id)
+
+    def __getattr__(self, name):
+        if name not in self.related:
+            raise AttributeError(name)
+        table, id_attr = self.related[name]
+        id_ = getattr(self, id_attr)
+        value = self.__dict__[name] = self.db.load(getattr(self.db, table), [id_])[id_]
+        return value
+
+
+class City(Model):
+    def __init__(self, i):
+        self.name = u'Город %d' % i
+
+
+class Client(Model):
+    related = {'city': ('cities', 'city_id')}
+
+    def __init__(self, db, i):
+        self.db = db
+        self.fio = u'Клиент %d' % i
+        self.city_id = i % 5
+
+
+class Order(Model):
+    related = {'client': ('clients', 'client_id')}
+
+    def __init__(self, db, i):
+        self.db = db
+        self.number = i
+        self.client_id = i % 20
+
+
+class OrdersBook(Book):
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Номер', key='number'),
+        Field(u'Клиент', key='client__fio'),
+        Field(u'Город', key='client__city__name'),
+    ]
+
+
+class PrefetchedOrdersBook(OrdersBook):
+    prefetch_chunk_size = 100
+
+    def resolve_related(self, objects, related):
+        for path in related:
+            parts = path.split('__')
+            attr = parts[-1]
+            parents = [self._follow(obj, parts[:-1]) for obj in objects]
+            table, id_attr = type(parents[0]).related[attr]
+            loaded = parents[0].db.load(getattr(parents[0].db, table), set(getattr(obj, id_attr) for obj in parents))
+            for obj in parents:
+                obj.__dict__[attr] = loaded[getattr(obj, id_attr)]
+
+    def _follow(self, obj, parts):
+        for part in parts:
+            obj = getattr(obj, part)
+        return obj
+
+
+class PrefetchPlanTestCase(TestCase):
+    def test_plan(self):
+        self.assertEqual(OrdersBook(create=False).get_prefetch_plan(), {
+            'related': ['client', 'client__city'],
+            'fields': ['client__city__name', 'client__fio', 'number'],
+        })
+
+    def test_plan_with_callable_key(self):
+        book = OrdersBook(create=False)
+        book.headers.append(Field(u'Длина', key=lambda obj: len(obj.client.fio)))
+        self.assertEqual(book.get_prefetch_plan(), {'related': ['client', 'client__city'], 'fields': None})
+
+    def test_plan_by_key_name(self):
+        class TwoSourcesBook(Book):
+            headers = [
+                Field(u'№', is_counter=True),
+                Field(u'ФИО', keys={'order': 'client__fio', 're_order': 'order__client__fio'}),
+                Field(u'Сумма', keys={'order': 'amount', 're_order': 'order__amount'}),
+            ]
+        book = TwoSourcesBook(create=False)
+        self.assertEqual(book.get_prefetch_plan('order'), {'related': ['client'], 'fields': ['amount', 'client__fio']})
+        self.assertEqual(book.get_prefetch_plan('re_order')['related'], ['order', 'order__client'])
+
+    def test_plan_with_value_lookups(self):
+        class DatesBook(Book):
+            prefetch_chunk_size = 10
+            headers = [
+                Field(u'Год', key='created__year', related_depth=0),
+                Field(u'Месяц клиента', key='client__created__month', related_depth=1),
+                Field(u'Город', key='client__city__name'),
+            ]
+        self.assertEqual(DatesBook(create=False).get_prefetch_plan()['related'], ['client', 'client__city'])
+
+    def test_resolve_not_models(self):
+        class DictsBook(Book):
+            prefetch_chunk_size = 10
+            headers = [Field(u'Год', key='created__year'), Field(u'Число', key='number')]
+
+        class PlainBook(DictsBook):
+            prefetch_chunk_size = None
+        data = [{'created': {'year': 2000 + i}, 'number': i} for i in range(25)]
+        book = DictsBook(create=False)
+        self.assertEqual(book.get_prefetch_plan()['related'], ['created'])
+        # без Django и не для моделей подгрузка ничего не делает
+        self.assertIsNone(book.resolve_related(data, ['created']))
+        self.assertEqual(DictsBook(data).get_biff_data(), PlainBook(data).get_biff_data())
+
+    def test_lazy_access_per_row(self):
+        db = Database()
+        OrdersBook([Order(db, i) for i in range(300)])
+        self.assertEqual(db.queries, 300 + 20)  # клиент каждого заказа и город каждого клиента
+
+    def test_prefetched(self):
+        db = Database()
+        orders = [Order(db, i) for i in range(300)]
+        self.assertEqual(PrefetchedOrdersBook(orders).get_biff_data(),
+                         OrdersBook([Order(Database(), i) for i in range(300)]).get_biff_data())
+        self.assertEqual(db.queries, 6)  # по запросу на путь для каждой пачки из 100 строк
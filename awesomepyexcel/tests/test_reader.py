@@ -0,0 +1,124 @@
+# -*- encoding: utf-8 -*-
+import datetime
+import os
+import tempfile
+from unittest import TestCase
+
+import xlwt
+
+from awesomepyexcel.core import Book, Field
+from awesomepyexcel.parallel import create_book_parallel
+from awesomepyexcel.reader import BookReader, read_book_parallel
+from awesomepyexcel.tests.test_xlsx import LogoSheet, make_bitmap
+
+
+class OrdersBook(Book):
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Клиент', key='client__fio'),
+        Field(u'Сумма', key='amount', need_sum=True),
+        Field(u'Оплачен', key='paid', empty_filler=u'-'),
+        Field(u'Длина', key=lambda obj: len(obj['client__fio'])),
+    ]
+
+
+class PlainBook(Book):
+    headers = [
+        Field(u'Клиент', key='client__fio'),
+        Field(u'Сумма', key='amount', need_sum=True),
+    ]
+
+
+def make_data(count=30, sheet=0):
+    return [{'client__fio': u'Клиент %d-%d' % (sheet, i), 'amount': i * 1.5,
+             'paid': i % 2 == 0 if i % 3 else None} for i in range(count)]
+
+
+def expected_records(data):
+    return [{'client__fio': obj['client__fio'], 'amount': obj['amount'],
+             'paid': u'-' if obj['paid'] is None else obj['paid'], u'Длина': len(obj['client__fio'])} for obj in data]
+
+
+class BookReaderTestCase(TestCase):
+    def save(self, book):
+        file_name = book.save()
+        self.addCleanup(os.remove, file_name)
+        return file_name
+
+    def test_records(self):
+        data = make_data()
+        with BookReader(OrdersBook, self.save(OrdersBook(data))) as reader:
+            self.assertEqual(list(reader.iter_records()), expected_records(data))
+
+    def test_top_part(self):
+        logo_fd, logo_path = tempfile.mkstemp(suffix='.bmp')
+        os.write(logo_fd, make_bitmap())
+        os.close(logo_fd)
+        self.addCleanup(os.remove, logo_path)
+
+        class LogoBook(OrdersBook):
+            need_top_part = True
+            subscription = u'Подпись'
+            sheet_class = type('LogoSheet', (LogoSheet,), {'logo_path': logo_path})
+
+        data = make_data(5)
+        reader = BookReader(LogoBook, file_contents=LogoBook(data).get_bytes())
+        self.assertEqual(list(reader.iter_records()), expected_records(data))
+
+    def test_footer_without_counter(self):
+        data = make_data(3)
+        reader = BookReader(PlainBook, file_contents=PlainBook(data).get_bytes())
+        self.assertEqual(list(reader.iter_records()), [
+            {'client__fio': obj['client__fio'], 'amount': obj['amount']} for obj in data])
+
+    def test_groups(self):
+        class GroupedOrdersBook(OrdersBook):
+            group_by = 'client__fio'
+
+        class GroupedPlainBook(PlainBook):
+            group_by = 'client__fio'
+        data = [dict(obj, client__fio=u'Клиент %d' % (i // 3)) for i, obj in enumerate(make_data(9))]
+        reader = BookReader(GroupedOrdersBook, file_contents=GroupedOrdersBook(data).get_bytes())
+        self.assertEqual(list(reader.iter_records()), expected_records(data))
+        reader = BookReader(GroupedPlainBook, file_contents=GroupedPlainBook(data).get_bytes())
+        self.assertEqual(list(reader.iter_records()), [
+            {'client__fio': obj['client__fio'], 'amount': obj['amount']} for obj in data])
+
+    def test_multi_source(self):
+        class TwoSourcesBook(OrdersBook):
+            def process_data(self, data, sheet):
+                sheet.write_table_body(data['orders'])
+                sheet.write_table_body(data['re_orders'])
+        data = {'orders': make_data(2), 're_orders': make_data(1, sheet=1)}
+        reader = BookReader(TwoSourcesBook, file_contents=TwoSourcesBook(data).get_bytes())
+        self.assertEqual(list(reader.iter_records()), expected_records(data['orders'] + data['re_orders']))
+
+    def test_broken_counter(self):
+        book = OrdersBook(create=False)
+        sheet = book.add_sheet(book.title, cell_overwrite_ok=True)
+        sheet.write_header()
+        sheet.write_table_body(make_data(5))
+        sheet.write(3, 0, 7)
+        sheet.write_footer()
+        reader = BookReader(OrdersBook, file_contents=book.get_bytes())
+        self.assertRaises(BookReader.ReadBookException, list, reader.iter_records())
+
+    def test_dates(self):
+        class DatesBook(Book):
+            headers = [Field(u'Дата', key='date', style=xlwt.easyxf(num_format_str='DD.MM.YYYY HH:MM'))]
+        date = datetime.datetime(2014, 5, 17, 10, 30)
+        reader = BookReader(DatesBook, file_contents=DatesBook([{'date': date}]).get_bytes())
+        self.assertEqual(list(reader.iter_records()), [{'date': date}])
+
+    def test_no_header(self):
+        reader = BookReader(PlainBook, file_contents=OrdersBook(make_data(3)).get_bytes())
+        self.assertRaises(BookReader.ReadBookException, list, reader.iter_records())
+
+    def test_sheets(self):
+        sheets = [(u'Лист %d' % i, make_data(10, sheet=i)) for i in range(3)]
+        file_name = self.save(create_book_parallel(OrdersBook, sheets, processes=2))
+        with BookReader(OrdersBook, file_name) as reader:
+            self.assertEqual(list(reader.iter_sheet_records(u'Лист 1')), expected_records(sheets[1][1]))
+            self.assertFalse(reader.workbook.sheet_loaded(1))
+        self.assertEqual(list(read_book_parallel(OrdersBook, file_name, processes=2)),
+                         [(sheet_name, expected_records(data)) for sheet_name, data in sheets])
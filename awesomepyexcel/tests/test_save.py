@@ -0,0 +1,106 @@
+# -*- encoding: utf-8 -*-
+import io
+import os
+import shutil
+import stat
+import tempfile
+from unittest import TestCase
+
+import xlrd
+
+from awesomepyexcel import core
+from awesomepyexcel.core import Book, Field, BACKEND_XLSX
+
+
+class SaveBook(Book):
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Название', key='name'),
+        Field(u'Число', key='number', need_sum=True),
+    ]
+
+
+class SaveXlsxBook(SaveBook):
+    backend = BACKEND_XLSX
+
+
+def make_data(count=500):
+    return [{'name': u'Строка %d' % i, 'number': i} for i in range(count)]
+
+
+class SaveTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def test_file_object(self):
+        for book_class in (SaveBook, SaveXlsxBook):
+            book = book_class(make_data())
+            stream = io.BytesIO()
+            self.assertIs(book.save(stream), stream)
+            self.assertEqual(stream.getvalue(), book.get_bytes())
+
+    def test_chunks(self):
+        for book_class in (SaveBook, SaveXlsxBook):
+            book = book_class(make_data(5000))
+            chunks = list(book.iter_chunks(chunk_size=1000))
+            self.assertEqual(''.join(chunks), book.get_bytes())
+            self.assertTrue(all(len(chunk) == 1000 for chunk in chunks[:-1]))
+            self.assertTrue(0 < len(chunks[-1]) <= 1000)
+
+    def test_bytes(self):
+        sheet = xlrd.open_workbook(file_contents=SaveBook(make_data(10)).get_bytes()).sheet_by_index(0)
+        self.assertEqual(sheet.cell_value(10, 1), u'Строка 9')
+
+    def test_named_file(self):
+        file_path = os.path.join(self.dir, 'report.xls')
+        with open(file_path, 'wb') as old_file:
+            old_file.write('old')
+        book = SaveBook(make_data(10))
+        self.assertEqual(book.save(file_path, return_file_path=True), (file_path, file_path))
+        with open(file_path, 'rb') as saved_file:
+            self.assertEqual(saved_file.read(), book.get_bytes())
+        self.assertEqual(os.listdir(self.dir), ['report.xls'])
+
+    def test_unique_names(self):
+        cwd = os.getcwd()
+        os.chdir(self.dir)
+        try:
+            book = SaveXlsxBook(make_data(10))
+            names = set(book.save() for i in range(20))
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(len(names), 20)
+        self.assertEqual(set(os.listdir(self.dir)), names)
+        self.assertTrue(all(name.endswith('.xlsx') for name in names))
+
+    def test_failed_save(self):
+        class FailingBook(SaveBook):
+            def write_to(self, fileobj):
+                fileobj.write('part')
+                raise IOError('disk full')
+        cwd = os.getcwd()
+        os.chdir(self.dir)
+        try:
+            book = FailingBook(make_data(10))
+            self.assertRaises(IOError, book.save)
+            self.assertRaises(IOError, book.save, 'report.xls')
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_permissions(self):
+        file_path = os.path.join(self.dir, 'report.xls')
+        umask_calls = []
+
+        def umask(mask):
+            umask_calls.append(mask)
+            return original_umask(mask)
+        # маска общая для всех потоков процесса, сохранение ее не меняет
+        original_umask, os.umask = os.umask, umask
+        try:
+            SaveBook(make_data(10)).save(file_path)
+        finally:
+            os.umask = original_umask
+        self.assertEqual(umask_calls, [])
+        self.assertEqual(stat.S_IMODE(os.stat(file_path).st_mode), 0o666 & ~core._UMASK)
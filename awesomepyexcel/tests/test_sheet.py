@@ -0,0 +1,45 @@
+# -*- encoding: utf-8 -*-
+from unittest import TestCase
+
+import xlwt
+
+from awesomepyexcel.core import Book, Field
+
+
+class StyledBook(Book):
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Название', key='name', style=xlwt.easyxf('font: bold on')),
+        Field(u'Число', key='number', need_sum=True),
+    ]
+
+
+class SheetStylesTestCase(TestCase):
+    def test_styles_resolved_once_per_sheet(self):
+        # stats[3] - количество повторных поисков стиля в таблице стилей книги
+        small = StyledBook([{'name': u'a', 'number': i} for i in range(10)]).get_style_stats()[3]
+        big = StyledBook([{'name': u'a', 'number': i} for i in range(1000)]).get_style_stats()[3]
+        self.assertEqual(small, big)
+
+
+class AutoFitBook(Book):
+    auto_fit_sample_size = 10
+    calculate_row_heights = True
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Имя', key='name'),
+    ]
+
+
+class AutoFitTestCase(TestCase):
+    def test_width_and_height_from_sample(self):
+        book = AutoFitBook([{'name': u'x' * 40}] * 10 + [{'name': u'x' * 500}])
+        sheet = book.get_sheet(0)
+        self.assertEqual(sheet.col(1).width, 40 * sheet.ONE_LETTER_WIDTH)
+        # строки вне выборки получают высоту, оцененную по выборке
+        self.assertEqual(sheet.row(11).height, sheet.row(1).height)
+        self.assertEqual(sheet.row(1).height, sheet._get_row_height(u'x' * 40, width=sheet.col(1).width))
+
+    def test_header_width_is_minimum(self):
+        sheet = AutoFitBook([{'name': u'x'}]).get_sheet(0)
+        self.assertEqual(sheet.col(1).width, len(u'Имя') * sheet.ONE_LETTER_WIDTH)
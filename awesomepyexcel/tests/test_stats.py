@@ -0,0 +1,48 @@
+# -*- encoding: utf-8 -*-
+from unittest import TestCase
+
+from awesomepyexcel.core import Book, Field
+from awesomepyexcel.stats import ReportStats, PHASE_PROGRESS
+
+
+class StatsBook(Book):
+    stats_class = ReportStats
+    calculate_row_heights = True
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Название', key='name'),
+        Field(u'Число', key=lambda obj: obj['number'] * 2, need_sum=True),
+    ]
+
+
+def make_data(count=250):
+    return [{'name': u'Строка %d' % i, 'number': i} for i in range(count)]
+
+
+class ReportStatsTestCase(TestCase):
+    def test_stats(self):
+        book = StatsBook(make_data())
+        book.get_bytes()
+        stats = book.stats.as_dict()
+        self.assertEqual(sorted(stats['phases']), ['process_data', 'save', 'write_footer', 'write_header'])
+        self.assertEqual(stats['rows'], 250)
+        self.assertEqual([(field['column'], field['name'], field['calls']) for field in stats['fields']],
+                         [(1, u'Название', 250), (2, u'Число', 250)])
+        self.assertIn('data', stats['timers'])
+        self.assertIn('row_heights', stats['timers'])
+        self.assertGreater(stats['rows_per_second'], 0)
+
+    def test_callback(self):
+        events = []
+        stats = ReportStats(callback=lambda event, stats: events.append((event, stats.rows)), progress_every=100)
+        StatsBook(make_data(), stats=stats)
+        self.assertEqual(events, [('write_header', 0), (PHASE_PROGRESS, 100), (PHASE_PROGRESS, 200),
+                                  ('process_data', 250), ('write_footer', 250)])
+
+    def test_disabled(self):
+        class PlainBook(StatsBook):
+            stats_class = None
+
+        book = PlainBook(make_data())
+        self.assertIsNone(book.stats)
+        self.assertEqual(book.get_bytes(), StatsBook(make_data()).get_bytes())
@@ -0,0 +1,66 @@
+# -*- encoding: utf-8 -*-
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+import xlrd
+
+from awesomepyexcel.core import Book, Field
+
+
+class StreamingBook(Book):
+    streaming_chunk_size = 100
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Число', key='number', need_sum=True),
+    ]
+
+    def process_data(self, data, sheet):
+        self.max_rows_in_memory = 0
+
+        def observed(data):
+            for obj in data:
+                self.max_rows_in_memory = max(self.max_rows_in_memory, len(sheet.get_rows()))
+                yield obj
+        sheet.write_table_body(observed(data))
+
+
+PEAK_RSS_SCRIPT = '''
+import resource, sys
+from awesomepyexcel.core import Book, Field
+
+class MyBook(Book):
+    streaming_chunk_size = 1000
+    headers = [Field(u'N', is_counter=True), Field(u'a', key='a', need_sum=True), Field(u'b', key='b')]
+
+MyBook(({'a': i, 'b': u'x%d' % (i % 100)} for i in xrange(int(sys.argv[1]))))
+print resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+'''
+
+
+def peak_rss(rows_count):
+    """Пиковое потребление памяти (Кб) процесса, сформировавшего отчет из rows_count строк"""
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    output = subprocess.check_output([sys.executable, '-c', PEAK_RSS_SCRIPT, str(rows_count)], cwd=root)
+    return int(output.strip())
+
+
+class StreamingTestCase(TestCase):
+    def test_rows_are_flushed(self):
+        book = StreamingBook({'number': i} for i in xrange(1000))
+        self.assertLessEqual(book.max_rows_in_memory, StreamingBook.streaming_chunk_size + 1)
+
+        file_name = book.save()
+        try:
+            sheet = xlrd.open_workbook(file_name).sheet_by_index(0)
+        finally:
+            os.remove(file_name)
+        self.assertEqual(sheet.nrows, 1002)
+        self.assertEqual(sheet.cell_value(1, 0), 1)
+        self.assertEqual(sheet.cell_value(1000, 1), 999)
+
+    def test_peak_memory_is_flat(self):
+        # 60000 строк - почти предел листа .xls (65536 строк)
+        growth = peak_rss(60000) - peak_rss(10000)
+        self.assertLess(growth, 8 * 1024)
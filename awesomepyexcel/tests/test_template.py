@@ -0,0 +1,90 @@
+# -*- encoding: utf-8 -*-
+import os
+import tempfile
+from unittest import TestCase
+
+from awesomepyexcel.core import Book, Field, BACKEND_XLSX
+from awesomepyexcel.tests.test_xlsx import LogoSheet, make_bitmap
+
+
+class CountingSheet(LogoSheet):
+    headers_written = 0
+
+    def _write_header(self):
+        CountingSheet.headers_written += 1
+        super(CountingSheet, self)._write_header()
+
+
+class TemplateBook(Book):
+    use_header_template = True
+    need_top_part = True
+    subscription = u'Подпись'
+    sheet_class = CountingSheet
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Название', key='name'),
+        Field(u'Число', key='number', need_sum=True, header_orientation='vertical'),
+    ]
+
+
+def make_data(count=20):
+    return [{'name': u'Строка %d' % i, 'number': i} for i in range(count)]
+
+
+class HeaderTemplateTestCase(TestCase):
+    def setUp(self):
+        logo_fd, self.logo_path = tempfile.mkstemp(suffix='.bmp')
+        os.write(logo_fd, make_bitmap())
+        os.close(logo_fd)
+        self.addCleanup(os.remove, self.logo_path)
+        CountingSheet.logo_path = self.logo_path
+        CountingSheet.headers_written = 0
+
+    def test_same_output(self):
+        class PlainBook(TemplateBook):
+            use_header_template = False
+
+        expected = PlainBook(make_data()).get_bytes()
+        self.assertEqual(TemplateBook(make_data()).get_bytes(), expected)
+        self.assertEqual(TemplateBook(make_data()).get_bytes(), expected)
+        self.assertEqual(CountingSheet.headers_written, 2)
+
+    def test_xlsx(self):
+        class XlsxTemplateBook(TemplateBook):
+            backend = BACKEND_XLSX
+
+        first = XlsxTemplateBook(make_data()).get_bytes()
+        self.assertEqual(XlsxTemplateBook(make_data()).get_bytes(), first)
+        self.assertEqual(CountingSheet.headers_written, 1)
+
+    def test_invalidation(self):
+        TemplateBook(make_data())
+        TemplateBook(make_data())
+        self.assertEqual(CountingSheet.headers_written, 1)
+
+        os.utime(self.logo_path, (0, 0))
+        TemplateBook(make_data())
+        self.assertEqual(CountingSheet.headers_written, 2)
+
+        book = TemplateBook(create=False)
+        book.headers = book.headers + [Field(u'Еще', key='name')]
+        book.create(make_data())
+        self.assertEqual(CountingSheet.headers_written, 3)
+
+    def test_same_headers_new_fields(self):
+        # Шапка зависит от значений полей, а не от самих объектов Field
+        def make_headers():
+            return [Field(u'№', is_counter=True), Field(u'Название', key='name'),
+                    Field(u'Число', key='number', need_sum=True, header_orientation='vertical')]
+
+        for _ in range(2):
+            book = TemplateBook(create=False)
+            book.headers = make_headers()
+            book.create(make_data())
+        self.assertEqual(CountingSheet.headers_written, 1)
+
+        book = TemplateBook(create=False)
+        book.headers = make_headers()
+        book.headers[1].verbose_name = u'Имя'
+        book.create(make_data())
+        self.assertEqual(CountingSheet.headers_written, 2)
@@ -0,0 +1,121 @@
+# -*- encoding: utf-8 -*-
+import datetime
+import io
+from decimal import Decimal
+from unittest import TestCase
+
+import xlrd
+
+from awesomepyexcel.core import Book, Field, Sheet, BACKEND_XLSX
+from awesomepyexcel.tests.test_xlsx import read_xlsx
+
+
+class TypedBook(Book):
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Количество', key='count', value_type=Field.TYPE_INT),
+        Field(u'Цена', key='price', value_type=Field.TYPE_FLOAT, need_sum=True),
+        Field(u'Сумма', key='amount', value_type=Field.TYPE_DECIMAL, empty_filler=u'-'),
+        Field(u'Дата', key='date', value_type=Field.TYPE_DATE),
+        Field(u'Время', key='time', value_type=Field.TYPE_DATETIME),
+        Field(u'Название', key='name', value_type=Field.TYPE_TEXT),
+        Field(u'Оплачен', key='paid', value_type=Field.TYPE_BOOL),
+    ]
+
+
+class UntypedBook(Book):
+    headers = [Field(field.verbose_name, key=field.key, is_counter=field.is_counter, need_sum=field.need_sum,
+                     empty_filler=field.empty_filler) for field in TypedBook.headers]
+
+
+def make_rows(count=300):
+    rows = []
+    for i in range(count):
+        rows.append({
+            'count': i,
+            'price': i * 0.25,
+            'amount': Decimal('%d.%02d' % (i, i % 100)) if i % 7 else None,
+            'date': datetime.date(2014, 1, 1) + datetime.timedelta(days=i),
+            'time': datetime.datetime(1900, 1, 1, 12, 30) + datetime.timedelta(days=i, seconds=i),
+            'name': u'Строка %d' % i if i % 5 else u'',
+            'paid': i % 2 == 0,
+        })
+    return rows
+
+
+def read_cells(book):
+    sheet = xlrd.open_workbook(file_contents=book.get_bytes()).sheet_by_index(0)
+    return [[(cell.ctype, cell.value) for cell in sheet.row(row_i)] for row_i in range(sheet.nrows)]
+
+
+def to_xldate(value):
+    xldate = value.toordinal() - datetime.date(1899, 12, 31).toordinal()
+    if xldate > 59:
+        xldate += 1
+    if isinstance(value, datetime.datetime):
+        xldate += (value.hour * 3600 + value.minute * 60 + value.second) / 86400.0
+    return xldate
+
+
+class TypedFieldTestCase(TestCase):
+    def test_same_as_untyped(self):
+        rows = make_rows()
+        self.assertEqual(TypedBook(rows).get_biff_data(),
+                         UntypedBook([dict(row, amount=u'-' if row['amount'] is None else row['amount'])
+                                      for row in rows]).get_biff_data())
+
+    def test_conversion(self):
+        rows = make_rows(3)
+        converted = [dict(row, count=str(row['count']), price=unicode(row['price']), amount=str(row['amount'] or '-'),
+                          date=datetime.datetime.combine(row['date'], datetime.time(15)), name=row['count'], paid=1)
+                     for row in rows]
+        expected = [dict(row, amount=row['amount'] or u'-', name=unicode(row['count']),
+                         paid=True) for row in rows]
+        self.assertEqual(TypedBook(converted).get_biff_data(), UntypedBook(expected).get_biff_data())
+
+    def test_type_error(self):
+        rows = make_rows(3)
+        rows[2]['price'] = u'дорого'
+        try:
+            TypedBook(rows)
+        except Sheet.WriteSheetException as e:
+            self.assertEqual(unicode(e), u"Ячейка C4 (колонка \"Цена\"): значение u'\\u0434\\u043e\\u0440\\u043e"
+                                         u"\\u0433\\u043e' не приводится к типу float")
+        else:
+            self.fail()
+
+    def test_not_integer(self):
+        rows = make_rows(3)
+        rows[1]['count'] = 2.7
+        with self.assertRaises(Sheet.WriteSheetException) as context:
+            TypedBook(rows)
+        self.assertEqual(unicode(context.exception), u'Ячейка B3 (колонка "Количество"): значение 2.7 '
+                                                     u'не приводится к типу int')
+        rows[1]['count'] = 1.0
+        self.assertEqual(TypedBook(rows).get_biff_data(), TypedBook(make_rows(3)).get_biff_data())
+
+    def test_columns(self):
+        rows = make_rows()
+        columns = dict((key, [row[key] for row in rows]) for key in rows[0])
+        columns['count'] = [str(value) for value in columns['count']]
+        columns['paid'] = [int(value) for value in columns['paid']]
+        book = TypedBook(create=False)
+        book.create_columns(columns)
+        # порядок строк в таблице строк (SST) у колонок другой, поэтому сравниваются ячейки
+        self.assertEqual(read_cells(book), read_cells(TypedBook(rows)))
+        columns['count'][5] = 5.5
+        self.assertRaises(Sheet.WriteSheetException, TypedBook(create=False).create_columns, columns)
+
+    def test_xlsx(self):
+        class XlsxTypedBook(TypedBook):
+            backend = BACKEND_XLSX
+        rows = make_rows(10)
+        archive, sheet, cells = read_xlsx(io.BytesIO(XlsxTypedBook(rows).get_bytes()))
+        for row_number, row in enumerate(rows, start=2):
+            values = [cells.get('%s%d' % (column, row_number)) for column in 'BCDEFGH']
+            self.assertEqual(values, [
+                row['count'], row['price'], float(row['amount']) if row['amount'] is not None else u'-',
+                to_xldate(row['date']), to_xldate(row['time']),
+                row['name'] or None, row['paid'],
+            ])
+        self.assertEqual(cells['C12'], u'=SUM(C2:C11)')
@@ -0,0 +1,113 @@
+# -*- encoding: utf-8 -*-
+import functools
+import multiprocessing
+import os
+import shutil
+import stat
+import tempfile
+import time
+from unittest import TestCase
+
+from awesomepyexcel.core import Book, Field
+from awesomepyexcel.worker import ReportClient, ReportPool
+
+
+class OrdersBook(Book):
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Клиент', key='client'),
+        Field(u'Сумма', key='amount', need_sum=True),
+    ]
+
+
+def load_orders(count):
+    return [{'client': u'Клиент %d' % i, 'amount': i * 1.5} for i in range(count)]
+
+
+def load_slowly(seconds):
+    time.sleep(seconds)
+    return []
+
+
+def load_broken():
+    raise ValueError(u'нет связи с базой')
+
+
+class ReportPoolTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.pool = ReportPool([OrdersBook], processes=2, timeout=5, result_dir=self.dir)
+        self.pool.start()
+        self.addCleanup(self.pool.close)
+
+    def test_jobs(self):
+        jobs = [self.pool.submit('OrdersBook', functools.partial(load_orders, count), metadata={'count': count})
+                for count in (10, 20, 30, 40)]
+        self.assertEqual([job.get() for job in jobs],
+                         [OrdersBook(load_orders(count)).get_bytes() for count in (10, 20, 30, 40)])
+        stats = self.pool.get_stats()
+        self.assertEqual((stats['submitted'], stats['completed'], stats['queue_depth'], stats['running']),
+                         (4, 4, 0, 0))
+        self.assertTrue(stats['run']['max'] >= stats['run']['avg'] > 0)
+
+    def test_file(self):
+        file_path = self.pool.generate('OrdersBook', load_orders(5), as_file=True)
+        self.assertEqual(os.path.dirname(file_path), self.dir)
+        with open(file_path, 'rb') as book_file:
+            self.assertEqual(book_file.read(), OrdersBook(load_orders(5)).get_bytes())
+
+    def test_timeout(self):
+        job = self.pool.submit('OrdersBook', functools.partial(load_slowly, 30), timeout=0.5)
+        self.assertRaises(ReportPool.JobTimeout, job.get)
+        # процесс прерванного задания заменен, пул продолжает работать
+        self.assertEqual(self.pool.generate('OrdersBook', load_orders(3)), OrdersBook(load_orders(3)).get_bytes())
+        self.assertEqual(self.pool.get_stats()['timed_out'], 1)
+
+    def test_errors(self):
+        try:
+            self.pool.generate('OrdersBook', load_broken)
+        except ReportPool.JobError as e:
+            self.assertIn('ValueError', unicode(e))
+        else:
+            self.fail()
+        self.assertRaises(ReportPool.JobError, self.pool.submit, 'UnknownBook')
+        self.assertEqual(self.pool.get_stats()['failed'], 1)
+
+    def test_socket(self):
+        address = self.pool.serve(('localhost', 0), authkey='secret')
+        client = ReportClient(address, authkey='secret')
+        self.assertEqual(client.generate('OrdersBook', functools.partial(load_orders, 7)),
+                         OrdersBook(load_orders(7)).get_bytes())
+        self.assertRaises(ReportPool.JobTimeout, client.generate, 'OrdersBook',
+                          functools.partial(load_slowly, 30), timeout=0.5)
+        self.assertEqual(client.get_stats()['completed'], 1)
+        self.assertRaises(ValueError, self.pool.serve, ('0.0.0.0', 0), authkey='secret')
+
+    def test_socket_authkey(self):
+        self.assertRaises(ValueError, self.pool.serve, ('localhost', 0))
+        address = self.pool.serve(('localhost', 0), authkey='secret')
+        data = functools.partial(load_orders, 3)
+        self.assertRaises(multiprocessing.AuthenticationError,
+                          ReportClient(address, authkey='wrong').generate, 'OrdersBook', data)
+        self.assertRaises(Exception, ReportClient(address).generate, 'OrdersBook', data)
+        self.assertEqual(self.pool.get_stats()['submitted'], 0)
+        self.assertEqual(ReportClient(address, authkey='secret').generate('OrdersBook', data),
+                         OrdersBook(data()).get_bytes())
+
+    def test_unix_socket(self):
+        umask_calls = []
+
+        def umask(mask):
+            umask_calls.append(mask)
+            return original_umask(mask)
+        # маска прав общая с потоками пула, которые пишут файлы книг, - serve ее не меняет
+        original_umask, os.umask = os.umask, umask
+        try:
+            address = self.pool.serve(os.path.join(self.dir, 'pool.sock'))
+        finally:
+            os.umask = original_umask
+        self.assertEqual(umask_calls, [])
+        self.assertEqual(stat.S_IMODE(os.stat(address).st_mode), 0o600)
+        self.assertEqual(ReportClient(address).generate('OrdersBook', load_orders(2)),
+                         OrdersBook(load_orders(2)).get_bytes())
@@ -0,0 +1,131 @@
+# -*- encoding: utf-8 -*-
+import os
+import struct
+import tempfile
+import zipfile
+from unittest import TestCase
+from xml.etree import ElementTree
+
+from awesomepyexcel.core import Book, Field, Sheet, BACKEND_XLSX
+
+NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+def make_bitmap(width=4, height=2):
+    row_size = (width * 3 + 3) & ~3
+    pixels = '\xff' * row_size * height
+    return (struct.pack('<2sL2HL', 'BM', 54 + len(pixels), 0, 0, 54) +
+            struct.pack('<3l2H6L', 40, width, height, 1, 24, 0, len(pixels), 2835, 2835, 0, 0) + pixels)
+
+
+class LogoSheet(Sheet):
+    logo_path = None
+    logo_rows = 3
+    logo_width = 2000
+
+    def get_logo_path(self):
+        return self.logo_path
+
+
+class XlsxBook(Book):
+    backend = BACKEND_XLSX
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Название', key='name', width=5000),
+        Field(u'Сумма', key='amount', need_sum=True),
+        Field(u'Флаг', key='flag'),
+    ]
+
+
+def read_xlsx(file_name):
+    """
+    :return: (архив, {адрес ячейки: значение (формулы - текст с '=')})
+    """
+    archive = zipfile.ZipFile(file_name)
+    self_check = archive.testzip()
+    assert self_check is None, self_check
+    strings = [u''.join(si.itertext()) for si in
+               ElementTree.fromstring(archive.read('xl/sharedStrings.xml')).findall(NS + 'si')]
+    cells = {}
+    sheet = ElementTree.fromstring(archive.read('xl/worksheets/sheet1.xml'))
+    for c in sheet.iter(NS + 'c'):
+        formula, value = c.find(NS + 'f'), c.find(NS + 'v')
+        if formula is not None:
+            cells[c.get('r')] = u'=' + formula.text
+        elif value is None:
+            cells[c.get('r')] = None
+        elif c.get('t') == 's':
+            cells[c.get('r')] = strings[int(value.text)]
+        elif c.get('t') == 'b':
+            cells[c.get('r')] = value.text == '1'
+        elif c.get('t') == 'e':
+            cells[c.get('r')] = value.text
+        else:
+            cells[c.get('r')] = float(value.text)
+    return archive, sheet, cells
+
+
+class XlsxTestCase(TestCase):
+    def save(self, book):
+        file_name = book.save()
+        self.addCleanup(os.remove, file_name)
+        self.assertTrue(file_name.endswith('.xlsx'))
+        return read_xlsx(file_name)
+
+    def test_values(self):
+        data = [{'name': u'Строка <%d> & "%d"' % (i, i), 'amount': i * 1.5, 'flag': i % 2 == 0} for i in range(10)]
+        archive, sheet, cells = self.save(XlsxBook(data))
+        self.assertEqual(cells['A1'], u'№')
+        self.assertEqual(cells['B2'], u'Строка <0> & "0"')
+        self.assertEqual(cells['A11'], 10)
+        self.assertEqual(cells['C11'], 13.5)
+        self.assertEqual(cells['D2'], True)
+        self.assertEqual(cells['D3'], False)
+        self.assertEqual(cells['C12'], u'=SUM(C2:C11)')
+        widths = dict((col.get('min'), float(col.get('width'))) for col in sheet.iter(NS + 'col'))
+        self.assertEqual(widths['2'], 5000 / 256.0)
+        ElementTree.fromstring(archive.read('xl/styles.xml'))
+
+    def test_not_finite_numbers(self):
+        data = [{'name': u'x', 'amount': amount, 'flag': True} for amount in (float('nan'), float('inf'), -1e400, 2.5)]
+        archive, sheet, cells = self.save(XlsxBook(data))
+        self.assertEqual([cells['C%d' % row_number] for row_number in range(2, 6)], ['#NUM!', '#NUM!', '#NUM!', 2.5])
+        # итог с NaN не кэшируется - его посчитает Excel
+        footer = [c for c in sheet.iter(NS + 'c') if c.get('r') == 'C6'][0]
+        self.assertEqual((footer.find(NS + 'f').text, footer.find(NS + 'v')), ('SUM(C2:C5)', None))
+
+    def test_more_rows_than_xls(self):
+        class BigBook(XlsxBook):
+            streaming_chunk_size = 5000
+        rows_count = 70000
+        book = BigBook(create=False)
+        sheet = book.add_sheet(book.title)
+        sheet.write_header()
+        sheet.write_table_body({'name': u'x', 'amount': 1, 'flag': True} for i in xrange(rows_count))
+        self.assertLessEqual(len(sheet.get_rows()), 5000)
+        sheet.write_footer()
+        archive, sheet, cells = self.save(book)
+        self.assertEqual(cells['A%d' % (rows_count + 1)], rows_count)
+        self.assertEqual(cells['C%d' % (rows_count + 2)], u'=SUM(C2:C%d)' % (rows_count + 1))
+
+    def test_top_part_with_logo(self):
+        logo_fd, logo_path = tempfile.mkstemp(suffix='.bmp')
+        os.write(logo_fd, make_bitmap())
+        os.close(logo_fd)
+        self.addCleanup(os.remove, logo_path)
+
+        class LogoBook(XlsxBook):
+            need_top_part = True
+            subscription = u'Подпись'
+            sheet_class = type('LogoSheet', (LogoSheet,), {'logo_path': logo_path})
+
+        archive, sheet, cells = self.save(LogoBook([{'name': u'a', 'amount': 1, 'flag': False}]))
+        self.assertIn(u'Подпись', cells.values())
+        self.assertTrue(sheet.find(NS + 'mergeCells') is not None)
+        self.assertEqual(archive.read('xl/media/image1.bmp'), make_bitmap())
+        self.assertIn('xl/drawings/drawing1.xml', archive.namelist())
+
+    def test_xls_by_default(self):
+        file_name = Book([]).save()
+        self.addCleanup(os.remove, file_name)
+        self.assertTrue(file_name.endswith('.xls'))
@@ -0,0 +1,444 @@
+# coding: utf-8
+"""
+Пул процессов, постоянно готовых формировать отчеты. Классы книг регистрируются заранее и загружаются
+в каждом процессе пула при его запуске (модули импортированы, стили xlwt.easyxf разобраны, шапки
+построены), задания передаются через локальную очередь, результат - содержимое файла или путь к файлу.
+
+    pool = ReportPool([OrdersBook, ClientsBook], processes=4, timeout=60)
+    pool.start()
+    job = pool.submit('OrdersBook', functools.partial(load_orders, period_id), metadata={'period': period})
+    content = job.get()
+    pool.get_stats()  # глубина очереди, задания в работе, время ожидания и формирования
+    pool.close()
+
+Другие процессы (например, веб-воркеры) передают задания через локальный сокет:
+
+    pool.serve(('localhost', 8765), authkey='secret')  # в процессе пула
+    content = ReportClient(('localhost', 8765), authkey='secret').generate('OrdersBook', data, metadata)
+
+или пул запускается отдельно: python -m awesomepyexcel.worker --book reports.OrdersBook --authkey secret
+
+Данные задания - как у create_book_parallel: список объектов или picklable-функция без аргументов,
+которая возвращает данные (например, functools.partial над функцией модуля, делающей запрос к БД).
+Задание, не уложившееся в timeout, прерывается вместе с процессом, вместо которого запускается новый.
+"""
+import collections
+import multiprocessing
+import multiprocessing.connection
+import optparse
+import os
+import signal
+import tempfile
+import threading
+import time
+import traceback
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from awesomepyexcel.core import _percentile
+
+LATENCY_WINDOW = 1000  # последних заданий, по которым считается время ожидания и формирования
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+_STOP = None
+
+
+def _warm_up(book_class):
+    """
+    Строит шапку листа книги в процессе пула, чтобы первое задание не платило за стили и шаблон шапки
+    """
+    book = book_class(create=False)
+    book.add_sheet(book.title).write_header()
+
+
+def _generate(book_class, data, metadata, result_dir):
+    if hasattr(data, '__call__'):
+        data = data()
+    book = book_class(data, metadata=metadata)
+    if result_dir is None:
+        return book.get_bytes()
+    fd, file_path = tempfile.mkstemp(suffix='.%s' % book.backend, dir=result_dir)
+    os.close(fd)
+    return book.save(file_path, return_file_path=True)[1]
+
+
+def _serve_jobs(book_classes, conn, result_dir):
+    """
+    Выполняется в процессе пула: формирует книги по заданиям из conn, пока не придет _STOP
+    """
+    # процесс останавливает пул: Ctrl+C в терминале и SIGTERM запускающего main не прерывают задание
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    for book_class in book_classes.values():
+        try:
+            _warm_up(book_class)
+        except Exception:
+            pass  # та же ошибка будет в задании с этой книгой
+    while True:
+        message = conn.recv()
+        if message is _STOP:
+            return
+        book_name, data, metadata, as_file = message
+        try:
+            conn.send((True, _generate(book_classes[book_name], data, metadata, result_dir if as_file else None)))
+        except Exception:
+            conn.send((False, traceback.format_exc().decode('utf-8', 'replace')))
+
+
+def _latency(times):
+    if not times:
+        return {'avg': 0.0, 'p95': 0.0, 'max': 0.0}
+    return {'avg': sum(times) / len(times), 'p95': _percentile(times, 95), 'max': max(times)}
+
+
+class ReportJob(object):
+    """
+    Задание пула. Результат - через get
+    """
+
+    def __init__(self, book_name, data, metadata, as_file, timeout):
+        self.book_name = book_name
+        self.data = data
+        self.metadata = metadata
+        self.as_file = as_file
+        self.timeout = timeout
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None  # текст ошибки (traceback из процесса пула)
+        self.timed_out = False
+        self._done = threading.Event()
+
+    def done(self):
+        return self._done.is_set()
+
+    def get(self, timeout=None):
+        """
+        :param timeout: сколько секунд ждать результата. По умолчанию - пока задание не выполнится
+        :return: содержимое файла книги или путь к файлу (as_file)
+        """
+        if not self._done.wait(timeout):
+            raise ReportPool.JobTimeout(u'Результат задания не получен за %s с' % timeout)
+        if self.timed_out:
+            raise ReportPool.JobTimeout(self.error)
+        if self.error is not None:
+            raise ReportPool.JobError(self.error)
+        return self.result
+
+
+class ReportPool(object):
+    class JobError(Exception): pass
+
+    class JobTimeout(JobError): pass
+
+    def __init__(self, book_classes=(), processes=None, timeout=None, result_dir=None):
+        """
+        :param book_classes: классы книг (наследники Book), задания ссылаются на них по имени класса
+        :param processes: количество процессов пула. По умолчанию - количество ядер
+        :param timeout: секунд на формирование книги по заданию (без ожидания в очереди). None - без ограничения
+        :param result_dir: папка для книг заданий с as_file
+        """
+        self._threads = []
+        self.book_classes = {}
+        for book_class in book_classes:
+            self.register(book_class)
+        self.processes = processes or multiprocessing.cpu_count()
+        self.timeout = timeout
+        self.result_dir = result_dir
+        self._jobs = queue.Queue()
+        self._listener = None
+        self._lock = threading.Lock()
+        self._spawn_lock = threading.Lock()
+        self._running = 0
+        self._counts = {'submitted': 0, 'completed': 0, 'failed': 0, 'timed_out': 0}
+        self._wait_times = collections.deque(maxlen=LATENCY_WINDOW)
+        self._run_times = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def register(self, book_class, name=None):
+        """
+        Регистрирует класс книги под именем name (по умолчанию - имя класса). Только до start
+        """
+        assert not self._threads, u'Классы книг регистрируются до запуска пула'
+        self.book_classes[name or book_class.__name__] = book_class
+
+    def start(self):
+        for i in range(self.processes):
+            thread = threading.Thread(target=self._run_worker)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def close(self):
+        """
+        Перестает принимать задания через сокет, выполняет задания из очереди и останавливает процессы
+        """
+        if self._listener is not None:
+            listener, self._listener = self._listener, None
+            listener.close()
+        for thread in self._threads:
+            self._jobs.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, book_name, data=None, metadata=None, as_file=False, timeout=None):
+        """
+        Ставит задание в очередь
+        :param book_name: имя зарегистрированного класса книги
+        :param data: данные отчета: список объектов или picklable-функция без аргументов, которая их возвращает
+        :param metadata: дополнительные данные об отчете (см. Book.__init__)
+        :param as_file: сохранить книгу в result_dir и вернуть путь к файлу вместо содержимого
+        :param timeout: секунд на формирование. По умолчанию - timeout пула
+        :return: ReportJob
+        """
+        if book_name not in self.book_classes:
+            raise self.JobError(u'Класс книги "%s" не зарегистрирован' % book_name)
+        if as_file and self.result_dir is None:
+            raise self.JobError(u'Для результата в файле у пула должна быть задана папка result_dir')
+        job = ReportJob(book_name, data, metadata, as_file, self.timeout if timeout is None else timeout)
+        with self._lock:
+            self._counts['submitted'] += 1
+        self._jobs.put(job)
+        return job
+
+    def generate(self, book_name, data=None, metadata=None, as_file=False, timeout=None):
+        """
+        submit и ожидание результата
+        """
+        return self.submit(book_name, data, metadata, as_file, timeout).get()
+
+    def get_stats(self):
+        """
+        :return: словарь: queue_depth - заданий в очереди, running - в работе, processes - процессов пула,
+                 submitted, completed, failed, timed_out - количество заданий, wait и run - время ожидания
+                 в очереди и формирования (avg, p95, max) по последним LATENCY_WINDOW заданиям, в секундах
+        """
+        with self._lock:
+            stats = dict(self._counts, queue_depth=self._jobs.qsize(), running=self._running,
+                         processes=self.processes)
+            stats['wait'] = _latency(self._wait_times)
+            stats['run'] = _latency(self._run_times)
+        return stats
+
+    def serve(self, address, authkey=None):
+        """
+        Принимает задания ReportClient через локальный сокет, каждое подключение - в своем потоке.
+        Задания передаются через pickle, то есть подключившийся клиент выполняет код в процессе пула.
+        Поэтому сокет только локальный: к порту TCP подключаются только клиенты с authkey,
+        unix-сокет создается с правами 0600 (только для пользователя пула)
+        :param address: ('localhost', порт) или путь unix-сокета. Порт 0 - любой свободный
+        :param authkey: ключ подключения клиентов. Обязателен для порта TCP
+        :return: адрес, на котором принимаются подключения
+        """
+        if isinstance(address, tuple):
+            if address[0] not in LOCAL_HOSTS:
+                raise ValueError(u'Пул принимает задания только на локальном адресе, а не %s' % address[0])
+            if not authkey:
+                raise ValueError(u'Для приема заданий на порту TCP нужен authkey')
+        listener = multiprocessing.connection.Listener(address, authkey=authkey)
+        if not isinstance(address, tuple):
+            # права меняются до того, как пул начнет принимать подключения; маска прав процесса
+            # (os.umask) не трогается - она общая с потоками, которые пишут файлы книг
+            os.chmod(listener.address, 0o600)
+        self._listener = listener
+        thread = threading.Thread(target=self._accept, args=(listener,))
+        thread.daemon = True
+        thread.start()
+        return listener.address
+
+    def _accept(self, listener):
+        while True:
+            try:
+                conn = listener.accept()
+            except (multiprocessing.AuthenticationError, IOError, EOFError, AttributeError):
+                if self._listener is not listener:
+                    return  # listener закрыт
+                continue  # клиент не прошел проверку authkey или отключился
+            thread = threading.Thread(target=self._serve_client, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def _serve_client(self, conn):
+        try:
+            while True:
+                command, kwargs = conn.recv()
+                if command == 'stats':
+                    reply = ('ok', self.get_stats())
+                else:
+                    try:
+                        reply = ('ok', self.generate(**kwargs))
+                    except self.JobTimeout as e:
+                        reply = ('timeout', unicode(e))
+                    except self.JobError as e:
+                        reply = ('error', unicode(e))
+                conn.send(reply)
+        except (IOError, EOFError):
+            pass
+        finally:
+            conn.close()
+
+    def _spawn(self):
+        # процессы создаются по одному, чтобы ни один из них не унаследовал чужой конец канала:
+        # иначе завершение процесса не было бы видно по закрытию канала
+        with self._spawn_lock:
+            conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_serve_jobs, args=(self.book_classes, child_conn, self.result_dir))
+            process.daemon = True
+            process.start()
+            child_conn.close()
+        return process, conn
+
+    def _run_worker(self):
+        """
+        Поток пула: передает задания из очереди своему процессу и следит за временем их выполнения
+        """
+        process, conn = self._spawn()
+        while True:
+            job = self._jobs.get()
+            if job is _STOP:
+                conn.send(_STOP)
+                process.join()
+                conn.close()
+                return
+            self._start_job(job)
+            try:
+                conn.send((job.book_name, job.data, job.metadata, job.as_file))
+            except (IOError, EOFError):
+                error, timed_out = u'Процесс пула завершился до получения задания', False
+            except Exception:
+                # данные задания не передаются в процесс (например, не сериализуются pickle)
+                self._finish_job(job, error=traceback.format_exc().decode('utf-8', 'replace'))
+                continue
+            else:
+                try:
+                    if conn.poll(job.timeout):
+                        success, payload = conn.recv()
+                        self._finish_job(job, *((payload, None) if success else (None, payload)))
+                        continue
+                    error, timed_out = u'Задание не выполнено за %s с' % job.timeout, True
+                except (IOError, EOFError):
+                    error, timed_out = u'Процесс пула завершился во время задания', False
+            process.terminate()
+            process.join()
+            conn.close()
+            self._finish_job(job, error=error, timed_out=timed_out)
+            process, conn = self._spawn()
+
+    def _start_job(self, job):
+        job.started = time.time()
+        with self._lock:
+            self._running += 1
+            self._wait_times.append(job.started - job.submitted)
+
+    def _finish_job(self, job, result=None, error=None, timed_out=False):
+        job.finished = time.time()
+        job.result, job.error, job.timed_out = result, error, timed_out
+        job.data = None
+        with self._lock:
+            self._running -= 1
+            self._run_times.append(job.finished - job.started)
+            if timed_out:
+                self._counts['timed_out'] += 1
+            elif error is not None:
+                self._counts['failed'] += 1
+            else:
+                self._counts['completed'] += 1
+        job._done.set()
+
+
+class ReportClient(object):
+    """
+    Клиент пула, запущенного в другом процессе (ReportPool.serve). Каждый запрос - отдельное подключение
+    """
+
+    def __init__(self, address, authkey=None):
+        self.address = address
+        self.authkey = authkey
+
+    def _request(self, command, kwargs=None):
+        conn = multiprocessing.connection.Client(self.address, authkey=self.authkey)
+        try:
+            conn.send((command, kwargs))
+            status, payload = conn.recv()
+        finally:
+            conn.close()
+        if status == 'timeout':
+            raise ReportPool.JobTimeout(payload)
+        if status == 'error':
+            raise ReportPool.JobError(payload)
+        return payload
+
+    def generate(self, book_name, data=None, metadata=None, as_file=False, timeout=None):
+        """
+        Формирует книгу в пуле (см. ReportPool.submit) и ждет результат
+        """
+        return self._request('generate', {'book_name': book_name, 'data': data, 'metadata': metadata,
+                                          'as_file': as_file, 'timeout': timeout})
+
+    def get_stats(self):
+        """
+        Статистика пула (см. ReportPool.get_stats)
+        """
+        return self._request('stats')
+
+
+def _import_class(path):
+    module_name, class_name = path.rsplit('.', 1)
+    return getattr(__import__(module_name, fromlist=[class_name]), class_name)
+
+
+def _parse_address(address):
+    host, separator, port = address.rpartition(':')
+    if separator and port.isdigit():
+        return host, int(port)
+    return address  # путь unix-сокета
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def main(args=None):
+    parser = optparse.OptionParser(usage=u'%prog --book пакет.модуль.КлассКниги [--book ...] [параметры]')
+    parser.add_option('--book', action='append', default=[], help=u'класс книги, можно указать несколько раз')
+    parser.add_option('--address', default='localhost:8765', help=u'хост:порт или путь unix-сокета')
+    parser.add_option('--authkey', default=os.environ.get('AWESOMEPYEXCEL_AUTHKEY'),
+                      help=u'ключ подключения клиентов (по умолчанию - AWESOMEPYEXCEL_AUTHKEY)')
+    parser.add_option('--processes', type='int', help=u'процессов пула, по умолчанию - количество ядер')
+    parser.add_option('--timeout', type='float', help=u'секунд на задание')
+    parser.add_option('--result-dir', dest='result_dir', help=u'папка для книг заданий с as_file')
+    options, args = parser.parse_args(args)
+    if not options.book:
+        parser.error(u'не указаны классы книг (--book)')
+
+    pool = ReportPool([_import_class(path) for path in options.book], processes=options.processes,
+                      timeout=options.timeout, result_dir=options.result_dir)
+    signal.signal(signal.SIGTERM, _interrupt)
+    pool.start()
+    try:
+        try:
+            address = pool.serve(_parse_address(options.address), authkey=options.authkey)
+        except ValueError as e:
+            parser.error(unicode(e).encode('utf-8'))
+        print('Report pool is listening on %s' % (address,))
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,643 @@
+# coding: utf-8
+"""
+Запись книги в формат .xlsx (Office Open XML).
+
+Ячейки, стили и строки (shared strings) копятся в тех же структурах xlwt, что и для .xls,
+поэтому вся логика Book/Sheet/Field работает без изменений. Отличается только сериализация:
+строки листа по мере заполнения сбрасываются в XML во временный файл, а при сохранении
+XML листов потоком сжимается прямо в zip-контейнер.
+Включается атрибутом книги: Book.backend = BACKEND_XLSX.
+"""
+import math
+import re
+import struct
+import tempfile
+import zlib
+from xml.sax.saxutils import escape, quoteattr
+
+import xlrd
+import xlwt.Cell
+from xlwt.Row import Row
+import xlwt.Style
+
+XLSX_MAX_ROWS = 1048576
+XLSX_MAX_COLS = 16384
+
+# первый индекс XF ячеек в xlwt (до него идут 16 XF стилей)
+FIRST_CELL_XF_INDEX = 0x10
+
+NS_MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+NS_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+NS_PACKAGE_REL = 'http://schemas.openxmlformats.org/package/2006/relationships'
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+HORIZONTAL_ALIGNMENTS = {1: 'left', 2: 'center', 3: 'right', 4: 'fill', 5: 'justify',
+                         6: 'centerContinuous', 7: 'distributed'}
+VERTICAL_ALIGNMENTS = {0: 'top', 1: 'center', 3: 'justify', 4: 'distributed'}
+BORDER_STYLES = {1: 'thin', 2: 'medium', 3: 'dashed', 4: 'dotted', 5: 'thick', 6: 'double', 7: 'hair',
+                 8: 'mediumDashed', 9: 'dashDot', 10: 'mediumDashDot', 11: 'dashDotDot',
+                 12: 'mediumDashDotDot', 13: 'slantDashDot'}
+PATTERN_TYPES = {1: 'solid', 2: 'mediumGray', 3: 'darkGray', 4: 'lightGray', 5: 'darkHorizontal',
+                 6: 'darkVertical', 7: 'darkDown', 8: 'darkUp', 9: 'darkGrid', 10: 'darkTrellis',
+                 11: 'lightHorizontal', 12: 'lightVertical', 13: 'lightDown', 14: 'lightUp',
+                 15: 'lightGrid', 16: 'lightTrellis', 17: 'gray125', 18: 'gray0625'}
+UNDERLINES = {0x01: 'single', 0x02: 'double', 0x21: 'singleAccounting', 0x22: 'doubleAccounting'}
+ERROR_CODES = {0x00: '#NULL!', 0x07: '#DIV/0!', 0x0F: '#VALUE!', 0x17: '#REF!', 0x1D: '#NAME?',
+               0x24: '#NUM!', 0x2A: '#N/A'}
+
+CONTENT_TYPE_SHEET = 'application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml'
+CONTENT_TYPE_DRAWING = 'application/vnd.openxmlformats-officedocument.drawing+xml'
+
+
+def _xml_text(value):
+    """Текст для XML: экранирование и удаление недопустимых в XML управляющих символов"""
+    if not isinstance(value, unicode):
+        value = unicode(value)
+    value = escape(value)
+    if any(u'\x00' <= char < u' ' and char not in u'\t\n\r' for char in value):
+        value = u''.join(char for char in value if char >= u' ' or char in u'\t\n\r')
+    return value.encode('utf-8')
+
+
+def _xml_attr(value):
+    if not isinstance(value, unicode):
+        value = unicode(value)
+    return quoteattr(value).encode('utf-8')
+
+
+def _is_finite(number):
+    return not (math.isnan(number) or math.isinf(number))
+
+
+def _number_text(number):
+    """
+    Текст конечного числа (NaN и бесконечности в .xlsx записываются ошибкой #NUM!, см. _is_finite)
+    """
+    if number == int(number) and abs(number) < 1e15:
+        return '%d' % number
+    return repr(number)
+
+
+def _formula_text(formula):
+    """
+    Текст формулы xlwt -> формула .xlsx: разделитель аргументов ';' заменяется на ','
+    (вне строковых литералов)
+    """
+    parts = formula.split('"')
+    for i in range(0, len(parts), 2):
+        parts[i] = parts[i].replace(';', ',')
+    return '"'.join(parts)
+
+
+def _colour(tag, colour_index):
+    if colour_index is None or colour_index > 64:
+        return ''
+    return '<%s indexed="%d"/>' % (tag, colour_index)
+
+
+class XlsxFormula(object):
+    """
+    Формула для листа .xlsx. В отличие от xlwt.Formula не разбирается парсером xlwt,
+    поэтому допускает ссылки за пределами 65536 строк .xls
+    """
+    __slots__ = ['_text']
+
+    def __init__(self, text):
+        self._text = text
+
+    def text(self):
+        return self._text
+
+
+class XlsxRowFormula(object):
+    """
+    Формула колонки тела таблицы (Field.row_formula) для .xlsx: ссылки Ncol заменяются
+    на адреса колонок один раз, для каждой строки подставляется только номер строки
+    """
+    __slots__ = ['_template']
+
+    def __init__(self, text):
+        self._template = re.sub(r'(\d+)col', lambda match: _colname(int(match.group(1))) + '%(row)d',
+                                text.replace('%', '%%'))
+
+    def make_cell(self, row_i, col_i, xf_index):
+        return xlwt.Cell.FormulaCell(row_i, col_i, xf_index, XlsxFormula(self._template % {'row': row_i + 1}))
+
+
+class XlsxRow(Row):
+    """
+    Строка xlwt без ограничений формата .xls на номер строки (65536) и колонки (256)
+    """
+    __slots__ = []
+
+    def __init__(self, rowx, parent_sheet):
+        if not (isinstance(rowx, (int, long)) and 0 <= rowx < XLSX_MAX_ROWS):
+            raise ValueError("row index (%r) not an int in range(%d)" % (rowx, XLSX_MAX_ROWS))
+        self._Row__idx = rowx
+        self._Row__parent = parent_sheet
+        self._Row__parent_wb = parent_sheet.get_parent()
+        self._Row__cells = {}
+        self._Row__min_col_idx = 0
+        self._Row__max_col_idx = 0
+        self._Row__xf_index = 0x0F
+        self._Row__has_default_xf_index = 0
+        self._Row__height_in_pixels = 0x11
+
+        self.height = 0x00FF
+        self.has_default_height = 0x00
+        self.height_mismatch = 0
+        self.level = 0
+        self.collapse = 0
+        self.hidden = 0
+        self.space_above = 0
+        self.space_below = 0
+
+    def _Row__adjust_bound_col_idx(self, *args):
+        sheet = self._Row__parent
+        for arg in args:
+            iarg = int(arg)
+            if not ((0 <= iarg < XLSX_MAX_COLS) and arg == iarg):
+                raise ValueError("column index (%r) not an int in range(%d)" % (arg, XLSX_MAX_COLS))
+            if iarg < self._Row__min_col_idx:
+                self._Row__min_col_idx = iarg
+            if iarg > self._Row__max_col_idx:
+                self._Row__max_col_idx = iarg
+            if iarg < sheet.first_used_col:
+                sheet.first_used_col = iarg
+            if iarg > sheet.last_used_col:
+                sheet.last_used_col = iarg
+
+
+class XlsxSheetMixin(object):
+    """
+    Примесь к классу листа (Sheet) для записи в .xlsx. Подмешивается автоматически,
+    см. sheet_class_for.
+    """
+    # Если у книги не задан streaming_chunk_size, строки сбрасываются в XML каждые XLSX_CHUNK_SIZE строк
+    XLSX_CHUNK_SIZE = 1000
+    XLSX_READ_CHUNK_SIZE = 64 * 1024
+    max_rows = XLSX_MAX_ROWS
+    PIXEL_EMU = 9525  # EMU в одном пикселе
+
+    def __init__(self, *args, **kwargs):
+        super(XlsxSheetMixin, self).__init__(*args, **kwargs)
+        self.Row = XlsxRow
+        self._xlsx_rows_file = None  # временный файл с XML сброшенных строк
+        self._xlsx_last_row_i = -1  # последняя сброшенная строка
+        self._xlsx_images = []
+
+    def _get_streaming_chunk_size(self):
+        return self.parent.streaming_chunk_size or self.XLSX_CHUNK_SIZE
+
+    def _make_formula(self, text):
+        return XlsxFormula(text)
+
+    def _make_row_formula(self, text):
+        return XlsxRowFormula(text)
+
+    def write(self, r, c, label="", style=xlwt.Style.default_style):
+        if isinstance(label, XlsxFormula):
+            row = self.row(r)
+            row._Row__adjust_bound_col_idx(c)
+            row.insert_cell(c, xlwt.Cell.FormulaCell(r, c, self.parent.add_style(style), label))
+        else:
+            super(XlsxSheetMixin, self).write(r, c, label, style)
+
+    def write_merge(self, r1, r2, c1, c2, label="", style=xlwt.Style.default_style):
+        assert 0 <= c1 <= c2 < XLSX_MAX_COLS
+        assert 0 <= r1 <= r2 < XLSX_MAX_ROWS
+        self.write(r1, c1, label, style)
+        if c2 > c1:
+            self.row(r1).write_blanks(c1 + 1, c2, style)
+        for r in range(r1 + 1, r2 + 1):
+            self.row(r).write_blanks(c1, c2, style)
+        self.get_merged_ranges().append((r1, r2, c1, c2))
+
+    def insert_bitmap(self, filename, row, col, x=0, y=0, scale_x=1, scale_y=1):
+        with open(filename, 'rb') as bitmap_file:
+            header = bitmap_file.read(26)
+        if header[:2] != 'BM':
+            raise self.WriteSheetException(u'Файл "%s" не является BMP' % filename)
+        width, height = struct.unpack('<ii', header[18:26])
+        self._xlsx_images.append((filename, row, col, x, y, int(width * scale_x), int(abs(height) * scale_y)))
+
+    def _get_images_state(self):
+        return list(self._xlsx_images)
+
+    def _set_images_state(self, state):
+        self._xlsx_images = list(state)
+
+    def _write_number_columns(self, rows, first_col_i, columns, column_styles):
+        # готовые BIFF-записи в .xlsx не нужны, пишем ячейки
+        for col_n, (values, kind, missing) in enumerate(columns):
+            style, xf_index = column_styles[col_n]
+            self._write_column(rows, first_col_i + col_n, values, kind, xf_index, style)
+
+    def flush_row_data(self):
+        rows = self._Worksheet__rows
+        if not rows:
+            return
+        if self._xlsx_rows_file is None:
+            self._xlsx_rows_file = tempfile.TemporaryFile()
+        self._xlsx_rows_file.write(self._rows_xml(rows))
+        self._xlsx_last_row_i = max(rows)
+        for rowx in rows:
+            self._Worksheet__flushed_rows[rowx] = 1
+        self._Worksheet__rows = {}
+
+    def _rows_xml(self, rows):
+        """XML строк листа (элементы row)"""
+        if min(rows) <= self._xlsx_last_row_i:
+            raise self.WriteSheetException(u'Строка %d записана после уже сброшенных строк' % min(rows))
+        colname = _colname
+        pieces = []
+        for rowx in sorted(rows):
+            row = rows[rowx]
+            row_number = rowx + 1
+            if row.height != 0x00FF:
+                pieces.append('<row r="%d" ht="%s" customHeight="1">' % (row_number, row.height / 20.0))
+            else:
+                pieces.append('<row r="%d">' % row_number)
+            for colx, cell in sorted(row._Row__cells.iteritems()):
+                if cell is None:
+                    continue
+                cell_class = type(cell)
+                if cell_class is xlwt.Cell.StrCell:
+                    pieces.append('<c r="%s%d" s="%d" t="s"><v>%d</v></c>' % (
+                        colname(colx), row_number, cell.xf_idx - FIRST_CELL_XF_INDEX, cell.sst_idx))
+                elif cell_class is xlwt.Cell.NumberCell and not _is_finite(cell.number):
+                    pieces.append('<c r="%s%d" s="%d" t="e"><v>#NUM!</v></c>' % (
+                        colname(colx), row_number, cell.xf_idx - FIRST_CELL_XF_INDEX))
+                elif cell_class is xlwt.Cell.NumberCell:
+                    pieces.append('<c r="%s%d" s="%d"><v>%s</v></c>' % (
+                        colname(colx), row_number, cell.xf_idx - FIRST_CELL_XF_INDEX, _number_text(cell.number)))
+                elif cell_class is xlwt.Cell.BlankCell:
+                    pieces.append('<c r="%s%d" s="%d"/>' % (colname(colx), row_number, cell.xf_idx - FIRST_CELL_XF_INDEX))
+                elif cell_class is xlwt.Cell.MulBlankCell:
+                    for blank_colx in xrange(cell.colx1, cell.colx2 + 1):
+                        pieces.append('<c r="%s%d" s="%d"/>' % (
+                            colname(blank_colx), row_number, cell.xf_idx - FIRST_CELL_XF_INDEX))
+                elif cell_class is xlwt.Cell.BooleanCell:
+                    pieces.append('<c r="%s%d" s="%d" t="b"><v>%d</v></c>' % (
+                        colname(colx), row_number, cell.xf_idx - FIRST_CELL_XF_INDEX, bool(cell.number)))
+                elif isinstance(cell, xlwt.Cell.FormulaCell):
+                    # value - уже вычисленное значение формулы итогов (см. core._CachedFormulaCell)
+                    value = getattr(cell, 'value', None)
+                    pieces.append('<c r="%s%d" s="%d"><f>%s</f>%s</c>' % (
+                        colname(colx), row_number, cell.xf_idx - FIRST_CELL_XF_INDEX,
+                        _xml_text(_formula_text(cell.frmla.text())),
+                        '' if value is None or not _is_finite(value) else '<v>%s</v>' % _number_text(value)))
+                elif cell_class is xlwt.Cell.ErrorCell:
+                    pieces.append('<c r="%s%d" s="%d" t="e"><v>%s</v></c>' % (
+                        colname(colx), row_number, cell.xf_idx - FIRST_CELL_XF_INDEX,
+                        ERROR_CODES.get(cell.number, '#N/A')))
+                else:
+                    raise self.WriteSheetException(u'Ячейка %r не поддерживается в .xlsx' % cell)
+            pieces.append('</row>')
+        return ''.join(pieces)
+
+    def iter_xlsx_xml(self, drawing_rel_id=None):
+        """
+        XML листа по частям: сброшенные строки читаются из временного файла, поэтому
+        лист целиком в памяти не собирается.
+        """
+        yield XML_HEADER
+        yield '<worksheet xmlns="%s" xmlns:r="%s">' % (NS_MAIN, NS_REL)
+        yield '<sheetViews><sheetView workbookViewId="0"/></sheetViews>'
+        yield '<sheetFormatPr defaultRowHeight="12.75"/>'
+        cols = self.get_cols()
+        if cols:
+            yield '<cols>'
+            for colx in sorted(cols):
+                yield '<col min="%d" max="%d" width="%s" customWidth="1"%s/>' % (
+                    colx + 1, colx + 1, cols[colx].width / 256.0, ' hidden="1"' if cols[colx].hidden else '')
+            yield '</cols>'
+        yield '<sheetData>'
+        if self._xlsx_rows_file is not None:
+            self._xlsx_rows_file.flush()
+            self._xlsx_rows_file.seek(0)
+            while True:
+                chunk = self._xlsx_rows_file.read(self.XLSX_READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+            self._xlsx_rows_file.seek(0, 2)
+        rows = self._Worksheet__rows
+        if rows:
+            yield self._rows_xml(rows)
+        yield '</sheetData>'
+        merged_ranges = self.get_merged_ranges()
+        if merged_ranges:
+            yield '<mergeCells count="%d">' % len(merged_ranges)
+            for r1, r2, c1, c2 in merged_ranges:
+                yield '<mergeCell ref="%s%d:%s%d"/>' % (_colname(c1), r1 + 1, _colname(c2), r2 + 1)
+            yield '</mergeCells>'
+        if drawing_rel_id:
+            yield '<drawing r:id="%s"/>' % drawing_rel_id
+        yield '</worksheet>'
+
+    def get_xlsx_drawing_xml(self, image_rel_ids):
+        """XML рисунка листа (логотипы, вставленные insert_bitmap)"""
+        pieces = [XML_HEADER,
+                  '<xdr:wsDr xmlns:xdr="http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing" '
+                  'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" xmlns:r="%s">' % NS_REL]
+        for number, ((filename, row, col, x, y, width, height), rel_id) in enumerate(
+                zip(self._xlsx_images, image_rel_ids), start=1):
+            cx, cy = width * self.PIXEL_EMU, height * self.PIXEL_EMU
+            pieces.append(
+                '<xdr:oneCellAnchor><xdr:from><xdr:col>%d</xdr:col><xdr:colOff>%d</xdr:colOff>'
+                '<xdr:row>%d</xdr:row><xdr:rowOff>%d</xdr:rowOff></xdr:from><xdr:ext cx="%d" cy="%d"/>'
+                '<xdr:pic><xdr:nvPicPr><xdr:cNvPr id="%d" name="Picture %d"/>'
+                '<xdr:cNvPicPr><a:picLocks noChangeAspect="1"/></xdr:cNvPicPr></xdr:nvPicPr>'
+                '<xdr:blipFill><a:blip r:embed="%s"/><a:stretch><a:fillRect/></a:stretch></xdr:blipFill>'
+                '<xdr:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="%d" cy="%d"/></a:xfrm>'
+                '<a:prstGeom prst="rect"><a:avLst/></a:prstGeom></xdr:spPr></xdr:pic><xdr:clientData/>'
+                '</xdr:oneCellAnchor>' % (
+                    col, int(x * self.PIXEL_EMU), row, int(y * self.PIXEL_EMU), cx, cy,
+                    number + 1, number, rel_id, cx, cy))
+        pieces.append('</xdr:wsDr>')
+        return ''.join(pieces)
+
+
+_colnames = {}
+
+
+def _colname(colx):
+    try:
+        return _colnames[colx]
+    except KeyError:
+        name = _colnames[colx] = str(xlrd.colname(colx))
+        return name
+
+
+_sheet_classes = {}
+
+
+def sheet_class_for(sheet_class):
+    """
+    Класс листа .xlsx для класса листа книги: sheet_class с подмешанным XlsxSheetMixin
+    """
+    if issubclass(sheet_class, XlsxSheetMixin):
+        return sheet_class
+    if sheet_class not in _sheet_classes:
+        _sheet_classes[sheet_class] = type(sheet_class.__name__, (XlsxSheetMixin, sheet_class), {})
+    return _sheet_classes[sheet_class]
+
+
+class ZipStream(object):
+    """
+    Минимальная потоковая запись zip: содержимое файла сжимается по частям по мере
+    поступления, размеры и CRC пишутся после данных (data descriptor).
+    """
+    DOS_TIME, DOS_DATE = 0, (1980 - 1980) << 9 | 1 << 5 | 1  # фиксированная дата: 1980-01-01
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.offset = 0
+        self.entries = []
+
+    def _write(self, data):
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def write(self, name, chunks):
+        """
+        :param name: имя файла в архиве
+        :param chunks: итерируемый объект с частями содержимого (str)
+        """
+        for _ in self.iter_write(name, chunks):
+            pass
+
+    def iter_write(self, name, chunks):
+        """
+        То же, что write, но генератор: отдает управление после записи каждой части
+        """
+        header_offset = self.offset
+        self._write(struct.pack('<4s2B4HL2L2H', 'PK\x03\x04', 20, 0, 0x08, 8,
+                                self.DOS_TIME, self.DOS_DATE, 0, 0, 0, len(name), 0) + name)
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        crc, size, compressed_size = 0, 0, 0
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            data = compressor.compress(chunk)
+            compressed_size += len(data)
+            self._write(data)
+            yield
+        data = compressor.flush()
+        compressed_size += len(data)
+        self._write(data)
+        crc &= 0xFFFFFFFF
+        self._write(struct.pack('<4s3L', 'PK\x07\x08', crc, compressed_size, size))
+        self.entries.append((name, crc, compressed_size, size, header_offset))
+
+    def close(self):
+        central_directory_offset = self.offset
+        for name, crc, compressed_size, size, header_offset in self.entries:
+            self._write(struct.pack('<4s4B4HL2L5H2L', 'PK\x01\x02', 20, 0, 20, 0, 0x08, 8,
+                                    self.DOS_TIME, self.DOS_DATE, crc, compressed_size, size,
+                                    len(name), 0, 0, 0, 0, 0, header_offset) + name)
+        central_directory_size = self.offset - central_directory_offset
+        self._write(struct.pack('<4s4H2LH', 'PK\x05\x06', 0, 0, len(self.entries), len(self.entries),
+                                central_directory_size, central_directory_offset, 0))
+
+
+class XlsxWriter(object):
+    """
+    Сохранение книги (Book) в .xlsx
+    """
+
+    def __init__(self, book):
+        self.book = book
+
+    def write(self, fileobj):
+        for _ in self.iter_write(fileobj):
+            pass
+
+    def iter_write(self, fileobj):
+        """
+        Пишет книгу в fileobj, отдавая управление по мере записи XML листов
+        (для выдачи файла по частям, не дожидаясь конца записи)
+        """
+        sheets = self.book._Workbook__worksheets
+        stream = ZipStream(fileobj)
+        drawings = []
+        images_count = 0
+        for sheet_number, sheet in enumerate(sheets, start=1):
+            drawing_rel_id = None
+            if sheet._xlsx_images:
+                drawing_number = len(drawings) + 1
+                drawing_rel_id = 'rId1'
+                image_rel_ids = ['rId%d' % n for n in range(1, len(sheet._xlsx_images) + 1)]
+                stream.write('xl/worksheets/_rels/sheet%d.xml.rels' % sheet_number, [self._rels_xml(
+                    [(drawing_rel_id, NS_REL + '/drawing', '../drawings/drawing%d.xml' % drawing_number)])])
+                stream.write('xl/drawings/drawing%d.xml' % drawing_number, [sheet.get_xlsx_drawing_xml(image_rel_ids)])
+                image_rels = []
+                for rel_id, image in zip(image_rel_ids, sheet._xlsx_images):
+                    images_count += 1
+                    image_name = 'image%d.bmp' % images_count
+                    with open(image[0], 'rb') as image_file:
+                        stream.write('xl/media/' + image_name, [image_file.read()])
+                    image_rels.append((rel_id, NS_REL + '/image', '../media/' + image_name))
+                stream.write('xl/drawings/_rels/drawing%d.xml.rels' % drawing_number, [self._rels_xml(image_rels)])
+                drawings.append(drawing_number)
+            for _ in stream.iter_write('xl/worksheets/sheet%d.xml' % sheet_number, sheet.iter_xlsx_xml(drawing_rel_id)):
+                yield
+
+        stream.write('[Content_Types].xml', [self._content_types_xml(len(sheets), drawings, images_count)])
+        stream.write('_rels/.rels', [self._rels_xml([('rId1', NS_REL + '/officeDocument', 'xl/workbook.xml')])])
+        stream.write('xl/workbook.xml', [self._workbook_xml(sheets)])
+        workbook_rels = [('rId%d' % n, NS_REL + '/worksheet', 'worksheets/sheet%d.xml' % n)
+                         for n in range(1, len(sheets) + 1)]
+        workbook_rels.append(('rId%d' % (len(sheets) + 1), NS_REL + '/styles', 'styles.xml'))
+        workbook_rels.append(('rId%d' % (len(sheets) + 2), NS_REL + '/sharedStrings', 'sharedStrings.xml'))
+        stream.write('xl/_rels/workbook.xml.rels', [self._rels_xml(workbook_rels)])
+        stream.write('xl/styles.xml', [self._styles_xml()])
+        for _ in stream.iter_write('xl/sharedStrings.xml', self._iter_shared_strings_xml()):
+            yield
+        stream.close()
+
+    def _rels_xml(self, relationships):
+        return XML_HEADER + '<Relationships xmlns="%s">%s</Relationships>' % (NS_PACKAGE_REL, ''.join(
+            '<Relationship Id="%s" Type="%s" Target="%s"/>' % relationship for relationship in relationships))
+
+    def _content_types_xml(self, sheets_count, drawings, images_count):
+        overrides = [
+            ('/xl/workbook.xml', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml'),
+            ('/xl/styles.xml', 'application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml'),
+            ('/xl/sharedStrings.xml', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml'),
+        ]
+        overrides += [('/xl/worksheets/sheet%d.xml' % n, CONTENT_TYPE_SHEET) for n in range(1, sheets_count + 1)]
+        overrides += [('/xl/drawings/drawing%d.xml' % n, CONTENT_TYPE_DRAWING) for n in drawings]
+        defaults = [('rels', 'application/vnd.openxmlformats-package.relationships+xml'), ('xml', 'application/xml')]
+        if images_count:
+            defaults.append(('bmp', 'image/bmp'))
+        return (XML_HEADER + '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">' +
+                ''.join('<Default Extension="%s" ContentType="%s"/>' % default for default in defaults) +
+                ''.join('<Override PartName="%s" ContentType="%s"/>' % override for override in overrides) +
+                '</Types>')
+
+    def _workbook_xml(self, sheets):
+        return (XML_HEADER + '<workbook xmlns="%s" xmlns:r="%s">' % (NS_MAIN, NS_REL) +
+                '<bookViews><workbookView activeTab="%d"/></bookViews><sheets>' % self.book.get_active_sheet() +
+                ''.join('<sheet name=%s sheetId="%d" r:id="rId%d"/>' % (_xml_attr(sheet.get_name()), n, n)
+                        for n, sheet in enumerate(sheets, start=1)) +
+                '</sheets><calcPr fullCalcOnLoad="1"/></workbook>')
+
+    def _iter_shared_strings_xml(self):
+        sst = self.book._Workbook__sst
+        strings = [None] * (len(sst._str_indexes) + len(sst._rt_indexes))
+        for value, index in sst._str_indexes.iteritems():
+            strings[index] = value
+        for rich_text, index in sst._rt_indexes.iteritems():
+            strings[index] = u''.join(text for text, font_index in rich_text)
+        yield XML_HEADER + '<sst xmlns="%s" count="%d" uniqueCount="%d">' % (NS_MAIN, sst._add_calls, len(strings))
+        pieces = []
+        for value in strings:
+            if value[:1].isspace() or value[-1:].isspace():
+                pieces.append('<si><t xml:space="preserve">%s</t></si>' % _xml_text(value))
+            else:
+                pieces.append('<si><t>%s</t></si>' % _xml_text(value))
+            if len(pieces) >= 1000:
+                yield ''.join(pieces)
+                pieces = []
+        pieces.append('</sst>')
+        yield ''.join(pieces)
+
+    def _styles_xml(self):
+        """styles.xml из таблицы стилей xlwt: индекс XF ячейки xlwt - FIRST_CELL_XF_INDEX = индекс в cellXfs"""
+        styles = self.book._Workbook__styles
+        fonts = dict((font_index, font) for font, font_index in styles._font_id2x.iteritems())
+        font_positions = dict((font_index, position) for position, font_index in enumerate(sorted(fonts)))
+        xfs = dict((xf_index, xf) for xf, xf_index in styles._xf_id2x.iteritems())
+
+        fills, fill_positions = ['<fill><patternFill patternType="none"/></fill>',
+                                 '<fill><patternFill patternType="gray125"/></fill>'], {}
+        borders, border_positions = [], {}
+        cell_xfs = []
+        for xf_index in range(FIRST_CELL_XF_INDEX, max(xfs) + 1):
+            if xf_index not in xfs:
+                cell_xfs.append('<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>')
+                continue
+            font_index, num_format_index, alignment, xf_borders, pattern, protection = xfs[xf_index]
+
+            if pattern.pattern == pattern.NO_PATTERN:
+                fill_id = 0
+            else:
+                key = pattern._search_key()
+                if key not in fill_positions:
+                    fill_positions[key] = len(fills)
+                    fills.append('<fill><patternFill patternType="%s">%s%s</patternFill></fill>' % (
+                        PATTERN_TYPES.get(pattern.pattern, 'solid'),
+                        _colour('fgColor', pattern.pattern_fore_colour),
+                        _colour('bgColor', pattern.pattern_back_colour)))
+                fill_id = fill_positions[key]
+
+            key = xf_borders._search_key()
+            if key not in border_positions:
+                border_positions[key] = len(borders)
+                borders.append('<border>%s<diagonal/></border>' % ''.join(
+                    '<%s style="%s">%s</%s>' % (side, BORDER_STYLES[line], _colour('color', colour), side)
+                    if line in BORDER_STYLES else '<%s/>' % side
+                    for side, line, colour in (
+                        ('left', xf_borders.left, xf_borders.left_colour),
+                        ('right', xf_borders.right, xf_borders.right_colour),
+                        ('top', xf_borders.top, xf_borders.top_colour),
+                        ('bottom', xf_borders.bottom, xf_borders.bottom_colour))))
+            border_id = border_positions[key]
+
+            alignment_attrs = []
+            if alignment.horz in HORIZONTAL_ALIGNMENTS:
+                alignment_attrs.append('horizontal="%s"' % HORIZONTAL_ALIGNMENTS[alignment.horz])
+            if alignment.vert in VERTICAL_ALIGNMENTS:
+                alignment_attrs.append('vertical="%s"' % VERTICAL_ALIGNMENTS[alignment.vert])
+            if alignment.rota:
+                alignment_attrs.append('textRotation="%d"' % alignment.rota)
+            if alignment.wrap:
+                alignment_attrs.append('wrapText="1"')
+            if alignment.inde:
+                alignment_attrs.append('indent="%d"' % alignment.inde)
+            if alignment.shri:
+                alignment_attrs.append('shrinkToFit="1"')
+
+            xf_xml = '<xf numFmtId="%d" fontId="%d" fillId="%d" borderId="%d" xfId="0"' % (
+                num_format_index, font_positions[font_index], fill_id, border_id)
+            xf_xml += ' applyNumberFormat="1" applyFont="1" applyFill="1" applyBorder="1"'
+            if alignment_attrs:
+                xf_xml += ' applyAlignment="1"><alignment %s/></xf>' % ' '.join(alignment_attrs)
+            else:
+                xf_xml += '/>'
+            cell_xfs.append(xf_xml)
+
+        font_xmls = []
+        for font_index in sorted(fonts):
+            font = fonts[font_index]
+            font_xml = '<font>'
+            if font.bold:
+                font_xml += '<b/>'
+            if font.italic:
+                font_xml += '<i/>'
+            if font.struck_out:
+                font_xml += '<strike/>'
+            if font.underline in UNDERLINES:
+                font_xml += '<u val="%s"/>' % UNDERLINES[font.underline]
+            if font.escapement:
+                font_xml += '<vertAlign val="%s"/>' % ('superscript' if font.escapement == 1 else 'subscript')
+            font_xml += '<sz val="%s"/>%s<name val=%s/></font>' % (
+                font.height / 20.0, _colour('color', font.colour_index), _xml_attr(font.name))
+            font_xmls.append(font_xml)
+
+        num_formats = ''.join('<numFmt numFmtId="%d" formatCode=%s/>' % (index, _xml_attr(format_string))
+                              for format_string, index in sorted(styles._num_formats.items(), key=lambda item: item[1])
+                              if index >= 164)
+
+        return (XML_HEADER + '<styleSheet xmlns="%s">' % NS_MAIN +
+                ('<numFmts count="%d">%s</numFmts>' % (num_formats.count('<numFmt '), num_formats)
+                 if num_formats else '') +
+                '<fonts count="%d">%s</fonts>' % (len(font_xmls), ''.join(font_xmls)) +
+                '<fills count="%d">%s</fills>' % (len(fills), ''.join(fills)) +
+                '<borders count="%d">%s</borders>' % (len(borders), ''.join(borders)) +
+                '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>' +
+                '<cellXfs count="%d">%s</cellXfs>' % (len(cell_xfs), ''.join(cell_xfs)) +
+                '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>' +
+                '</styleSheet>')
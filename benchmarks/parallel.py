@@ -0,0 +1,57 @@
+# coding: utf-8
+"""
+Ускорение create_book_parallel в зависимости от количества процессов.
+
+    python benchmarks/parallel.py [количество листов] [строк на листе]
+"""
+import functools
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from awesomepyexcel.core import Book, Field
+from awesomepyexcel.parallel import create_book_parallel
+
+
+def heavy_value(obj):
+    # имитация дорогого вычисляемого значения ячейки
+    value = 0.0
+    for i in xrange(200):
+        value += math.sqrt(obj['amount'] + i)
+    return value
+
+
+class BranchBook(Book):
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Филиал', key='branch'),
+        Field(u'Сумма', key='amount', need_sum=True),
+        Field(u'Показатель', key=heavy_value),
+    ]
+
+
+def branch_data(branch, rows_count):
+    return ({'branch': branch, 'amount': i} for i in xrange(rows_count))
+
+
+def main():
+    sheets_count = int(sys.argv[1]) if len(sys.argv) > 1 else 24
+    rows_count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    sheets = [(u'Филиал %d' % i, functools.partial(branch_data, u'Филиал %d' % i, rows_count))
+              for i in range(sheets_count)]
+
+    base_time = None
+    for processes in range(1, multiprocessing.cpu_count() + 1):
+        start = time.time()
+        create_book_parallel(BranchBook, sheets, processes=processes)
+        elapsed = time.time() - start
+        base_time = base_time or elapsed
+        print('%2d processes: %6.2f s, speedup x%.2f' % (processes, elapsed, base_time / elapsed))
+
+
+if __name__ == '__main__':
+    main()
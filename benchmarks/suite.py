@@ -0,0 +1,268 @@
+# coding: utf-8
+"""
+Производительность формирования книг на разных наборах данных.
+
+    python benchmarks/suite.py [--cases dicts,objects] [--sizes 1k,max] [--save baseline.json]
+                               [--compare baseline.json] [--tolerance 0.15]
+
+Каждый замер выполняется в отдельном процессе, чтобы пиковая память (RSS) относилась только к нему.
+Размеры: 1k - 1000 строк, max - максимум строк на листе .xls, 100k - 100000 строк (в .xlsx,
+на лист .xls столько не помещается).
+С --save результаты сохраняются как базовые, с --compare сравниваются с сохраненными:
+падение скорости или рост памяти больше tolerance считается регрессией (код выхода 1).
+"""
+import json
+import optparse
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from awesomepyexcel.core import Book, Field, BACKEND_XLS, BACKEND_XLSX, HEADER_VERTICAL
+
+SIZES = {
+    '1k': (1000, BACKEND_XLS),
+    'max': (65536 - 2, BACKEND_XLS),  # строка заголовков и итоговая строка
+    '100k': (100000, BACKEND_XLSX),
+}
+
+
+class Client(object):
+    def __init__(self, i):
+        self.fio = u'Клиент %d' % (i % 1000)
+        self.city = City(i)
+
+
+class City(object):
+    def __init__(self, i):
+        self.name = u'Город %d' % (i % 50)
+        self.region = {'code': i % 90}
+
+
+class Order(object):
+    def __init__(self, i):
+        self.number = i
+        self.amount = i * 1.25
+        self.comment = u'Комментарий к заказу номер %d' % i if i % 3 else u''
+        self.client = Client(i)
+
+
+def make_dicts(count):
+    return [{'number': i, 'amount': i * 1.25, 'comment': u'Комментарий к заказу номер %d' % i if i % 3 else u'',
+             'client': u'Клиент %d' % (i % 1000)} for i in xrange(count)]
+
+
+def make_objects(count):
+    return [Order(i) for i in xrange(count)]
+
+
+class DictsBook(Book):
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Номер', key='number'),
+        Field(u'Сумма', key='amount'),
+        Field(u'Комментарий', key='comment'),
+        Field(u'Клиент', key='client'),
+    ]
+
+
+class ObjectsBook(Book):
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Номер', key='number'),
+        Field(u'Сумма', key='amount'),
+        Field(u'Комментарий', key='comment'),
+        Field(u'Клиент', key='client__fio'),
+    ]
+
+
+class LookupsBook(Book):
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Номер', key='number'),
+        Field(u'Клиент', key='client__fio'),
+        Field(u'Город', key='client__city__name'),
+        Field(u'Регион', key='client__city__region__code'),
+    ]
+
+
+class CallablesBook(Book):
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Номер', key=lambda obj: obj['number']),
+        Field(u'Сумма с НДС', key=lambda obj: round(obj['amount'] * 1.2, 2)),
+        Field(u'Длина комментария', key=lambda obj: len(obj['comment'])),
+        Field(u'Клиент', key=lambda obj: obj['client'].upper()),
+    ]
+
+
+class VerticalBook(DictsBook):
+    header_orientation = HEADER_VERTICAL
+    header_height = 2000
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Номер заказа в системе учета', key='number'),
+        Field(u'Сумма заказа с учетом скидки', key='amount'),
+        Field(u'Комментарий', key='comment', header_orientation='horizontal', width=8000),
+        Field(u'Клиент', key='client'),
+    ]
+
+
+class RowHeightsBook(DictsBook):
+    calculate_row_heights = True
+
+
+class FormulasBook(Book):
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Номер', key='number', need_count=u'>0'),
+        Field(u'Сумма', key='amount', need_sum=True),
+        Field(u'Среднее', key='amount', need_average=True),
+        Field(u'Клиент', key='client'),
+    ]
+
+
+class RowFormulasBook(Book):
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Номер', key='number'),
+        Field(u'Сумма', key='amount'),
+        Field(u'Сумма с НДС', row_formula='2col*1.2'),
+        Field(u'Доля', row_formula='IF(1col>0;2col/1col;0)'),
+    ]
+
+
+class TypedBook(Book):
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Номер', key='number', value_type=Field.TYPE_INT),
+        Field(u'Сумма', key='amount', value_type=Field.TYPE_FLOAT),
+        Field(u'Комментарий', key='comment', value_type=Field.TYPE_TEXT),
+        Field(u'Клиент', key='client', value_type=Field.TYPE_TEXT),
+    ]
+
+
+class AggregatesBook(Book):
+    headers = [
+        Field(u'№', is_counter=True),
+        Field(u'Номер', key='number', need_max=True),
+        Field(u'Сумма', key='amount', need_sum=True),
+        Field(u'Комментарий', key='comment', need_count=u'<>'),
+        Field(u'Клиент', key='client'),
+    ]
+
+
+CASES = [
+    ('dicts', DictsBook, make_dicts),
+    ('objects', ObjectsBook, make_objects),
+    ('lookups', LookupsBook, make_objects),
+    ('callables', CallablesBook, make_dicts),
+    ('vertical', VerticalBook, make_dicts),
+    ('row_heights', RowHeightsBook, make_dicts),
+    ('formulas', FormulasBook, make_dicts),
+    ('row_formulas', RowFormulasBook, make_dicts),
+    ('typed', TypedBook, make_dicts),
+    ('aggregates', AggregatesBook, make_dicts),
+]
+
+
+def run_case(case_name, size_name):
+    """
+    Замер одного набора данных. Выполняется в отдельном процессе
+    :return: словарь с результатами
+    """
+    book_class, make_data = [(book_class, make_data) for name, book_class, make_data in CASES
+                             if name == case_name][0]
+    rows_count, backend = SIZES[size_name]
+    data = make_data(rows_count)
+
+    book_class = type(book_class.__name__, (book_class,), {'backend': backend})
+    start = time.time()
+    book = book_class(create=False)
+    sheet = book.add_sheet(book.title)
+    sheet.write_header()
+    header_time = time.time()
+    book.process_data(data, sheet)
+    body_time = time.time()
+    sheet.write_footer()
+    footer_time = time.time()
+    content = book.get_bytes()
+    save_time = time.time()
+
+    return {
+        'rows': rows_count,
+        'backend': backend,
+        'rows_per_sec': rows_count / (save_time - start),
+        'header': header_time - start,
+        'body': body_time - header_time,
+        'footer': footer_time - body_time,
+        'save': save_time - footer_time,
+        'total': save_time - start,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'size': len(content),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: список описаний регрессий
+    """
+    regressions = []
+    for key, result in sorted(results.items()):
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if result['rows_per_sec'] < base['rows_per_sec'] * (1 - tolerance):
+            regressions.append('%s: %.0f rows/s, baseline %.0f rows/s' % (
+                key, result['rows_per_sec'], base['rows_per_sec']))
+        if result['peak_rss_kb'] > base['peak_rss_kb'] * (1 + tolerance):
+            regressions.append('%s: peak RSS %.1f MB, baseline %.1f MB' % (
+                key, result['peak_rss_kb'] / 1024.0, base['peak_rss_kb'] / 1024.0))
+        if result['size'] != base['size']:
+            print('%s: output size %d bytes, baseline %d bytes' % (key, result['size'], base['size']))
+    return regressions
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--cases', default=','.join(name for name, book_class, make_data in CASES))
+    parser.add_option('--sizes', default='1k,max,100k')
+    parser.add_option('--save', help=u'сохранить результаты как базовые в файл')
+    parser.add_option('--compare', help=u'сравнить с базовыми результатами из файла')
+    parser.add_option('--tolerance', type='float', default=0.15)
+    parser.add_option('--run', help=optparse.SUPPRESS_HELP)  # замер в дочернем процессе: case/size
+    options, args = parser.parse_args()
+
+    if options.run:
+        print(json.dumps(run_case(*options.run.split('/'))))
+        return
+
+    results = {}
+    print('%-12s %5s %10s %8s %8s %8s %8s %9s %9s' % (
+        'case', 'size', 'rows/s', 'header', 'body', 'footer', 'save', 'RSS, MB', 'size, KB'))
+    for size_name in options.sizes.split(','):
+        for case_name in options.cases.split(','):
+            key = '%s/%s' % (case_name, size_name)
+            output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--run', key])
+            result = results[key] = json.loads(output)
+            print('%-12s %5s %10.0f %8.3f %8.3f %8.3f %8.3f %9.1f %9.1f' % (
+                case_name, size_name, result['rows_per_sec'], result['header'], result['body'],
+                result['footer'], result['save'], result['peak_rss_kb'] / 1024.0, result['size'] / 1024.0))
+
+    if options.save:
+        with open(options.save, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+    if options.compare:
+        with open(options.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), options.tolerance)
+        for regression in regressions:
+            print('REGRESSION %s' % regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()